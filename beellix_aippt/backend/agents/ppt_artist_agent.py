@@ -1,41 +1,74 @@
 import logging
 
+import config
 from prompts import get_image_enhancer
 from llm.base import BaseLLMClient
+from llm.cache import is_cache_bypassed
+from llm.context import llm_stage
+from llm.replay import is_replay
+from llm.router import ProviderRouter
+from utils.image_saver import ImageIndex, get_image_index
+from utils.metrics import time_stage
+from utils.tracing import span
 
 logger = logging.getLogger(__name__)
 
 FALLBACK_IMAGE_URL = "https://placehold.co/1280x720?text={text}"
+IMAGE_SIZE = "1280*720"
 
 
 class PPTArtistAgent:
     """增强图片提示词并调用图像模型生成配图。"""
 
-    def __init__(self, llm: BaseLLMClient, provider: str):
-        self.llm = llm
-        self.enhance = get_image_enhancer(provider)
+    def __init__(self, router: ProviderRouter):
+        self.router = router
+
+    @staticmethod
+    def _enhance(provider: str, image_prompt: str) -> tuple[str, str]:
+        """按供应商增强提示词，返回 (prompt, negative_prompt)。"""
+        enhanced = get_image_enhancer(provider)(image_prompt)
+
+        # enhance 可能返回 dict(含 negative_prompt) 或纯字符串
+        if isinstance(enhanced, dict):
+            return enhanced["prompt"], enhanced.get("negative_prompt", "")
+        return enhanced, ""
 
     async def generate_image(self, image_prompt: str) -> str:
         """增强提示词并生成图片，返回图片 URL。"""
         logger.info(f"Artist: 为提示词生成图片 '{image_prompt[:60]}...'")
 
-        enhanced = self.enhance(image_prompt)
+        with span("generate_image", cache_hit=False, **{"prompt.chars": len(image_prompt)}) as current:
+            # 任一供应商为相同提示词 + 尺寸生成过图片则直接复用本地图片；录制 / 回放时每张图片都走上游
+            taped = config.REPLAY_MODE or any(is_replay(c["image"]) for c in self.router.clients.values())
+            use_index = config.IMAGE_DEDUP_ENABLED and not is_cache_bypassed() and not taped
+            if use_index:
+                for provider in self.router.providers:
+                    prompt, negative_prompt = self._enhance(provider, image_prompt)
+                    key = ImageIndex.make_key(provider, prompt, negative_prompt, IMAGE_SIZE)
+                    cached = await get_image_index().lookup(key)
+                    if cached:
+                        logger.info(f"Artist: 命中图片缓存 {cached}")
+                        current.set_attributes(provider=provider, cache_hit=True)
+                        return cached
 
-        # enhance 可能返回 dict(含 negative_prompt) 或纯字符串
-        if isinstance(enhanced, dict):
-            prompt = enhanced["prompt"]
-            negative_prompt = enhanced.get("negative_prompt", "")
-            logger.info(f"Artist: 增强后提示词 '{prompt[:80]}...'")
-        else:
-            prompt = enhanced
-            negative_prompt = ""
-            logger.info(f"Artist: 增强后提示词 '{prompt[:80]}...'")
-
-        try:
-            url = await self.llm.generate_image(prompt, negative_prompt=negative_prompt)
-            logger.info("Artist: 图片生成成功")
-            return url
-        except Exception as e:
-            logger.warning(f"Artist: 图片生成失败 ({e})，使用占位图")
-            fallback_text = image_prompt[:50].replace(" ", "+")
-            return FALLBACK_IMAGE_URL.format(text=fallback_text)
\ No newline at end of file
+            async def call(provider: str, llm: BaseLLMClient) -> str:
+                with time_stage("image_enhance", provider, llm.image_model):
+                    prompt, negative_prompt = self._enhance(provider, image_prompt)
+                logger.info(f"Artist: [{provider}] 增强后提示词 '{prompt[:80]}...'")
+                current.set_attributes(provider=provider, **{"prompt.enhanced_chars": len(prompt)})
+                with llm_stage("artist"):
+                    url = await llm.generate_image(prompt, size=IMAGE_SIZE, negative_prompt=negative_prompt)
+                if use_index:
+                    key = ImageIndex.make_key(provider, prompt, negative_prompt, IMAGE_SIZE)
+                    await get_image_index().record(key, url)
+                return url
+
+            try:
+                url = await self.router.run("image", call)
+                logger.info("Artist: 图片生成成功")
+                return url
+            except Exception as e:
+                logger.warning(f"Artist: 图片生成失败 ({e})，使用占位图")
+                current.set_attributes(fallback=True, error=str(e))
+                fallback_text = image_prompt[:50].replace(" ", "+")
+                return FALLBACK_IMAGE_URL.format(text=fallback_text)
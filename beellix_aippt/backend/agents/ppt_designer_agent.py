@@ -1,10 +1,16 @@
 import json
 import logging
+from typing import Awaitable, Callable
 
+import config
 from models import DesignerResult
 from prompts import get_designer_prompts
 from llm.base import BaseLLMClient
-from utils.text import extract_json
+from llm.router import ProviderRouter
+from llm.context import llm_stage, staged_stream
+from utils.metrics import time_stage
+from utils.text import PartialStringField, extract_json
+from utils.tracing import span
 
 logger = logging.getLogger(__name__)
 
@@ -12,19 +18,42 @@ logger = logging.getLogger(__name__)
 class PPTDesignerAgent:
     """为单页幻灯片生成 HTML/CSS 内容。"""
 
-    def __init__(self, llm: BaseLLMClient, provider: str):
-        self.llm = llm
-        self.provider = provider
+    def __init__(self, router: ProviderRouter):
+        self.router = router
 
     async def design_slide(
-        self, metadata: dict, slide_outline: dict, index: int
+        self,
+        metadata: dict,
+        slide_outline: dict,
+        index: int,
+        on_partial: Callable[[str], Awaitable[None]] | None = None,
     ) -> DesignerResult:
+        """设计单页幻灯片。
+
+        传入 on_partial 时改用流式补全，每当 htmlContent 增长足够多就回调一次当前已生成的部分 HTML。
+        当前供应商失败（包括返回无法解析的结果）时由路由切换到其他供应商重新设计。
+        """
         logger.info(f"Designer: 设计第 {index + 1} 页 '{slide_outline['title']}'")
 
-        system_prompt, build_user_prompt = get_designer_prompts(self.provider)
-        user_prompt = build_user_prompt(metadata, slide_outline, index)
+        async def call(provider: str, llm: BaseLLMClient) -> DesignerResult:
+            system_prompt, build_user_prompt = get_designer_prompts(provider)
+            user_prompt = build_user_prompt(metadata, slide_outline, index)
+            current.set_attributes(provider=provider, **{"prompt.chars": len(system_prompt) + len(user_prompt)})
+            if on_partial is None:
+                with llm_stage("designer"):
+                    raw = await llm.chat(system_prompt, user_prompt)
+            else:
+                raw = await self._stream_chat(llm, system_prompt, user_prompt, on_partial)
+            current.set_attribute("response.chars", len(raw))
+            with time_stage("designer_parse", provider, llm.text_model):
+                return self._parse_design(raw, index)
+
+        with span("design_slide", streaming=on_partial is not None, **{"slide.index": index}) as current:
+            result = await self.router.run("text", call)
+        logger.info(f"Designer: 第 {index + 1} 页完成")
+        return result
 
-        raw = await self.llm.chat(system_prompt, user_prompt)
+    def _parse_design(self, raw: str, index: int) -> DesignerResult:
         logger.info(f"Designer 第 {index + 1} 页原始响应长度: {len(raw)} 字符，前 300 字符: {raw[:300]}")
 
         text = extract_json(raw)
@@ -35,7 +64,24 @@ class PPTDesignerAgent:
             logger.error(f"Designer 第 {index + 1} 页 JSON 解析失败: {e}\n响应文本前 500 字符: {text[:500]}")
             raise ValueError(f"第 {index + 1} 页设计 JSON 解析失败: {e}") from e
 
-        result = DesignerResult(**data)
+        return DesignerResult(**data)
 
-        logger.info(f"Designer: 第 {index + 1} 页完成")
-        return result
\ No newline at end of file
+    async def _stream_chat(
+        self,
+        llm: BaseLLMClient,
+        system_prompt: str,
+        user_prompt: str,
+        on_partial: Callable[[str], Awaitable[None]],
+    ) -> str:
+        """流式拉取设计结果，按 STREAM_PARTIAL_MIN_CHARS 节流回调部分 HTML，返回完整原始文本。"""
+        chunks: list[str] = []
+        # 增量提取，每段增量只扫描新到达的文本
+        html = PartialStringField("htmlContent")
+        sent_len = 0
+        async for delta in staged_stream("designer", llm.chat_stream(system_prompt, user_prompt)):
+            chunks.append(delta)
+            html.feed(delta)
+            if len(html) - sent_len >= config.STREAM_PARTIAL_MIN_CHARS:
+                sent_len = len(html)
+                await on_partial(html.value)
+        return "".join(chunks)
@@ -1,28 +1,91 @@
 import json
 import logging
+from typing import AsyncIterator
 
-from models import PlannerResult
+from models import PlannerResult, SlideOutline
 from prompts import get_planner_prompts
 from llm.base import BaseLLMClient
+from llm.router import ProviderRouter
+from llm.context import llm_stage, staged_stream
+from utils.metrics import time_stage
 from utils.text import extract_json
+from utils.json_stream import IncrementalJSONParser
 
 logger = logging.getLogger(__name__)
 
+# 设计 Agent 需要的 deck 级字段，全部到达后即可开始设计幻灯片
+METADATA_FIELDS = ("topic", "title", "visualTheme", "tone", "accentColor")
+
 
 class PPTPlannerAgent:
     """根据主题生成完整的演示文稿大纲。"""
 
-    def __init__(self, llm: BaseLLMClient, provider: str):
-        self.llm = llm
-        self.provider = provider
+    def __init__(self, router: ProviderRouter):
+        self.router = router
 
     async def generate_outline(self, topic: str) -> PlannerResult:
         logger.info(f"Planner: 为主题 '{topic}' 生成大纲")
 
-        system_prompt, user_template = get_planner_prompts(self.provider)
-        user_prompt = user_template.format(topic=topic)
+        async def call(provider: str, llm: BaseLLMClient) -> PlannerResult:
+            system_prompt, user_template = get_planner_prompts(provider)
+            with llm_stage("planner"):
+                raw = await llm.chat(system_prompt, user_template.format(topic=topic))
+            with time_stage("planner_parse", provider, llm.text_model):
+                return self._parse_outline(raw)
+
+        return await self.router.run("text", call)
+
+    async def generate_outline_stream(self, topic: str) -> AsyncIterator[tuple[str, object]]:
+        """流式生成大纲，边接收边增量解析：
+          - ("metadata", dict)         METADATA_FIELDS 全部到达
+          - ("slide", SlideOutline)    某页大纲对象闭合，按页码顺序产出
+          - ("outline", PlannerResult) 完整大纲，以整体解析结果为准
+        """
+        logger.info(f"Planner: 为主题 '{topic}' 流式生成大纲")
+
+        # 最后一次打开流所用的供应商，用于解析阶段的指标标签
+        source = {"provider": "", "model": ""}
+
+        def open_stream(provider: str, llm: BaseLLMClient) -> AsyncIterator[str]:
+            source.update(provider=provider, model=llm.text_model)
+            system_prompt, user_template = get_planner_prompts(provider)
+            return llm.chat_stream(system_prompt, user_template.format(topic=topic))
+
+        parser = IncrementalJSONParser(array_fields={"slides"})
+        fields: dict = {}
+        metadata_sent = False
+        chunks: list[str] = []
+
+        async for delta in staged_stream("planner", self.router.stream("text", open_stream)):
+            chunks.append(delta)
+            try:
+                events = parser.feed(delta)
+            except (json.JSONDecodeError, ValueError) as e:
+                # 增量解析失败不影响结果，等待完整响应后整体解析
+                logger.warning(f"Planner 增量解析失败，回退为整体解析: {e}")
+                parser.done = True
+                continue
+
+            for event in events:
+                if event[0] == "field":
+                    fields[event[1]] = event[2]
+                    if not metadata_sent and all(k in fields for k in METADATA_FIELDS):
+                        metadata_sent = True
+                        yield "metadata", {k: fields[k] for k in METADATA_FIELDS}
+                    continue
+                try:
+                    slide = SlideOutline(**event[3])
+                except ValueError as e:
+                    logger.warning(f"Planner 第 {event[2] + 1} 页大纲不完整，停止增量产出: {e}")
+                    parser.done = True
+                    break
+                yield "slide", slide
+
+        with time_stage("planner_parse", source["provider"], source["model"]):
+            result = self._parse_outline("".join(chunks))
+        yield "outline", result
 
-        raw = await self.llm.chat(system_prompt, user_prompt)
+    def _parse_outline(self, raw: str) -> PlannerResult:
         logger.info(f"Planner 原始响应长度: {len(raw)} 字符，前 300 字符: {raw[:300]}")
 
         text = extract_json(raw)
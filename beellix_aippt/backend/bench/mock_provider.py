@@ -0,0 +1,229 @@
+"""本地模拟上游服务：实现 QwenClient / GeminiClient 用到的 DashScope 与 Gemini 接口子集，
+延迟分布、错误率与响应大小均可配置，用于在没有真实 API Key 的情况下压测后端。
+
+    cd backend
+    uv run python -m bench.mock_provider --port 9100 --text-latency 3 --image-latency 6 --error-rate 0.02
+
+后端通过 QWEN_BASE_URL / GEMINI_BASE_URL 指向该服务（Key 任意非空值即可）。
+"""
+import argparse
+import asyncio
+import base64
+import json
+import math
+import os
+import random
+import re
+import struct
+import zlib
+from collections import Counter
+from dataclasses import dataclass, fields
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+# 设计师提示词中的页码标记（千问 "Design slide #3"、Gemini "Assignment: Slide #3"）
+_SLIDE_RE = re.compile(r"slide #(\d+)", re.IGNORECASE)
+
+
+@dataclass
+class MockSettings:
+    """延迟为对数正态分布的中位数（秒），jitter 为其 σ；0 表示无抖动。"""
+    text_latency: float = 2.0
+    text_ttft: float = 0.5
+    image_latency: float = 4.0
+    download_latency: float = 0.2
+    jitter: float = 0.4
+    # 可重试错误（429 / 500 / 503）的比例，429 带 Retry-After
+    error_rate: float = 0.0
+    retry_after: float = 1.0
+    slides: int = 8
+    html_chars: int = 4000
+    image_kb: int = 400
+    stream_chunks: int = 40
+    seed: int | None = None
+
+
+def _sample(median: float, sigma: float) -> float:
+    if median <= 0:
+        return 0.0
+    return median * math.exp(random.gauss(0, sigma)) if sigma > 0 else median
+
+
+def _png(size_bytes: int, width: int = 1280) -> bytes:
+    """随机像素的 RGB PNG，不可压缩，文件大小约为 size_bytes。"""
+    height = max(1, size_bytes // (width * 3))
+    row = width * 3
+    noise = os.urandom(row * height)
+    raw = b"".join(b"\x00" + noise[i * row:(i + 1) * row] for i in range(height))
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw, 0)) + chunk(b"IEND", b"")
+
+
+def _outline(settings: MockSettings, topic: str) -> str:
+    return json.dumps({
+        "topic": topic,
+        "title": f"{topic}：基准测试演示文稿",
+        "subtitle": "模拟上游生成",
+        "targetAudience": "性能工程师",
+        "presentationGoal": "测量生成流水线的吞吐与延迟",
+        "tone": "professional",
+        "visualTheme": "dark tech",
+        "accentColor": "#4F8CFF",
+        "researchContext": "由本地模拟服务生成的占位内容。" * 4,
+        "slides": [
+            {"title": f"第 {i + 1} 部分", "purpose": "说明要点", "visualAdvice": "抽象几何背景，冷色调"}
+            for i in range(settings.slides)
+        ],
+    }, ensure_ascii=False)
+
+
+def _design(settings: MockSettings, index: int) -> str:
+    card = (
+        '<div style="padding:24px;margin:12px;border-radius:16px;background:rgba(255,255,255,0.08);'
+        'backdrop-filter:blur(12px);color:#fff;text-shadow:0 2px 8px rgba(0,0,0,0.5)">'
+        f"<h3>要点 {index + 1}</h3><p>模拟设计内容，用于填充 HTML 体积。</p></div>"
+    )
+    body = card * max(1, settings.html_chars // len(card))
+    html = (
+        '<div style="position:relative;width:1280px;height:720px;overflow:hidden;'
+        "background:url('__SLIDE_IMAGE__') center/cover\">"
+        f'<h1 style="color:#fff;font-size:48px">第 {index + 1} 页</h1>{body}</div>'
+    )
+    return json.dumps({
+        "title": f"第 {index + 1} 页",
+        "subtitle": "模拟设计",
+        "content": ["要点一", "要点二", "要点三"],
+        "imagePrompt": f"abstract geometric background for slide {index + 1}",
+        "htmlContent": html,
+        "designDirective": "glassmorphism cards",
+        "stats": [{"value": "42%", "label": "示例指标"}],
+    }, ensure_ascii=False)
+
+
+def create_app(settings: MockSettings) -> FastAPI:
+    if settings.seed is not None:
+        random.seed(settings.seed)
+    app = FastAPI(title="Beellix mock provider")
+    stats: Counter = Counter()
+
+    def completion(user_prompt: str) -> str:
+        match = _SLIDE_RE.search(user_prompt)
+        if match:
+            return _design(settings, int(match.group(1)) - 1)
+        topic = re.search(r'"([^"]+)"', user_prompt)
+        return _outline(settings, topic.group(1) if topic else "基准测试")
+
+    async def maybe_fail(route: str) -> Response | None:
+        """按 error_rate 注入可重试错误。"""
+        if random.random() >= settings.error_rate:
+            return None
+        stats[f"{route}:error"] += 1
+        await asyncio.sleep(_sample(settings.text_ttft, settings.jitter) / 2)
+        status = random.choice([429, 500, 503])
+        headers = {"Retry-After": str(settings.retry_after)} if status == 429 else {}
+        return JSONResponse({"error": {"message": "mock upstream error"}}, status_code=status, headers=headers)
+
+    async def sse(chunks: list[str], encode, done_marker: bool) -> StreamingResponse:
+        """先等待首 token 延迟，再把剩余延迟均摊到各段之间。OpenAI 兼容流以 [DONE] 结尾，Gemini 流没有结束标记。"""
+        ttft = _sample(settings.text_ttft, settings.jitter)
+        rest = max(0.0, _sample(settings.text_latency, settings.jitter) - ttft)
+
+        async def body():
+            await asyncio.sleep(ttft)
+            for i, chunk in enumerate(chunks):
+                if i:
+                    await asyncio.sleep(rest / len(chunks))
+                yield f"data: {json.dumps(encode(chunk), ensure_ascii=False)}\n\n"
+            if done_marker:
+                yield "data: [DONE]\n\n"
+
+        return StreamingResponse(body(), media_type="text/event-stream")
+
+    def split(text: str) -> list[str]:
+        size = max(1, math.ceil(len(text) / max(1, settings.stream_chunks)))
+        return [text[i:i + size] for i in range(0, len(text), size)]
+
+    # --- DashScope ---
+
+    @app.post("/compatible-mode/v1/chat/completions")
+    async def qwen_chat(request: Request):
+        stats["qwen:chat"] += 1
+        if failure := await maybe_fail("qwen:chat"):
+            return failure
+        payload = await request.json()
+        text = completion(payload["messages"][-1]["content"])
+        if payload.get("stream"):
+            return await sse(split(text), lambda c: {"choices": [{"delta": {"content": c}}]}, True)
+        await asyncio.sleep(_sample(settings.text_latency, settings.jitter))
+        return {"choices": [{"message": {"role": "assistant", "content": text}}]}
+
+    @app.post("/api/v1/services/aigc/multimodal-generation/generation")
+    async def qwen_image(request: Request):
+        stats["qwen:image"] += 1
+        if failure := await maybe_fail("qwen:image"):
+            return failure
+        await asyncio.sleep(_sample(settings.image_latency, settings.jitter))
+        name = os.urandom(8).hex()
+        url = f"{str(request.base_url).rstrip('/')}/mock-images/{name}.png"
+        return {"output": {"choices": [{"message": {"content": [{"image": url}]}}]}}
+
+    @app.get("/mock-images/{name}")
+    async def image_file(name: str):
+        stats["image:download"] += 1
+        await asyncio.sleep(_sample(settings.download_latency, settings.jitter))
+        return Response(_png(settings.image_kb * 1024), media_type="image/png")
+
+    # --- Gemini ---
+
+    @app.post("/v1beta/models/{target}")
+    async def gemini(target: str, request: Request):
+        model, _, action = target.partition(":")
+        route = "gemini:image" if "image" in model else "gemini:chat"
+        stats[route] += 1
+        if failure := await maybe_fail(route):
+            return failure
+        payload = await request.json()
+        prompt = payload["contents"][-1]["parts"][0]["text"]
+
+        if route == "gemini:image":
+            await asyncio.sleep(_sample(settings.image_latency, settings.jitter))
+            data = base64.b64encode(_png(settings.image_kb * 1024)).decode()
+            return {"candidates": [{"content": {"parts": [{"inlineData": {"mimeType": "image/png", "data": data}}]}}]}
+
+        text = completion(prompt)
+        if action == "streamGenerateContent":
+            return await sse(split(text), lambda c: {"candidates": [{"content": {"parts": [{"text": c}]}}]}, False)
+        await asyncio.sleep(_sample(settings.text_latency, settings.jitter))
+        return {"candidates": [{"content": {"parts": [{"text": text}]}}]}
+
+    @app.get("/stats")
+    async def get_stats():
+        """各路由收到的请求数与注入的错误数。"""
+        return dict(stats)
+
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Beellix 本地模拟上游服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    defaults = MockSettings()
+    for f in fields(MockSettings):
+        kind = int if f.name == "seed" else type(getattr(defaults, f.name))
+        parser.add_argument(f"--{f.name.replace('_', '-')}", type=kind, default=getattr(defaults, f.name))
+    args = parser.parse_args()
+
+    import uvicorn
+
+    settings = MockSettings(**{f.name: getattr(args, f.name) for f in fields(MockSettings)})
+    uvicorn.run(create_app(settings), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
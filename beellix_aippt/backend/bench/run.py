@@ -0,0 +1,455 @@
+"""端到端性能基准：启动本地模拟上游与后端，用 N 个并发客户端驱动 /ws/generate 与 /api/export/pdf。
+
+    cd backend
+    uv run --extra bench python -m bench.run --clients 8 --decks 3 --json bench-result.json
+    # 与基线比较，退化时退出码为 1
+    uv run --extra bench python -m bench.run --clients 8 --decks 3 --baseline bench-result.json
+
+需要安装可选依赖 bench（WebSocket 客户端）：uv sync --extra bench
+
+报告：deck 吞吐、首页耗时（time-to-first-slide）、整份 deck 耗时、PDF 导出耗时，
+各阶段 p50 / p95 / p99（取自后端 /metrics 的直方图），以及后端进程树的峰值 RSS。
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field, fields
+from pathlib import Path
+
+import httpx
+import websockets
+
+from bench.mock_provider import MockSettings
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+QUANTILES = (0.5, 0.95, 0.99)
+
+# 与基线比较时数值越大越好的指标（其余指标越小越好）
+_HIGHER_IS_BETTER = {"throughput.decks_per_min"}
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def quantiles(samples: list[float]) -> dict:
+    """样本的 p50 / p95 / p99（最近秩法），单位与样本相同。"""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    result = {f"p{round(q * 100)}": ordered[min(len(ordered) - 1, math.ceil(q * len(ordered)) - 1)] for q in QUANTILES}
+    result["count"] = len(ordered)
+    return result
+
+
+# --- /metrics 解析 ---
+
+_SAMPLE_RE = re.compile(r'^(\w+)\{(.*)\} (\S+)$')
+_LABEL_RE = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def parse_histograms(text: str, name: str) -> dict[tuple, dict[float, float]]:
+    """解析 Prometheus 文本中某个直方图的累积桶：{除 le 外的标签元组: {上界: 累积计数}}。"""
+    series: dict[tuple, dict[float, float]] = {}
+    for line in text.splitlines():
+        match = _SAMPLE_RE.match(line)
+        if not match or match.group(1) != f"{name}_bucket":
+            continue
+        labels = dict(_LABEL_RE.findall(match.group(2)))
+        le = float(labels.pop("le").replace("+Inf", "inf"))
+        series.setdefault(tuple(sorted(labels.items())), {})[le] = float(match.group(3))
+    return series
+
+
+def histogram_quantile(q: float, buckets: dict[float, float]) -> float | None:
+    """与 PromQL histogram_quantile 相同的桶内线性插值。"""
+    bounds = sorted(buckets)
+    total = buckets[bounds[-1]] if bounds else 0
+    if total <= 0:
+        return None
+    rank = q * total
+    previous_bound, previous_count = 0.0, 0.0
+    for bound in bounds:
+        count = buckets[bound]
+        if count >= rank:
+            if math.isinf(bound):
+                return previous_bound
+            if count == previous_count:
+                return bound
+            return previous_bound + (bound - previous_bound) * (rank - previous_count) / (count - previous_count)
+        previous_bound, previous_count = bound, count
+    return previous_bound
+
+
+def histogram_report(before: str, after: str, name: str, key_labels: tuple[str, ...]) -> dict:
+    """两次抓取之间直方图增量的分位数（毫秒），按 key_labels 分组。"""
+    start = parse_histograms(before, name)
+    report = {}
+    for labels, buckets in sorted(parse_histograms(after, name).items()):
+        base = start.get(labels, {})
+        delta = {le: count - base.get(le, 0) for le, count in buckets.items()}
+        if not delta or max(delta.values()) <= 0:
+            continue
+        label_map = dict(labels)
+        key = "/".join(label_map.get(k, "") or "-" for k in key_labels)
+        stats = {f"p{round(q * 100)}": round(histogram_quantile(q, delta) * 1000, 1) for q in QUANTILES}
+        stats["count"] = int(max(delta.values()))
+        report[key] = stats
+    return report
+
+
+# --- 峰值 RSS ---
+
+class RSSSampler:
+    """定期采样进程树（后端 + 其 Playwright 浏览器等子进程）的 RSS 总和，记录峰值。
+
+    依赖 /proc（Linux）；不可用时退化为子进程结束后的 ru_maxrss（单个进程的峰值）。
+    """
+
+    def __init__(self, pid: int, interval: float = 0.25):
+        self.pid = pid
+        self.interval = interval
+        self.peak_tree_kb = 0
+        self.available = Path("/proc").is_dir()
+        self._task: asyncio.Task | None = None
+
+    @staticmethod
+    def _children() -> dict[int, list[int]]:
+        tree: dict[int, list[int]] = {}
+        for entry in Path("/proc").iterdir():
+            if not entry.name.isdigit():
+                continue
+            try:
+                ppid = int((entry / "stat").read_text().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            tree.setdefault(ppid, []).append(int(entry.name))
+        return tree
+
+    @staticmethod
+    def _status_kb(pid: int, field_name: str) -> int:
+        try:
+            for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+                if line.startswith(field_name + ":"):
+                    return int(line.split()[1])
+        except OSError:
+            pass
+        return 0
+
+    def sample(self) -> None:
+        tree = self._children()
+        pids, stack = [], [self.pid]
+        while stack:
+            pid = stack.pop()
+            pids.append(pid)
+            stack.extend(tree.get(pid, []))
+        self.peak_tree_kb = max(self.peak_tree_kb, sum(self._status_kb(pid, "VmRSS") for pid in pids))
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.to_thread(self.sample)
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self.available:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> dict:
+        result = {}
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            result["backend_mb"] = round(self._status_kb(self.pid, "VmHWM") / 1024, 1)
+            result["process_tree_mb"] = round(self.peak_tree_kb / 1024, 1)
+        return result
+
+
+# --- 客户端 ---
+
+@dataclass
+class DeckResult:
+    ok: bool
+    seconds: float
+    first_slide: float | None = None
+    slides: list[dict] = field(default_factory=list)
+    title: str = ""
+    error: str = ""
+
+
+async def run_deck(ws_url: str, topic: str, provider: str) -> DeckResult:
+    """通过 WebSocket 生成一份 deck，记录首页与完成耗时。"""
+    start = time.perf_counter()
+    first_slide = None
+    slides: list[dict] = []
+    title = ""
+    try:
+        async with websockets.connect(ws_url, max_size=None, open_timeout=30) as ws:
+            await ws.send(json.dumps({"action": "generate", "topic": topic, "provider": provider, "noCache": True}))
+            async for raw in ws:
+                event = json.loads(raw)
+                kind, data = event["event"], event.get("data", {})
+                if kind == "outline":
+                    title = data.get("title", "")
+                elif kind == "slide":
+                    if first_slide is None:
+                        first_slide = time.perf_counter() - start
+                    slides.append(data)
+                elif kind == "done":
+                    return DeckResult(True, time.perf_counter() - start, first_slide, slides, title)
+                elif kind == "error" and "slideIndex" not in data:
+                    return DeckResult(False, time.perf_counter() - start, first_slide, slides, title, data.get("message", ""))
+    except Exception as e:
+        return DeckResult(False, time.perf_counter() - start, first_slide, slides, title, str(e))
+    return DeckResult(False, time.perf_counter() - start, first_slide, slides, title, "连接提前关闭")
+
+
+async def export_pdf(client: httpx.AsyncClient, base_url: str, deck: DeckResult) -> tuple[bool, float, int]:
+    slides = [{"html": s["finalHtml"], "imageUrl": s.get("imageUrl", "")} for s in sorted(deck.slides, key=lambda s: s["index"])]
+    start = time.perf_counter()
+    try:
+        response = await client.post(f"{base_url}/api/export/pdf", json={"slides": slides, "title": deck.title or "bench"})
+        return response.status_code == 200, time.perf_counter() - start, len(response.content)
+    except httpx.HTTPError:
+        return False, time.perf_counter() - start, 0
+
+
+# --- 进程管理 ---
+
+async def wait_ready(url: str, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while True:
+            try:
+                if (await client.get(url, timeout=2)).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"等待服务就绪超时: {url}")
+            await asyncio.sleep(0.2)
+
+
+def spawn_mock(args, port: int) -> subprocess.Popen:
+    command = [sys.executable, "-m", "bench.mock_provider", "--port", str(port)]
+    for f in fields(MockSettings):
+        value = getattr(args, f"mock_{f.name}")
+        if value is not None:
+            command += [f"--{f.name.replace('_', '-')}", str(value)]
+    return subprocess.Popen(command, cwd=BACKEND_DIR)
+
+
+def spawn_backend(args, port: int, mock_url: str, workdir: str) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "QWEN_API_KEY": "mock",
+        "GEMINI_API_KEY": "mock",
+        "QWEN_BASE_URL": mock_url,
+        "GEMINI_BASE_URL": mock_url,
+        # 模拟服务是明文 HTTP，且每次都要真实走完流水线
+        "HTTP2_ENABLED": "false",
+        "ROUTING_ENABLED": "false",
+        "LLM_CACHE_ENABLED": "false",
+        "IMAGE_DEDUP_ENABLED": "false",
+        "JOB_BACKEND": "memory",
+        "IMAGES_DIR": f"{workdir}/images",
+        "LLM_CACHE_PATH": f"{workdir}/llm_cache.sqlite3",
+        "IMAGE_INDEX_PATH": f"{workdir}/image_index.sqlite3",
+        "JOBS_DB_PATH": f"{workdir}/jobs.sqlite3",
+    }
+    if not args.keep_rate_limits:
+        # 默认不限流，测量的是后端自身的开销与并发能力
+        for prefix in ("QWEN_TEXT", "QWEN_IMAGE", "GEMINI_TEXT", "GEMINI_IMAGE"):
+            for suffix in ("RPM", "TPM", "MAX_INFLIGHT"):
+                env.setdefault(f"{prefix}_{suffix}", "0")
+    command = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+    return subprocess.Popen(command, cwd=BACKEND_DIR, env=env)
+
+
+def stop(process: subprocess.Popen) -> None:
+    process.terminate()
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+# --- 报告 ---
+
+def _flatten(report: dict, prefix: str = "") -> dict[str, float]:
+    flat = {}
+    for key, value in report.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(_flatten(value, path))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    """返回相对基线退化超过 tolerance 的指标（p95 / p99、吞吐与峰值内存）。"""
+    current, previous = _flatten(report), _flatten(baseline)
+    regressions = []
+    for path, old in previous.items():
+        new = current.get(path)
+        if new is None or not old:
+            continue
+        tracked = path.endswith((".p95", ".p99")) or path.startswith("peak_rss.") or path in _HIGHER_IS_BETTER
+        if not tracked:
+            continue
+        change = (old - new) / old if path in _HIGHER_IS_BETTER else (new - old) / old
+        if change > tolerance:
+            regressions.append(f"{path}: {old} → {new} ({change:+.0%})")
+    return regressions
+
+
+def print_report(report: dict) -> None:
+    def table(title: str, rows: dict) -> None:
+        if not rows:
+            return
+        print(f"\n{title}")
+        print(f"  {'':<40}{'p50':>10}{'p95':>10}{'p99':>10}{'n':>8}")
+        for name, stats in rows.items():
+            print(f"  {name:<40}{stats['p50']:>10}{stats['p95']:>10}{stats['p99']:>10}{stats['count']:>8}")
+
+    run = report["run"]
+    print(f"\n并发客户端 {run['clients']}，每客户端 {run['decks_per_client']} 份，每份 {run['slides']} 页，提供方 {run['provider']}")
+    t = report["throughput"]
+    print(f"完成 {t['decks_ok']}/{t['decks']} 份 deck，用时 {t['seconds']}s，吞吐 {t['decks_per_min']} 份/分钟")
+    for error in report.get("errors", [])[:5]:
+        print(f"  失败: {error}")
+    table("客户端耗时 (ms)", report["client"])
+    table("阶段耗时 (ms，stage/provider)", report["stages"])
+    table("调度器排队 (ms，provider/op)", report["scheduler_wait"])
+    if report.get("peak_rss"):
+        rss = report["peak_rss"]
+        print(f"\n峰值 RSS: " + "，".join(f"{k} {v} MB" for k, v in rss.items()))
+    print(f"\n模拟上游请求数: {report['upstream']}")
+
+
+async def benchmark(args) -> dict:
+    mock_port, port = _free_port(), _free_port()
+    mock_url, base_url = f"http://127.0.0.1:{mock_port}", f"http://127.0.0.1:{port}"
+    workdir = tempfile.mkdtemp(prefix="beellix-bench-")
+    mock = spawn_mock(args, mock_port)
+    backend = spawn_backend(args, port, mock_url, workdir)
+    sampler = RSSSampler(backend.pid)
+    try:
+        await wait_ready(f"{mock_url}/stats")
+        await wait_ready(f"{base_url}/api/health")
+        async with httpx.AsyncClient(timeout=600) as http:
+            metrics_before = (await http.get(f"{base_url}/metrics")).text
+            sampler.start()
+
+            ws_url = f"ws://127.0.0.1:{port}/ws/generate"
+            start = time.perf_counter()
+
+            async def client(index: int) -> list[DeckResult]:
+                return [await run_deck(ws_url, f"基准测试主题 {index}-{n}", args.provider) for n in range(args.decks)]
+
+            decks = [deck for batch in await asyncio.gather(*(client(i) for i in range(args.clients))) for deck in batch]
+            elapsed = time.perf_counter() - start
+
+            pdf_times: list[float] = []
+            pdf_failures = 0
+            if args.pdf_exports:
+                exportable = [deck for deck in decks if deck.ok and deck.slides][:args.pdf_exports]
+                gate = asyncio.Semaphore(args.clients)
+
+                async def one(deck: DeckResult) -> None:
+                    nonlocal pdf_failures
+                    async with gate:
+                        ok, seconds, _ = await export_pdf(http, base_url, deck)
+                    if ok:
+                        pdf_times.append(seconds)
+                    else:
+                        pdf_failures += 1
+
+                await asyncio.gather(*(one(deck) for deck in exportable))
+
+            metrics_after = (await http.get(f"{base_url}/metrics")).text
+            upstream = (await http.get(f"{mock_url}/stats")).json()
+        peak_rss = await sampler.stop()
+    finally:
+        stop(backend)
+        stop(mock)
+    if not peak_rss:
+        import resource  # 仅 Unix 可用
+
+        peak_rss = {"max_child_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)}
+
+    ok = [deck for deck in decks if deck.ok]
+    ms = lambda values: {k: round(v * 1000, 1) if k != "count" else v for k, v in quantiles(values).items()}
+    client_stats = {
+        "time_to_first_slide": ms([d.first_slide for d in decks if d.first_slide is not None]),
+        "deck": ms([d.seconds for d in ok]),
+        "pdf_export": ms(pdf_times),
+    }
+    return {
+        "run": {
+            "clients": args.clients,
+            "decks_per_client": args.decks,
+            "slides": args.mock_slides or MockSettings.slides,
+            "provider": args.provider,
+        },
+        "throughput": {
+            "decks": len(decks),
+            "decks_ok": len(ok),
+            "seconds": round(elapsed, 2),
+            "decks_per_min": round(len(ok) / elapsed * 60, 2) if elapsed else 0,
+            "pdf_failures": pdf_failures,
+        },
+        "client": {name: stats for name, stats in client_stats.items() if stats},
+        "stages": histogram_report(metrics_before, metrics_after, "beellix_stage_duration_seconds", ("stage", "provider")),
+        "scheduler_wait": histogram_report(metrics_before, metrics_after, "beellix_scheduler_wait_seconds", ("provider", "op")),
+        "peak_rss": peak_rss,
+        "upstream": upstream,
+        "errors": [deck.error for deck in decks if not deck.ok],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Beellix 端到端性能基准")
+    parser.add_argument("--clients", type=int, default=4, help="并发 WebSocket 客户端数")
+    parser.add_argument("--decks", type=int, default=2, help="每个客户端依次生成的 deck 数")
+    parser.add_argument("--provider", choices=["qwen", "gemini"], default="qwen")
+    parser.add_argument("--pdf-exports", type=int, default=None, help="导出 PDF 的 deck 数（默认等于客户端数，0 跳过）")
+    parser.add_argument("--keep-rate-limits", action="store_true", help="保留配置中的 RPM / TPM / 并发上限")
+    parser.add_argument("--json", help="把报告写入该 JSON 文件")
+    parser.add_argument("--baseline", help="与该 JSON 报告比较，p95 / p99、吞吐或峰值内存退化超过阈值时退出码为 1")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="允许的退化比例")
+    group = parser.add_argument_group("模拟上游（默认值见 bench/mock_provider.py）")
+    for f in fields(MockSettings):
+        kind = int if f.name in ("slides", "html_chars", "image_kb", "stream_chunks", "seed") else float
+        group.add_argument(f"--mock-{f.name.replace('_', '-')}", dest=f"mock_{f.name}", type=kind, default=None)
+    args = parser.parse_args()
+    if args.pdf_exports is None:
+        args.pdf_exports = args.clients
+
+    report = asyncio.run(benchmark(args))
+    print_report(report)
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    if args.baseline:
+        regressions = compare(report, json.loads(Path(args.baseline).read_text(encoding="utf-8")), args.max_regression)
+        if regressions:
+            print("\n相对基线的退化：")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\n与基线相比没有超过阈值的退化")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,12 +7,159 @@ load_dotenv()
 QWEN_API_KEY = os.getenv("QWEN_API_KEY", "")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
 
+# 上游 API 地址；压测时可指向本地模拟服务（见 bench/mock_provider.py）
+QWEN_BASE_URL = os.getenv("QWEN_BASE_URL", "https://dashscope.aliyuncs.com").rstrip("/")
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com").rstrip("/")
+
 # 模型注册表
 QWEN_TEXT_MODEL = "qwen3-max"
 QWEN_IMAGE_MODEL = "qwen-image-max"
 GEMINI_TEXT_MODEL = "gemini-3-pro-preview"
 GEMINI_IMAGE_MODEL = "gemini-3-pro-image-preview"
 
+# 生成流水线：同时进行设计 + 配图的幻灯片数量（1 表示逐页串行）
+SLIDE_CONCURRENCY = int(os.getenv("SLIDE_CONCURRENCY", "4"))
+# slide 事件推送顺序："completion" 按完成先后推送，"ordered" 严格按页码顺序推送
+SLIDE_EVENT_ORDER = os.getenv("SLIDE_EVENT_ORDER", "completion")
+# 本 worker 上所有任务同时进行设计 + 配图的幻灯片总数（0 表示不限制），各任务按权重公平分配
+SLIDE_GLOBAL_CONCURRENCY = int(os.getenv("SLIDE_GLOBAL_CONCURRENCY", "16"))
+# 交互式任务相对批量任务的槽位权重
+INTERACTIVE_SHARE_WEIGHT = float(os.getenv("INTERACTIVE_SHARE_WEIGHT", "4"))
+# 设计阶段是否流式推送 slide_partial 事件，以及两次推送之间 HTML 至少增长的字符数
+STREAM_PARTIAL_SLIDES = os.getenv("STREAM_PARTIAL_SLIDES", "true").lower() == "true"
+STREAM_PARTIAL_MIN_CHARS = int(os.getenv("STREAM_PARTIAL_MIN_CHARS", "200"))
+
+# 上游 HTTP 连接池：每个上游主机一个长连接客户端
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() == "true"
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+# 各阶段超时（秒）；read 超时由调用方按操作类型（对话 / 图片 / 下载）单独指定
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_WRITE_TIMEOUT = float(os.getenv("HTTP_WRITE_TIMEOUT", "30"))
+HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", "30"))
+
+# 规划 / 设计 LLM 响应的持久化缓存
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "cache/llm_cache.sqlite3")
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_MB = int(os.getenv("LLM_CACHE_MAX_MB", "256"))
+# 图片去重索引：(provider, 增强提示词, 负向提示词, 尺寸) → 内容寻址图片
+IMAGE_DEDUP_ENABLED = os.getenv("IMAGE_DEDUP_ENABLED", "true").lower() == "true"
+IMAGE_INDEX_PATH = os.getenv("IMAGE_INDEX_PATH", "cache/image_index.sqlite3")
+
+# 部署的 worker 进程数（uvicorn --workers），进程级限流配额按此均分
+WORKERS = max(1, int(os.getenv("WORKERS", "1")))
+
+
+def _rate_limit(prefix: str, rpm: int, tpm: int, inflight: int) -> dict:
+    """读取 {prefix}_RPM / _TPM / _MAX_INFLIGHT 环境变量（整个部署的总配额），0 表示不限制。
+
+    调度器是进程级的，返回的是均分到单个 worker 的配额。
+    """
+    def per_worker(name: str, default: int) -> int:
+        total = int(os.getenv(f"{prefix}_{name}", str(default)))
+        return max(1, total // WORKERS) if total else 0
+
+    return {
+        "rpm": per_worker("RPM", rpm),
+        "tpm": per_worker("TPM", tpm),
+        "inflight": per_worker("MAX_INFLIGHT", inflight),
+    }
+
+
+# 进程级上游调度：(provider, 操作类型) → 每分钟请求数 / 每分钟 token 数 / 最大并发
+RATE_LIMITS = {
+    ("qwen", "text"): _rate_limit("QWEN_TEXT", rpm=60, tpm=1_000_000, inflight=8),
+    ("qwen", "image"): _rate_limit("QWEN_IMAGE", rpm=30, tpm=0, inflight=4),
+    ("gemini", "text"): _rate_limit("GEMINI_TEXT", rpm=60, tpm=1_000_000, inflight=8),
+    ("gemini", "image"): _rate_limit("GEMINI_IMAGE", rpm=20, tpm=0, inflight=4),
+}
+# 优先级调度：交互式会话的规划与靠前页面先于靠后页面与批量任务放行
+PRIORITY_ENABLED = os.getenv("PRIORITY_ENABLED", "true").lower() == "true"
+# 老化速率：每排队这么多秒，调用的优先级提升一级
+PRIORITY_AGING_SECONDS = float(os.getenv("PRIORITY_AGING_SECONDS", "2"))
+# 批量任务相对交互式会话降低的优先级级数
+PRIORITY_BATCH_OFFSET = int(os.getenv("PRIORITY_BATCH_OFFSET", "10"))
+# TPM 估算时每次对话预计输出的 token 数
+LLM_EST_OUTPUT_TOKENS = int(os.getenv("LLM_EST_OUTPUT_TOKENS", "2000"))
+# 429 / 5xx / 连接错误的重试次数与退避区间（秒）
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "1"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "30"))
+
+# 对冲请求（默认关闭）：耗时超过该阶段近期延迟的 HEDGE_PERCENTILE 分位时再发一个相同请求
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false").lower() == "true"
+HEDGE_OPS = {op.strip() for op in os.getenv("HEDGE_OPS", "text,image").split(",") if op.strip()}
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+# 每个阶段至少积累多少个延迟样本后才开始对冲
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+# 对冲预算：对冲请求数至多为主请求数的 RATIO 倍，BURST 为可累积的对冲次数上限
+HEDGE_BUDGET_RATIO = float(os.getenv("HEDGE_BUDGET_RATIO", "0.1"))
+HEDGE_BUDGET_BURST = float(os.getenv("HEDGE_BUDGET_BURST", "5"))
+
+# 链路追踪导出："jsonl"（追加写本地文件）/ "otlp"（OTLP/HTTP JSON 收集器），留空关闭
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "").lower()
+TRACE_JSONL_PATH = os.getenv("TRACE_JSONL_PATH", "traces/spans.jsonl")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "beellix-aippt")
+# 后台导出线程每批最多导出的 span 数与空闲时的轮询间隔（秒）
+TRACE_BATCH_SIZE = int(os.getenv("TRACE_BATCH_SIZE", "256"))
+TRACE_FLUSH_INTERVAL = float(os.getenv("TRACE_FLUSH_INTERVAL", "1"))
+
+# 录制 / 回放：record 时把上游请求与响应（含图片）写入录制文件，replay 时不访问网络、从录制文件返回
+REPLAY_MODE = os.getenv("REPLAY_MODE", "").lower()
+REPLAY_CASSETTE = os.getenv("REPLAY_CASSETTE", "cassettes/default")
+# 回放速度：0 为立即返回，1 按录制时的耗时等待，2 为两倍速
+REPLAY_SPEED = float(os.getenv("REPLAY_SPEED", "0"))
+
+# PDF 导出：常驻浏览器数、同时进行的导出数（共享这些浏览器）、每个浏览器借出多少次后换新（0 不换）、空闲时健康检查间隔（秒）
+PDF_BROWSERS = max(1, int(os.getenv("PDF_BROWSERS", "2")))
+PDF_CONCURRENCY = max(1, int(os.getenv("PDF_CONCURRENCY", "8")))
+PDF_BROWSER_MAX_RENDERS = int(os.getenv("PDF_BROWSER_MAX_RENDERS", "100"))
+PDF_BROWSER_HEALTH_INTERVAL = float(os.getenv("PDF_BROWSER_HEALTH_INTERVAL", "30"))
+# 单次导出内同时渲染的页面数
+PDF_PAGE_FANOUT = max(1, int(os.getenv("PDF_PAGE_FANOUT", "6")))
+# 每页等待渲染就绪（字体、图片解码、动画）的上限（秒），超时按当前画面截图
+PDF_READY_TIMEOUT = float(os.getenv("PDF_READY_TIMEOUT", "5"))
+# 截图模式的默认页面图像（可被导出请求覆盖）：编码 png / jpeg / auto（按页面内容选择）、JPEG 质量、截图缩放 1 / 1.5 / 2
+PDF_IMAGE_FORMAT = os.getenv("PDF_IMAGE_FORMAT", "png").lower()
+PDF_IMAGE_QUALITY = int(os.getenv("PDF_IMAGE_QUALITY", "85"))
+PDF_IMAGE_SCALE = float(os.getenv("PDF_IMAGE_SCALE", "2"))
+
+# 生成图片目录；多机部署时指向共享存储
+IMAGES_DIR = os.getenv("IMAGES_DIR", "generated_images")
+
+# 生成任务后端："memory"（单进程开发）/ "sqlite"（单机多 worker）/ "redis"（Redis 兼容服务，可跨机器）
+JOB_BACKEND = os.getenv("JOB_BACKEND", "sqlite")
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "cache/jobs.sqlite3")
+JOB_REDIS_URL = os.getenv("JOB_REDIS_URL", "redis://localhost:6379/0")
+# 已结束任务的保留时长（秒），每个 worker 至多每小时（或保留时长的四分之一）清理一次
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", str(24 * 3600)))
+# 每个 worker 同时执行的任务数，超出时任务排队等待其他 worker 领取
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", "4"))
+# 每个 worker 同时执行的批量任务数，与交互式任务分开计数，批量任务不会占满交互式任务的名额
+BATCH_WORKER_CONCURRENCY = int(os.getenv("BATCH_WORKER_CONCURRENCY", "2"))
+# 单个批量请求最多包含的主题数
+BATCH_MAX_TOPICS = int(os.getenv("BATCH_MAX_TOPICS", "500"))
+# 任务租约时长：worker 崩溃后其他 worker 最多等待这么久接管
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "15"))
+# 续约 / 领取任务 / 跟随其他 worker 任务事件的轮询间隔（秒）
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "0.5"))
+
+# 多供应商路由：按 EWMA 延迟与错误率为每次调用选择最健康的供应商，失败时切换
+ROUTING_ENABLED = os.getenv("ROUTING_ENABLED", "true").lower() == "true"
+ROUTER_EWMA_ALPHA = float(os.getenv("ROUTER_EWMA_ALPHA", "0.3"))
+# 错误率对得分的惩罚系数：得分 = 延迟 × (1 + 系数 × 错误率)
+ROUTER_ERROR_PENALTY = float(os.getenv("ROUTER_ERROR_PENALTY", "4"))
+# 连续失败达到阈值后熔断冷却的秒数
+ROUTER_FAILURE_THRESHOLD = int(os.getenv("ROUTER_FAILURE_THRESHOLD", "3"))
+ROUTER_COOLDOWN = float(os.getenv("ROUTER_COOLDOWN", "30"))
+# 其他供应商得分需优于用户所选供应商的比例，避免在相近的供应商之间来回切换
+ROUTER_SWITCH_MARGIN = float(os.getenv("ROUTER_SWITCH_MARGIN", "0.2"))
+# 探索比例：偶尔把请求发往非首选供应商以刷新其延迟样本
+ROUTER_EXPLORE_RATIO = float(os.getenv("ROUTER_EXPLORE_RATIO", "0.05"))
+
 # provider → 模块变量名 / 环境变量名 映射
 _KEY_MAP = {
     "qwen": "QWEN_API_KEY",
@@ -21,7 +168,9 @@ _KEY_MAP = {
 
 
 def get_active_provider() -> str:
-    """根据配置的 Key 自动选择供应商。优先级：Gemini > 千问。无 Key 时返回空字符串。"""
+    """根据配置的 Key 自动选择供应商。优先级：Gemini > 千问。无 Key 时返回空字符串。回放模式下为 replay。"""
+    if REPLAY_MODE == "replay":
+        return "replay"
     if GEMINI_API_KEY:
         return "gemini"
     if QWEN_API_KEY:
@@ -29,6 +178,11 @@ def get_active_provider() -> str:
     return ""
 
 
+def get_configured_providers() -> list[str]:
+    """所有已配置 Key 的供应商，按 get_active_provider 的优先级排列。"""
+    return [p for p, key in (("gemini", GEMINI_API_KEY), ("qwen", QWEN_API_KEY)) if key]
+
+
 def update_api_key(provider: str, key: str) -> None:
     """动态更新 API Key：模块变量 + os.environ + .env 文件。"""
     global QWEN_API_KEY, GEMINI_API_KEY
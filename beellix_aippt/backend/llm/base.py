@@ -1,13 +1,60 @@
 from abc import ABC, abstractmethod
+from typing import AsyncIterator
 
 
 class BaseLLMClient(ABC):
+    # 供应商标识，用于缓存键、日志等
+    provider: str = ""
+
+    @property
+    def text_model(self) -> str:
+        """文本模型名称。"""
+        return ""
+
+    @property
+    def image_model(self) -> str:
+        """图像模型名称。"""
+        return ""
+
     @abstractmethod
     async def chat(self, system_prompt: str, user_prompt: str) -> str:
         """发送文本补全请求，返回原始文本响应。"""
         ...
 
+    async def chat_stream(self, system_prompt: str, user_prompt: str) -> AsyncIterator[str]:
+        """流式文本补全，逐段 yield 文本增量。默认退化为一次性返回完整响应。"""
+        yield await self.chat(system_prompt, user_prompt)
+
     @abstractmethod
     async def generate_image(self, prompt: str, size: str = "1280*720", negative_prompt: str = "") -> str:
         """根据提示词生成图片，返回图片 URL 或 base64。"""
-        ...
\ No newline at end of file
+        ...
+
+
+class DelegatingLLMClient(BaseLLMClient):
+    """包装另一个客户端的基类：默认把所有调用原样转发给 inner，子类只覆盖需要增强的方法。"""
+
+    def __init__(self, inner: BaseLLMClient):
+        self.inner = inner
+
+    @property
+    def provider(self) -> str:
+        return self.inner.provider
+
+    @property
+    def text_model(self) -> str:
+        return self.inner.text_model
+
+    @property
+    def image_model(self) -> str:
+        return self.inner.image_model
+
+    async def chat(self, system_prompt: str, user_prompt: str) -> str:
+        return await self.inner.chat(system_prompt, user_prompt)
+
+    async def chat_stream(self, system_prompt: str, user_prompt: str) -> AsyncIterator[str]:
+        async for delta in self.inner.chat_stream(system_prompt, user_prompt):
+            yield delta
+
+    async def generate_image(self, prompt: str, size: str = "1280*720", negative_prompt: str = "") -> str:
+        return await self.inner.generate_image(prompt, size=size, negative_prompt=negative_prompt)
@@ -0,0 +1,173 @@
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from contextvars import ContextVar
+from pathlib import Path
+from typing import AsyncIterator
+
+import config
+from llm.base import BaseLLMClient, DelegatingLLMClient
+from utils.text import extract_json
+
+logger = logging.getLogger(__name__)
+
+# 当前请求是否跳过缓存（在生成任务内设置，子任务自动继承）
+_cache_bypass: ContextVar[bool] = ContextVar("llm_cache_bypass", default=False)
+
+
+def set_cache_bypass(bypass: bool) -> None:
+    """为当前请求（及其派生的子任务）开启 / 关闭缓存旁路。"""
+    _cache_bypass.set(bypass)
+
+
+def is_cache_bypassed() -> bool:
+    return _cache_bypass.get()
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _is_json_response(raw: str) -> bool:
+    """只缓存能解析出 JSON 的响应，避免把一次格式错误的输出固化下来。"""
+    try:
+        json.loads(extract_json(raw))
+        return True
+    except json.JSONDecodeError:
+        return False
+
+
+class LLMResponseCache:
+    """基于 SQLite 的内容寻址响应缓存，支持 TTL 与按总字节数的 LRU 淘汰。"""
+
+    def __init__(self, path: str, ttl: float, max_bytes: int):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )"""
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache (accessed_at)")
+        self._db.commit()
+
+    @staticmethod
+    def make_key(provider: str, model: str, system_prompt: str, user_prompt: str) -> str:
+        """缓存键：provider + model + system prompt 哈希 + user prompt。"""
+        return _sha256(json.dumps([provider, model, _sha256(system_prompt), user_prompt], ensure_ascii=False))
+
+    def _get(self, key: str) -> str | None:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if now - created_at > self.ttl:
+                self._db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._db.commit()
+                return None
+            self._db.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            return value
+
+    def _put(self, key: str, value: str) -> None:
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now),
+            )
+            self._db.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl,))
+            # 超出容量时按最近访问时间从旧到新淘汰
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+            if total > self.max_bytes:
+                rows = self._db.execute("SELECT key, size FROM llm_cache ORDER BY accessed_at").fetchall()
+                for old_key, old_size in rows:
+                    if total <= self.max_bytes:
+                        break
+                    self._db.execute("DELETE FROM llm_cache WHERE key = ?", (old_key,))
+                    total -= old_size
+            self._db.commit()
+
+    async def get(self, key: str) -> str | None:
+        return await asyncio.to_thread(self._get, key)
+
+    async def put(self, key: str, value: str) -> None:
+        await asyncio.to_thread(self._put, key, value)
+
+
+_cache: LLMResponseCache | None = None
+
+
+def get_llm_cache() -> LLMResponseCache:
+    """进程内共享的缓存实例（惰性创建）。"""
+    global _cache
+    if _cache is None:
+        _cache = LLMResponseCache(
+            config.LLM_CACHE_PATH,
+            ttl=config.LLM_CACHE_TTL,
+            max_bytes=config.LLM_CACHE_MAX_MB * 1024 * 1024,
+        )
+    return _cache
+
+
+class CachedLLMClient(DelegatingLLMClient):
+    """在 chat / chat_stream 前加一层持久化缓存；图片生成原样转发。"""
+
+    def __init__(self, inner: BaseLLMClient, cache: LLMResponseCache):
+        super().__init__(inner)
+        self.cache = cache
+
+    def _key(self, system_prompt: str, user_prompt: str) -> str:
+        return LLMResponseCache.make_key(self.provider, self.text_model, system_prompt, user_prompt)
+
+    async def chat(self, system_prompt: str, user_prompt: str) -> str:
+        if _cache_bypass.get():
+            return await self.inner.chat(system_prompt, user_prompt)
+
+        key = self._key(system_prompt, user_prompt)
+        cached = await self.cache.get(key)
+        if cached is not None:
+            logger.info(f"LLM 缓存命中 [{self.provider}]: {key[:12]}")
+            return cached
+
+        raw = await self.inner.chat(system_prompt, user_prompt)
+        if _is_json_response(raw):
+            await self.cache.put(key, raw)
+        return raw
+
+    async def chat_stream(self, system_prompt: str, user_prompt: str) -> AsyncIterator[str]:
+        if _cache_bypass.get():
+            async for delta in self.inner.chat_stream(system_prompt, user_prompt):
+                yield delta
+            return
+
+        key = self._key(system_prompt, user_prompt)
+        cached = await self.cache.get(key)
+        if cached is not None:
+            logger.info(f"LLM 缓存命中 [{self.provider}]: {key[:12]}")
+            yield cached
+            return
+
+        chunks: list[str] = []
+        async for delta in self.inner.chat_stream(system_prompt, user_prompt):
+            chunks.append(delta)
+            yield delta
+        raw = "".join(chunks)
+        if _is_json_response(raw):
+            await self.cache.put(key, raw)
@@ -0,0 +1,98 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator
+
+import config
+
+# 当前上游调用所属的流水线阶段（planner / designer / artist），用于分阶段统计
+_stage: ContextVar[str] = ContextVar("llm_stage", default="")
+# 发起调用的会话类别（interactive / batch）与页码，用于上游调度器排序
+_session_class: ContextVar[str] = ContextVar("llm_session_class", default="interactive")
+_slide_index: ContextVar[int | None] = ContextVar("llm_slide_index", default=None)
+
+
+class WaitTally:
+    """一次调用在上游调度器中累计的排队耗时（秒）。"""
+
+    def __init__(self):
+        self.seconds = 0.0
+
+
+_scheduler_wait: ContextVar[WaitTally | None] = ContextVar("llm_scheduler_wait", default=None)
+
+
+@contextmanager
+def llm_stage(name: str):
+    """在 with 块内发起的 LLM 调用都标记为 name 阶段。
+
+    注意不要让 with 块跨越异步生成器的 yield，流式调用请使用 staged_stream。
+    """
+    token = _stage.set(name)
+    try:
+        yield
+    finally:
+        _stage.reset(token)
+
+
+def current_stage() -> str:
+    return _stage.get()
+
+
+async def staged_stream(name: str, stream: AsyncIterator[str]) -> AsyncIterator[str]:
+    """以 name 阶段启动流式调用。
+
+    各层包装在首次迭代时读取阶段标记，因此只在拉取第一段内容时持有上下文，
+    之后的 yield 不再携带，避免标记泄漏到消费方。
+    """
+    iterator = stream.__aiter__()
+    with llm_stage(name):
+        try:
+            first = await iterator.__anext__()
+        except StopAsyncIteration:
+            return
+    yield first
+    async for delta in iterator:
+        yield delta
+
+
+@contextmanager
+def track_scheduler_wait():
+    """在 with 块内累计调度器的排队耗时，产出 WaitTally；用于从调用耗时中扣除排队、只统计上游本身。
+
+    上下文变量随任务复制，每个并发尝试应在各自的任务内使用。
+    """
+    tally = WaitTally()
+    token = _scheduler_wait.set(tally)
+    try:
+        yield tally
+    finally:
+        _scheduler_wait.reset(token)
+
+
+def record_scheduler_wait(seconds: float) -> None:
+    """由调度器在放行时调用，计入当前 track_scheduler_wait 的累计值（未在统计中时忽略）。"""
+    tally = _scheduler_wait.get()
+    if tally is not None:
+        tally.seconds += seconds
+
+
+def set_session_class(name: str) -> None:
+    """在当前任务上下文中标记会话类别："interactive"（WebSocket 会话）或 "batch"（批量 / 后台任务）。"""
+    _session_class.set(name)
+
+
+def set_slide_index(index: int | None) -> None:
+    """在当前任务上下文中标记正在生成的页码，规划等与具体页面无关的调用为 None。"""
+    _slide_index.set(index)
+
+
+def call_priority() -> int:
+    """当前调用的优先级，数值越小越先放行。
+
+    交互式会话的规划为 0，第 i 页的设计 / 配图为 i + 1；批量任务整体再加 PRIORITY_BATCH_OFFSET 级。
+    """
+    index = _slide_index.get()
+    level = 0 if _stage.get() == "planner" or index is None else index + 1
+    if _session_class.get() == "batch":
+        level += config.PRIORITY_BATCH_OFFSET
+    return level
@@ -1,24 +1,36 @@
+import json
 import logging
-import httpx
+from typing import AsyncIterator
 
 from llm.base import BaseLLMClient
 import config
+from utils.http_client import get_http_client, stage_timeout
 from utils.image_saver import save_image_from_base64
 
 logger = logging.getLogger(__name__)
 
-GEMINI_BASE_URL = "https://generativelanguage.googleapis.com/v1beta/models"
+GEMINI_BASE_URL = f"{config.GEMINI_BASE_URL}/v1beta/models"
 
 
 class GeminiClient(BaseLLMClient):
+    provider = "gemini"
+
     def __init__(self, api_key: str = None):
         self.api_key = api_key or config.GEMINI_API_KEY
         if not self.api_key:
             raise ValueError("未配置 Gemini API Key")
 
-    async def chat(self, system_prompt: str, user_prompt: str) -> str:
-        url = f"{GEMINI_BASE_URL}/{config.GEMINI_TEXT_MODEL}:generateContent?key={self.api_key}"
-        payload = {
+    @property
+    def text_model(self) -> str:
+        return config.GEMINI_TEXT_MODEL
+
+    @property
+    def image_model(self) -> str:
+        return config.GEMINI_IMAGE_MODEL
+
+    @staticmethod
+    def _chat_payload(system_prompt: str, user_prompt: str) -> dict:
+        return {
             "system_instruction": {"parts": [{"text": system_prompt}]},
             "contents": [{"parts": [{"text": user_prompt}]}],
             "generationConfig": {
@@ -28,24 +40,48 @@ class GeminiClient(BaseLLMClient):
                 },
             },
         }
-        async with httpx.AsyncClient(timeout=180) as client:
-            resp = await client.post(url, json=payload)
+
+    async def chat(self, system_prompt: str, user_prompt: str) -> str:
+        url = f"{GEMINI_BASE_URL}/{config.GEMINI_TEXT_MODEL}:generateContent?key={self.api_key}"
+        payload = self._chat_payload(system_prompt, user_prompt)
+        client = get_http_client(url)
+        resp = await client.post(url, json=payload, timeout=stage_timeout(180))
+        if resp.status_code != 200:
+            logger.error(f"Gemini API 错误 [{resp.status_code}]: {resp.text[:500]}")
+            resp.raise_for_status()
+        # 启用 thinking 后，思考部分带 thought:true，跳过它取实际输出
+        parts = resp.json()["candidates"][0]["content"]["parts"]
+        thinking_len = sum(len(p.get("text", "")) for p in parts if p.get("thought"))
+        if thinking_len:
+            logger.debug(f"Gemini thinking 长度: {thinking_len} 字符")
+        for part in parts:
+            if "text" in part and not part.get("thought"):
+                return part["text"]
+        # fallback: 取最后一个 text part
+        for part in reversed(parts):
+            if "text" in part:
+                return part["text"]
+        raise RuntimeError("Gemini 未返回文本内容")
+
+    async def chat_stream(self, system_prompt: str, user_prompt: str) -> AsyncIterator[str]:
+        """streamGenerateContent（alt=sse）流式输出，跳过 thought 部分。"""
+        url = f"{GEMINI_BASE_URL}/{config.GEMINI_TEXT_MODEL}:streamGenerateContent?alt=sse&key={self.api_key}"
+        payload = self._chat_payload(system_prompt, user_prompt)
+        client = get_http_client(url)
+        async with client.stream("POST", url, json=payload, timeout=stage_timeout(180)) as resp:
             if resp.status_code != 200:
-                logger.error(f"Gemini API 错误 [{resp.status_code}]: {resp.text[:500]}")
+                body = await resp.aread()
+                logger.error(f"Gemini API 错误 [{resp.status_code}]: {body[:500].decode(errors='replace')}")
                 resp.raise_for_status()
-            # 启用 thinking 后，思考部分带 thought:true，跳过它取实际输出
-            parts = resp.json()["candidates"][0]["content"]["parts"]
-            thinking_len = sum(len(p.get("text", "")) for p in parts if p.get("thought"))
-            if thinking_len:
-                logger.debug(f"Gemini thinking 长度: {thinking_len} 字符")
-            for part in parts:
-                if "text" in part and not part.get("thought"):
-                    return part["text"]
-            # fallback: 取最后一个 text part
-            for part in reversed(parts):
-                if "text" in part:
-                    return part["text"]
-            raise RuntimeError("Gemini 未返回文本内容")
+            async for line in resp.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                candidates = json.loads(line[len("data:"):]).get("candidates") or []
+                if not candidates:
+                    continue
+                for part in candidates[0].get("content", {}).get("parts", []):
+                    if part.get("text") and not part.get("thought"):
+                        yield part["text"]
 
     async def generate_image(self, prompt: str, size: str = "1280*720", negative_prompt: str = "") -> str:
         """生成图片并保存到本地，返回本地文件路径"""
@@ -60,18 +96,18 @@ class GeminiClient(BaseLLMClient):
                 },
             },
         }
-        async with httpx.AsyncClient(timeout=180) as client:
-            resp = await client.post(url, json=payload)
-            if resp.status_code != 200:
-                logger.error(f"Gemini 图片 API 错误 [{resp.status_code}]: {resp.text[:500]}")
-                resp.raise_for_status()
-            parts = resp.json()["candidates"][0]["content"]["parts"]
-            for part in parts:
-                if "inlineData" in part:
-                    b64_data = part["inlineData"]["data"]
+        client = get_http_client(url)
+        resp = await client.post(url, json=payload, timeout=stage_timeout(180))
+        if resp.status_code != 200:
+            logger.error(f"Gemini 图片 API 错误 [{resp.status_code}]: {resp.text[:500]}")
+            resp.raise_for_status()
+        parts = resp.json()["candidates"][0]["content"]["parts"]
+        for part in parts:
+            if "inlineData" in part:
+                b64_data = part["inlineData"]["data"]
 
-                    # 保存 base64 图片到本地
-                    local_path = save_image_from_base64(b64_data)
-                    return local_path
+                # 保存 base64 图片到本地
+                local_path = save_image_from_base64(b64_data)
+                return local_path
 
         raise RuntimeError("Gemini 未返回图片数据")
\ No newline at end of file
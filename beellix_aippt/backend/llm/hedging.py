@@ -0,0 +1,243 @@
+import asyncio
+import logging
+import math
+import time
+from typing import AsyncIterator, Awaitable, Callable, TypeVar
+
+import config
+from llm.base import DelegatingLLMClient
+from llm.context import current_stage, track_scheduler_wait
+from llm.scheduler import get_scheduler
+from utils.tracing import current_span
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# 指数分桶：第 i 个桶上界为 _BUCKET_BASE * _BUCKET_GROWTH ** i 秒，覆盖 50ms ~ 约 10 分钟
+_BUCKET_BASE = 0.05
+_BUCKET_GROWTH = 1.2
+_BUCKET_COUNT = 52
+# 每记录一个样本，旧样本权重乘以该系数，使阈值跟随近期延迟变化
+_DECAY = 0.99
+
+
+class LatencyHistogram:
+    """按指数分桶、带衰减的延迟直方图，用于估算近期延迟的分位数。"""
+
+    def __init__(self):
+        self._counts = [0.0] * _BUCKET_COUNT
+        self._weight = 0.0
+        self.samples = 0
+
+    @staticmethod
+    def _bucket(seconds: float) -> int:
+        if seconds <= _BUCKET_BASE:
+            return 0
+        index = math.ceil(math.log(seconds / _BUCKET_BASE, _BUCKET_GROWTH))
+        return min(index, _BUCKET_COUNT - 1)
+
+    def record(self, seconds: float) -> None:
+        for i in range(_BUCKET_COUNT):
+            self._counts[i] *= _DECAY
+        self._counts[self._bucket(seconds)] += 1
+        self._weight = self._weight * _DECAY + 1
+        self.samples += 1
+
+    def percentile(self, q: float) -> float:
+        """返回第 q 分位（0~1）所在桶的上界，单位秒。"""
+        target = q * self._weight
+        seen = 0.0
+        for i, count in enumerate(self._counts):
+            seen += count
+            if seen >= target:
+                return _BUCKET_BASE * _BUCKET_GROWTH ** i
+        return _BUCKET_BASE * _BUCKET_GROWTH ** (_BUCKET_COUNT - 1)
+
+
+class HedgeBudget:
+    """对冲请求的令牌桶：每次主请求存入 ratio 个令牌，每次对冲消耗 1 个。
+
+    长期来看对冲请求数不超过主请求数的 ratio 倍，burst 限制短时间内的集中对冲。
+    """
+
+    def __init__(self, ratio: float, burst: float):
+        self.ratio = ratio
+        self.burst = burst
+        self._tokens = 0.0
+
+    def deposit(self) -> None:
+        self._tokens = min(self.burst, self._tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+
+_histograms: dict[str, LatencyHistogram] = {}
+_budget = HedgeBudget(config.HEDGE_BUDGET_RATIO, config.HEDGE_BUDGET_BURST)
+
+
+def get_histogram(key: str) -> LatencyHistogram:
+    """返回 "provider/op/stage" 对应的进程级延迟直方图。"""
+    histogram = _histograms.get(key)
+    if histogram is None:
+        histogram = _histograms[key] = LatencyHistogram()
+    return histogram
+
+
+def _discard(task: asyncio.Task) -> None:
+    """取消落败的请求，并吞掉其结果，避免 "exception was never retrieved" 警告。"""
+    task.cancel()
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+
+# 后台关闭落败流的任务，持有引用防止被垃圾回收
+_closing: set[asyncio.Task] = set()
+
+
+async def _close_stream(task: asyncio.Task, stream: AsyncIterator[str]) -> None:
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    try:
+        await stream.aclose()
+    except Exception:
+        pass
+
+
+async def _first_chunk(stream: AsyncIterator[str]) -> tuple[str | None, float]:
+    """拉取流的第一段内容，返回 (内容, 期间的调度器排队秒数)；空流内容为 None。"""
+    with track_scheduler_wait() as waited:
+        try:
+            return await anext(stream), waited.seconds
+        except StopAsyncIteration:
+            return None, waited.seconds
+
+
+class HedgedLLMClient(DelegatingLLMClient):
+    """对冲请求：调用耗时超过该阶段近期延迟的 HEDGE_PERCENTILE 分位时，再发一个相同请求，
+    先成功返回者胜出，另一个被取消。
+
+    阈值来自按 (provider, 操作类型, 阶段) 分别统计的延迟直方图，样本扣除了调度器排队耗时，只反映上游本身的快慢；
+    样本不足 HEDGE_MIN_SAMPLES 时不对冲；对冲次数受 HedgeBudget 约束，且上游调度器已有排队时不再追加请求。
+    流式对话按首段内容到达时间对冲。
+    """
+
+    def _histogram(self, op: str) -> LatencyHistogram:
+        return get_histogram(f"{self.provider}/{op}/{current_stage() or op}")
+
+    @staticmethod
+    def _threshold(histogram: LatencyHistogram) -> float | None:
+        if histogram.samples < config.HEDGE_MIN_SAMPLES:
+            return None
+        return histogram.percentile(config.HEDGE_PERCENTILE)
+
+    def _may_hedge(self, op: str) -> bool:
+        # 调度器已在排队说明上游容量吃紧，此时对冲只会加剧拥塞
+        if get_scheduler(self.provider, op).snapshot()["queueDepth"] > 0:
+            return False
+        return _budget.try_spend()
+
+    async def _hedged(self, op: str, call: Callable[[], Awaitable[T]]) -> T:
+        if op not in config.HEDGE_OPS:
+            return await call()
+
+        histogram = self._histogram(op)
+        threshold = self._threshold(histogram)
+        _budget.deposit()
+
+        async def attempt() -> T:
+            # 每次尝试在各自的任务内统计排队耗时，负载高时阈值不会被排队拉高
+            with track_scheduler_wait() as waited:
+                start = time.monotonic()
+                result = await call()
+                histogram.record(time.monotonic() - start - waited.seconds)
+            return result
+
+        tasks = {asyncio.create_task(attempt())}
+        try:
+            if threshold is not None:
+                done, _ = await asyncio.wait(tasks, timeout=threshold)
+                if not done and self._may_hedge(op):
+                    logger.info(f"对冲请求 [{self.provider}/{op}/{current_stage() or op}]: 已超过 {threshold:.1f}s")
+                    current_span().add_event("hedge", provider=self.provider, op=op, threshold_s=round(threshold, 3))
+                    tasks.add(asyncio.create_task(attempt()))
+
+            error: BaseException | None = None
+            while tasks:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    tasks.discard(task)
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                _discard(task)
+
+    async def chat(self, system_prompt: str, user_prompt: str) -> str:
+        return await self._hedged("text", lambda: self.inner.chat(system_prompt, user_prompt))
+
+    async def generate_image(self, prompt: str, size: str = "1280*720", negative_prompt: str = "") -> str:
+        return await self._hedged(
+            "image",
+            lambda: self.inner.generate_image(prompt, size=size, negative_prompt=negative_prompt),
+        )
+
+    async def chat_stream(self, system_prompt: str, user_prompt: str) -> AsyncIterator[str]:
+        if "text" not in config.HEDGE_OPS:
+            async for delta in self.inner.chat_stream(system_prompt, user_prompt):
+                yield delta
+            return
+
+        histogram = get_histogram(f"{self.provider}/text/{current_stage() or 'text'}/first_chunk")
+        threshold = self._threshold(histogram)
+        _budget.deposit()
+
+        # 每个候选流对应一个"拉取首段内容"的任务
+        start = time.monotonic()
+        pending: dict[asyncio.Task, AsyncIterator[str]] = {}
+
+        def open_stream() -> None:
+            stream = self.inner.chat_stream(system_prompt, user_prompt)
+            pending[asyncio.create_task(_first_chunk(stream))] = stream
+
+        open_stream()
+        winner: AsyncIterator[str] | None = None
+        first: str | None = None
+        waited = 0.0
+        try:
+            if threshold is not None:
+                done, _ = await asyncio.wait(pending, timeout=threshold)
+                if not done and self._may_hedge("text"):
+                    logger.info(f"对冲流式请求 [{self.provider}/text/{current_stage() or 'text'}]: 首段超过 {threshold:.1f}s")
+                    current_span().add_event("hedge", provider=self.provider, op="text", threshold_s=round(threshold, 3))
+                    open_stream()
+
+            error: BaseException | None = None
+            while pending and winner is None:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    stream = pending.pop(task)
+                    if task.exception() is None:
+                        winner = stream
+                        first, waited = task.result()
+                        break
+                    error = task.exception()
+            if winner is None:
+                raise error
+        finally:
+            for task, stream in pending.items():
+                closing = asyncio.create_task(_close_stream(task, stream))
+                _closing.add(closing)
+                closing.add_done_callback(_closing.discard)
+
+        if first is None:
+            return
+        histogram.record(time.monotonic() - start - waited)
+        yield first
+        async for delta in winner:
+            yield delta
@@ -0,0 +1,58 @@
+from typing import AsyncIterator
+
+from llm.base import DelegatingLLMClient
+from llm.context import current_stage
+from utils.metrics import metric_labels, time_stage
+from utils.tracing import span, start_span
+
+
+class InstrumentedLLMClient(DelegatingLLMClient):
+    """记录每次上游调用的耗时指标，按 (阶段, provider, model) 打标签，并为每次调用创建一个 trace span。
+
+    位于调度器之内、紧贴供应商客户端，统计的是单次上游请求本身（每次重试单独计入），
+    不含排队等待；排队耗时由调度器单独统计。对话阶段名为 "<planner|designer>_chat"，
+    配图为 "image_generate"（包含下载 / 保存图片，后者另有 image_download / image_save 阶段）。
+    """
+
+    def _chat_stage(self) -> str:
+        return f"{current_stage() or 'text'}_chat"
+
+    def _span_attributes(self, model: str, prompt_chars: int) -> dict:
+        return {"provider": self.provider, "model": model, "stage": current_stage(), "prompt.chars": prompt_chars}
+
+    async def chat(self, system_prompt: str, user_prompt: str) -> str:
+        attributes = self._span_attributes(self.text_model, len(system_prompt) + len(user_prompt))
+        with span("llm.chat", **attributes) as current, time_stage(self._chat_stage(), self.provider, self.text_model):
+            raw = await self.inner.chat(system_prompt, user_prompt)
+            current.set_attribute("response.chars", len(raw))
+            return raw
+
+    async def chat_stream(self, system_prompt: str, user_prompt: str) -> AsyncIterator[str]:
+        # 阶段标记只在拉取第一段内容前有效，必须在第一次 yield 之前读取；
+        # span 不设为当前 span，否则会随 yield 泄漏到消费方
+        attributes = self._span_attributes(self.text_model, len(system_prompt) + len(user_prompt))
+        current = start_span("llm.chat_stream", **attributes)
+        chars = 0
+        error: BaseException | None = None
+        try:
+            with time_stage(self._chat_stage(), self.provider, self.text_model):
+                async for delta in self.inner.chat_stream(system_prompt, user_prompt):
+                    if not chars:
+                        current.add_event("first_chunk")
+                    chars += len(delta)
+                    yield delta
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            current.set_attribute("response.chars", chars)
+            current.end(error)
+
+    async def generate_image(self, prompt: str, size: str = "1280*720", negative_prompt: str = "") -> str:
+        attributes = self._span_attributes(self.image_model, len(prompt) + len(negative_prompt))
+        with (
+            span("llm.generate_image", size=size, **attributes),
+            metric_labels(self.provider, self.image_model),
+            time_stage("image_generate"),
+        ):
+            return await self.inner.generate_image(prompt, size=size, negative_prompt=negative_prompt)
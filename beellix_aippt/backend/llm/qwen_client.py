@@ -1,18 +1,22 @@
+import json
 import logging
-import httpx
+from typing import AsyncIterator
 
 from llm.base import BaseLLMClient
 import config
+from utils.http_client import get_http_client, stage_timeout
 from utils.image_saver import save_image_from_url
 
 logger = logging.getLogger(__name__)
 
-QWEN_CHAT_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions"
+QWEN_CHAT_URL = f"{config.QWEN_BASE_URL}/compatible-mode/v1/chat/completions"
 # qwen-image-max 使用同步 multimodal-generation 端点（不再是异步 text2image）
-QWEN_IMAGE_URL = "https://dashscope.aliyuncs.com/api/v1/services/aigc/multimodal-generation/generation"
+QWEN_IMAGE_URL = f"{config.QWEN_BASE_URL}/api/v1/services/aigc/multimodal-generation/generation"
 
 
 class QwenClient(BaseLLMClient):
+    provider = "qwen"
+
     def __init__(self, api_key: str = None):
         self.api_key = api_key or config.QWEN_API_KEY
         if not self.api_key:
@@ -22,21 +26,60 @@ class QwenClient(BaseLLMClient):
             "Content-Type": "application/json",
         }
 
-    async def chat(self, system_prompt: str, user_prompt: str) -> str:
-        payload = {
+    @property
+    def text_model(self) -> str:
+        return config.QWEN_TEXT_MODEL
+
+    @property
+    def image_model(self) -> str:
+        return config.QWEN_IMAGE_MODEL
+
+    @staticmethod
+    def _chat_payload(system_prompt: str, user_prompt: str) -> dict:
+        return {
             "model": config.QWEN_TEXT_MODEL,
             "messages": [
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_prompt},
             ],
         }
-        async with httpx.AsyncClient(timeout=120) as client:
-            resp = await client.post(QWEN_CHAT_URL, headers=self.headers, json=payload)
+
+    async def chat(self, system_prompt: str, user_prompt: str) -> str:
+        payload = self._chat_payload(system_prompt, user_prompt)
+        client = get_http_client(QWEN_CHAT_URL)
+        resp = await client.post(
+            QWEN_CHAT_URL, headers=self.headers, json=payload, timeout=stage_timeout(120)
+        )
+        if resp.status_code != 200:
+            logger.error(f"Qwen API 错误 [{resp.status_code}]: {resp.text[:500]}")
+            resp.raise_for_status()
+        data = resp.json()
+        return data["choices"][0]["message"]["content"]
+
+    async def chat_stream(self, system_prompt: str, user_prompt: str) -> AsyncIterator[str]:
+        """OpenAI 兼容 SSE 流式输出，逐段 yield delta.content。"""
+        payload = self._chat_payload(system_prompt, user_prompt)
+        payload["stream"] = True
+        client = get_http_client(QWEN_CHAT_URL)
+        async with client.stream(
+            "POST", QWEN_CHAT_URL, headers=self.headers, json=payload, timeout=stage_timeout(120)
+        ) as resp:
             if resp.status_code != 200:
-                logger.error(f"Qwen API 错误 [{resp.status_code}]: {resp.text[:500]}")
+                body = await resp.aread()
+                logger.error(f"Qwen API 错误 [{resp.status_code}]: {body[:500].decode(errors='replace')}")
                 resp.raise_for_status()
-            data = resp.json()
-            return data["choices"][0]["message"]["content"]
+            async for line in resp.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                choices = json.loads(data).get("choices") or []
+                if not choices:
+                    continue
+                delta = choices[0].get("delta", {}).get("content")
+                if delta:
+                    yield delta
 
     async def generate_image(self, prompt: str, size: str = "1280*720", negative_prompt: str = "") -> str:
         """调用 qwen-image-max 同步生成图片，返回本地文件路径。
@@ -63,16 +106,18 @@ class QwenClient(BaseLLMClient):
         if negative_prompt:
             payload["parameters"]["negative_prompt"] = negative_prompt
 
-        async with httpx.AsyncClient(timeout=180) as client:
-            logger.info(f"Qwen 图片生成请求 (同步): model={config.QWEN_IMAGE_MODEL}, size={size}")
-            resp = await client.post(QWEN_IMAGE_URL, headers=self.headers, json=payload)
-            if resp.status_code != 200:
-                logger.error(f"Qwen 图片 API 错误 [{resp.status_code}]: {resp.text[:500]}")
-                resp.raise_for_status()
+        client = get_http_client(QWEN_IMAGE_URL)
+        logger.info(f"Qwen 图片生成请求 (同步): model={config.QWEN_IMAGE_MODEL}, size={size}")
+        resp = await client.post(
+            QWEN_IMAGE_URL, headers=self.headers, json=payload, timeout=stage_timeout(180)
+        )
+        if resp.status_code != 200:
+            logger.error(f"Qwen 图片 API 错误 [{resp.status_code}]: {resp.text[:500]}")
+            resp.raise_for_status()
 
-            data = resp.json()
-            # 响应格式: output.choices[0].message.content[0].image
-            image_url = data["output"]["choices"][0]["message"]["content"][0]["image"]
-            logger.info(f"Qwen 图片生成成功: {image_url[:80]}...")
-            local_path = await save_image_from_url(image_url)
-            return local_path
\ No newline at end of file
+        data = resp.json()
+        # 响应格式: output.choices[0].message.content[0].image
+        image_url = data["output"]["choices"][0]["message"]["content"][0]["image"]
+        logger.info(f"Qwen 图片生成成功: {image_url[:80]}...")
+        local_path = await save_image_from_url(image_url)
+        return local_path
\ No newline at end of file
@@ -0,0 +1,215 @@
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import AsyncIterator
+
+import config
+from llm.base import BaseLLMClient, DelegatingLLMClient
+from utils.image_saver import save_image_bytes
+
+logger = logging.getLogger(__name__)
+
+
+def _key(*parts: str) -> str:
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def text_key(system_prompt: str, user_prompt: str) -> str:
+    """对话请求的匹配键；一次性与流式调用共用，任一方式录制的响应都能以另一种方式回放。"""
+    return _key("text", system_prompt, user_prompt)
+
+
+def image_key(prompt: str, negative_prompt: str, size: str) -> str:
+    return _key("image", prompt, negative_prompt, size)
+
+
+class Cassette:
+    """录制文件目录：
+
+      meta.json       录制来源（provider、文本 / 图像模型）
+      requests.jsonl  每行一次成功的上游调用：{key, op, response | chunks | file, elapsed}
+      images/         图片原始字节，按内容哈希命名
+
+    同一请求录制多次时按录制顺序轮流回放。
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.meta: dict = {}
+        self._entries: dict[str, list[dict]] = {}
+        self._cursor: dict[str, int] = {}
+        self._lock = threading.Lock()
+        if (self.path / "meta.json").exists():
+            self.meta = json.loads((self.path / "meta.json").read_text(encoding="utf-8"))
+        if (self.path / "requests.jsonl").exists():
+            with open(self.path / "requests.jsonl", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries.setdefault(entry["key"], []).append(entry)
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self._entries.values())
+
+    def next(self, key: str) -> dict | None:
+        """取出 key 对应的下一条录制，未录制过时返回 None。"""
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                return None
+            index = self._cursor.get(key, 0)
+            self._cursor[key] = index + 1
+            return entries[index % len(entries)]
+
+    def read_image(self, entry: dict) -> bytes:
+        return (self.path / entry["file"]).read_bytes()
+
+    # --- 录制 ---
+
+    def _append(self, entry: dict, meta: dict, image: bytes | None = None, suffix: str = "") -> None:
+        with self._lock:
+            self.path.mkdir(parents=True, exist_ok=True)
+            if self.meta != meta:
+                self.meta = meta
+                (self.path / "meta.json").write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
+            if image is not None:
+                filename = f"images/{hashlib.sha256(image).hexdigest()}{suffix}"
+                (self.path / "images").mkdir(exist_ok=True)
+                if not (self.path / filename).exists():
+                    (self.path / filename).write_bytes(image)
+                entry["file"] = filename
+            with open(self.path / "requests.jsonl", "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._entries.setdefault(entry["key"], []).append(entry)
+
+    async def record(self, entry: dict, meta: dict, image: bytes | None = None, suffix: str = "") -> None:
+        await asyncio.to_thread(self._append, entry, meta, image, suffix)
+
+
+class RecordingLLMClient(DelegatingLLMClient):
+    """录制模式：调用真实供应商，把成功的请求 / 响应（含图片字节与耗时）追加写入录制文件。"""
+
+    def __init__(self, inner: BaseLLMClient, cassette: Cassette):
+        super().__init__(inner)
+        self.cassette = cassette
+
+    @property
+    def meta(self) -> dict:
+        return {"provider": self.inner.provider, "text_model": self.text_model, "image_model": self.image_model}
+
+    async def chat(self, system_prompt: str, user_prompt: str) -> str:
+        start = time.monotonic()
+        raw = await self.inner.chat(system_prompt, user_prompt)
+        entry = {"key": text_key(system_prompt, user_prompt), "op": "chat", "response": raw}
+        await self.cassette.record({**entry, "elapsed": time.monotonic() - start}, self.meta)
+        return raw
+
+    async def chat_stream(self, system_prompt: str, user_prompt: str) -> AsyncIterator[str]:
+        start = time.monotonic()
+        # [相对开始的秒数, 文本增量]
+        chunks: list[tuple[float, str]] = []
+        async for delta in self.inner.chat_stream(system_prompt, user_prompt):
+            chunks.append((time.monotonic() - start, delta))
+            yield delta
+        entry = {
+            "key": text_key(system_prompt, user_prompt),
+            "op": "chat_stream",
+            "response": "".join(delta for _, delta in chunks),
+            "chunks": chunks,
+            "elapsed": time.monotonic() - start,
+        }
+        await self.cassette.record(entry, self.meta)
+
+    async def generate_image(self, prompt: str, size: str = "1280*720", negative_prompt: str = "") -> str:
+        start = time.monotonic()
+        local_path = await self.inner.generate_image(prompt, size=size, negative_prompt=negative_prompt)
+        elapsed = time.monotonic() - start
+        data = await asyncio.to_thread(Path(local_path).read_bytes)
+        entry = {"key": image_key(prompt, negative_prompt, size), "op": "image", "elapsed": elapsed}
+        await self.cassette.record(entry, self.meta, data, Path(local_path).suffix)
+        return local_path
+
+
+class ReplayLLMClient(BaseLLMClient):
+    """回放模式：不访问网络，按请求内容从录制文件中取出响应。
+
+    speed 为 0 时立即返回；大于 0 时按录制耗时除以 speed 等待（1 为原速），流式响应保留各段的到达节奏。
+    请求未录制过时抛出 LookupError。
+    """
+
+    provider = "replay"
+
+    def __init__(self, cassette: Cassette, speed: float = 0):
+        self.cassette = cassette
+        self.speed = speed
+
+    @property
+    def text_model(self) -> str:
+        return self.cassette.meta.get("text_model", "")
+
+    @property
+    def image_model(self) -> str:
+        return self.cassette.meta.get("image_model", "")
+
+    def _lookup(self, key: str, what: str) -> dict:
+        entry = self.cassette.next(key)
+        if entry is None:
+            raise LookupError(f"录制文件 {self.cassette.path} 中没有匹配的{what}请求")
+        return entry
+
+    async def _wait(self, seconds: float) -> None:
+        if self.speed > 0 and seconds > 0:
+            await asyncio.sleep(seconds / self.speed)
+
+    async def chat(self, system_prompt: str, user_prompt: str) -> str:
+        entry = self._lookup(text_key(system_prompt, user_prompt), "对话")
+        await self._wait(entry["elapsed"])
+        return entry["response"]
+
+    async def chat_stream(self, system_prompt: str, user_prompt: str) -> AsyncIterator[str]:
+        entry = self._lookup(text_key(system_prompt, user_prompt), "对话")
+        # 一次性调用录制的响应作为单段在录制耗时结束时返回
+        chunks = entry.get("chunks") or [(entry["elapsed"], entry["response"])]
+        previous = 0.0
+        for offset, delta in chunks:
+            await self._wait(offset - previous)
+            previous = offset
+            yield delta
+
+    async def generate_image(self, prompt: str, size: str = "1280*720", negative_prompt: str = "") -> str:
+        entry = self._lookup(image_key(prompt, negative_prompt, size), "图片")
+        data = await asyncio.to_thread(self.cassette.read_image, entry)
+        await self._wait(entry["elapsed"])
+        return await save_image_bytes(data)
+
+
+def is_replay(client: BaseLLMClient) -> bool:
+    """client（或其包装的客户端）是否为回放客户端。回放时响应缓存、备选供应商与图片复用都不启用。"""
+    return client.provider == ReplayLLMClient.provider
+
+
+_cassettes: dict[str, Cassette] = {}
+
+
+def get_cassette(path: str = "") -> Cassette:
+    """进程内共享的录制文件（按路径惰性加载，默认 REPLAY_CASSETTE），回放轮转位置在所有任务间共享。"""
+    path = path or config.REPLAY_CASSETTE
+    cassette = _cassettes.get(path)
+    if cassette is None:
+        cassette = _cassettes[path] = Cassette(path)
+    return cassette
+
+
+def get_replay_client() -> tuple[ReplayLLMClient, str]:
+    """返回 (回放客户端, 录制时的供应商)。后者决定使用哪套提示词，提示词不同则无法命中录制。"""
+    cassette = get_cassette()
+    if not len(cassette):
+        raise ValueError(f"录制文件为空或不存在: {cassette.path}")
+    if not cassette.meta.get("provider"):
+        raise ValueError(f"录制文件缺少 meta.json 或其中的录制来源: {cassette.path}")
+    logger.info(f"回放录制文件 {cassette.path}（{len(cassette)} 条，来源 {cassette.meta.get('provider')}）")
+    return ReplayLLMClient(cassette, config.REPLAY_SPEED), cassette.meta["provider"]
@@ -0,0 +1,158 @@
+import logging
+import random
+import time
+from typing import AsyncIterator, Awaitable, Callable, TypeVar
+
+import config
+from llm.base import BaseLLMClient
+from utils.tracing import current_span
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class ProviderHealth:
+    """单个 (provider, 操作类型) 的健康度：EWMA 延迟、EWMA 错误率，连续失败过多时熔断一段时间。"""
+
+    def __init__(self):
+        self.latency: float | None = None
+        self.error_rate = 0.0
+        self.failures = 0
+        self.open_until = 0.0
+
+    def record_success(self, seconds: float) -> None:
+        alpha = config.ROUTER_EWMA_ALPHA
+        self.latency = seconds if self.latency is None else alpha * seconds + (1 - alpha) * self.latency
+        self.error_rate *= 1 - alpha
+        self.failures = 0
+
+    def record_failure(self) -> None:
+        alpha = config.ROUTER_EWMA_ALPHA
+        self.error_rate = alpha + (1 - alpha) * self.error_rate
+        self.failures += 1
+        if self.failures >= config.ROUTER_FAILURE_THRESHOLD:
+            self.open_until = time.monotonic() + config.ROUTER_COOLDOWN
+
+    def available(self) -> bool:
+        return time.monotonic() >= self.open_until
+
+    def score(self) -> float:
+        """越小越好；尚无成功样本时视为无穷大。"""
+        if self.latency is None:
+            return float("inf")
+        return self.latency * (1 + config.ROUTER_ERROR_PENALTY * self.error_rate)
+
+    def snapshot(self) -> dict:
+        return {
+            "latencyMs": None if self.latency is None else round(self.latency * 1000),
+            "errorRate": round(self.error_rate, 3),
+            "available": self.available(),
+        }
+
+
+_health: dict[tuple[str, str], ProviderHealth] = {}
+
+
+def get_health(provider: str, op: str) -> ProviderHealth:
+    """返回 (provider, op) 的进程级健康度，op 为 "text" 或 "image"。"""
+    key = (provider, op)
+    health = _health.get(key)
+    if health is None:
+        health = _health[key] = ProviderHealth()
+    return health
+
+
+def health_snapshot() -> dict:
+    """所有已记录的 provider 健康度，供健康检查接口展示。"""
+    return {f"{provider}/{op}": health.snapshot() for (provider, op), health in _health.items()}
+
+
+class ProviderRouter:
+    """在已配置的多个供应商之间按调用路由：每次规划 / 设计 / 配图调用都发往当前最健康的供应商，
+    失败时依次切换到下一个。
+
+    clients 为 provider → {"text": 文本客户端, "image": 图像客户端}；preferred 为用户选择的供应商，
+    只有其他供应商的得分明显更好（超出 ROUTER_SWITCH_MARGIN）时才会被替换。
+    """
+
+    def __init__(self, clients: dict[str, dict[str, BaseLLMClient]], preferred: str):
+        self.clients = clients
+        self.preferred = preferred if preferred in clients else next(iter(clients))
+
+    @property
+    def providers(self) -> list[str]:
+        return list(self.clients)
+
+    def _rank(self, op: str) -> list[str]:
+        providers = list(self.clients)
+        healthy = [p for p in providers if get_health(p, op).available()]
+        # 熔断中的供应商排在最后，所有供应商都不可用时仍会尝试
+        cooling = sorted(
+            (p for p in providers if p not in healthy), key=lambda p: get_health(p, op).open_until
+        )
+        # 稳定排序：得分相同（包括都没有样本）时保持 preferred 在前
+        healthy.sort(key=lambda p: (get_health(p, op).score(), p != self.preferred))
+        if self.preferred in healthy and healthy[0] != self.preferred:
+            best = get_health(healthy[0], op).score()
+            if get_health(self.preferred, op).score() <= best * (1 + config.ROUTER_SWITCH_MARGIN):
+                healthy.remove(self.preferred)
+                healthy.insert(0, self.preferred)
+        return healthy + cooling
+
+    def primary(self, op: str) -> str:
+        """当前排在首位的供应商。"""
+        return self._rank(op)[0]
+
+    def candidates(self, op: str) -> list[str]:
+        """本次调用的尝试顺序；按 ROUTER_EXPLORE_RATIO 的概率把其他健康供应商提到首位，刷新其延迟样本。"""
+        ranked = self._rank(op)
+        healthy = [p for p in ranked if get_health(p, op).available()]
+        if len(healthy) > 1 and random.random() < config.ROUTER_EXPLORE_RATIO:
+            explore = random.choice(healthy[1:])
+            ranked.remove(explore)
+            ranked.insert(0, explore)
+        return ranked
+
+    async def run(self, op: str, call: Callable[[str, BaseLLMClient], Awaitable[T]]) -> T:
+        """依次在候选供应商上执行 call(provider, client)，返回第一个成功的结果。"""
+        error: Exception | None = None
+        for provider in self.candidates(op):
+            health = get_health(provider, op)
+            start = time.monotonic()
+            try:
+                result = await call(provider, self.clients[provider][op])
+            except Exception as e:
+                health.record_failure()
+                error = e
+                logger.warning(f"路由 [{op}] {provider} 调用失败 ({e})，尝试下一个供应商")
+                current_span().add_event("failover", op=op, provider=provider, error=str(e))
+                continue
+            health.record_success(time.monotonic() - start)
+            return result
+        raise error
+
+    async def stream(
+        self, op: str, open_stream: Callable[[str, BaseLLMClient], AsyncIterator[str]]
+    ) -> AsyncIterator[str]:
+        """流式版本的 run：仅在尚未产出任何内容时切换供应商。"""
+        error: Exception | None = None
+        for provider in self.candidates(op):
+            health = get_health(provider, op)
+            start = time.monotonic()
+            started = False
+            try:
+                async for delta in open_stream(provider, self.clients[provider][op]):
+                    started = True
+                    yield delta
+            except Exception as e:
+                health.record_failure()
+                if started:
+                    raise
+                error = e
+                logger.warning(f"路由 [{op}] {provider} 流式调用失败 ({e})，尝试下一个供应商")
+                current_span().add_event("failover", op=op, provider=provider, error=str(e))
+                continue
+            health.record_success(time.monotonic() - start)
+            return
+        raise error
@@ -0,0 +1,309 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Awaitable, Callable, TypeVar
+
+import httpx
+
+import config
+from llm.base import DelegatingLLMClient
+from llm.context import call_priority, record_scheduler_wait
+from utils.metrics import REGISTRY, Gauge, Histogram
+from utils.tracing import current_span
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# 可重试的上游状态码
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+# 粗略估算：平均每个 token 约对应的字符数
+_CHARS_PER_TOKEN = 3
+
+
+def estimate_tokens(*texts: str) -> int:
+    """估算一次对话请求消耗的 token 数（输入 + 预期输出），用于 TPM 限流。"""
+    return sum(len(t) for t in texts) // _CHARS_PER_TOKEN + config.LLM_EST_OUTPUT_TOKENS
+
+
+def _parse_retry_after(response: httpx.Response) -> float | None:
+    """解析 Retry-After 头，支持秒数和 HTTP 日期两种格式。"""
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class _PriorityGate:
+    """容量为 capacity 的信号量，等待者按 key 从小到大放行（key 相同时先到先得）；capacity <= 0 表示不限制。"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.holders = 0
+        self._waiters: list[tuple[float, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+
+    async def acquire(self, key: float) -> None:
+        if self.capacity <= 0 or (self.holders < self.capacity and not self._waiters):
+            self.holders += 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (key, next(self._seq), fut))
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # 名额已移交给本协程但它被取消了，转交给下一个等待者
+                self.release()
+            else:
+                fut.cancel()
+            raise
+
+    def release(self) -> None:
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(None)  # 名额直接移交，holders 不变
+                return
+        self.holders -= 1
+
+
+class ProviderScheduler:
+    """单个 (provider, 操作类型) 的进程级调度器：
+
+      - 最大并发（max_inflight）
+      - 60 秒滑动窗口内的请求数（rpm）与 token 数（tpm）
+      - 429 / 5xx / 连接错误时按指数退避 + 抖动重试，优先遵守 Retry-After
+      - 排队的调用按优先级放行：交互式会话的规划与靠前页面优先于靠后页面与批量任务，
+        等待越久优先级越高（老化），任何调用都不会被无限期推后
+
+    0 表示对应维度不限制。
+    """
+
+    def __init__(self, name: str, rpm: int, tpm: int, max_inflight: int):
+        self.name = name
+        self.provider, _, self.op = name.partition("/")
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_inflight = max_inflight
+
+        self._slots = _PriorityGate(max_inflight)
+        # 速率检查串行放行，同样按优先级排队
+        self._rate_gate = _PriorityGate(1)
+        self._requests: deque[float] = deque()
+        self._tokens: deque[tuple[float, int]] = deque()
+        self._token_sum = 0
+        # 收到 429 + Retry-After 后，整个 provider 暂停放行到该时刻
+        self._blocked_until = 0.0
+
+        self._queued = 0
+        self._last_wait = 0.0
+        self._avg_wait = 0.0
+        self._retries = 0
+
+    # --- 速率窗口 ---
+
+    def _expire(self, now: float) -> None:
+        while self._requests and self._requests[0] <= now - 60:
+            self._requests.popleft()
+        while self._tokens and self._tokens[0][0] <= now - 60:
+            self._token_sum -= self._tokens.popleft()[1]
+
+    async def _wait_rate(self, tokens: int, key: float) -> None:
+        await self._rate_gate.acquire(key)
+        try:
+            while True:
+                now = time.monotonic()
+                self._expire(now)
+                delay = self._blocked_until - now
+                if self.rpm and len(self._requests) >= self.rpm:
+                    delay = max(delay, self._requests[0] + 60 - now)
+                if self.tpm and self._tokens and self._token_sum + tokens > self.tpm:
+                    delay = max(delay, self._tokens[0][0] + 60 - now)
+                if delay <= 0:
+                    break
+                await asyncio.sleep(delay)
+            self._requests.append(now)
+            self._tokens.append((now, tokens))
+            self._token_sum += tokens
+        finally:
+            self._rate_gate.release()
+
+    @asynccontextmanager
+    async def slot(self, tokens: int = 0):
+        """占用一个并发槽位并通过速率检查后放行，退出时释放槽位。
+
+        排队顺序取决于调用上下文的优先级（见 llm.context.call_priority）：每高一级相当于
+        多排队 PRIORITY_AGING_SECONDS 秒，因此低优先级调用等待足够久后终会放行。
+        """
+        start = time.monotonic()
+        key = start + call_priority() * config.PRIORITY_AGING_SECONDS if config.PRIORITY_ENABLED else start
+        self._queued += 1
+        try:
+            await self._slots.acquire(key)
+            try:
+                await self._wait_rate(tokens, key)
+            except BaseException:
+                self._slots.release()
+                raise
+        finally:
+            self._queued -= 1
+
+        wait = time.monotonic() - start
+        SCHEDULER_WAIT.observe(wait, provider=self.provider, op=self.op)
+        record_scheduler_wait(wait)
+        # 记在发起调用的 span 上（如 design_slide），排队耗时与上游耗时分开呈现
+        current_span().increment("scheduler.wait_ms", round(wait * 1000))
+        if wait > 0.01:
+            current_span().add_event("scheduler.wait", scheduler=self.name, wait_ms=round(wait * 1000))
+        self._last_wait = wait
+        self._avg_wait = 0.8 * self._avg_wait + 0.2 * wait
+        if wait > 1:
+            logger.info(f"调度器 [{self.name}] 排队 {wait:.1f}s 后放行")
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    # --- 重试 ---
+
+    def _retry_delay(self, error: Exception, attempt: int) -> float | None:
+        """返回重试前需等待的秒数；不可重试时返回 None。"""
+        if attempt >= config.LLM_MAX_RETRIES:
+            return None
+        if isinstance(error, httpx.HTTPStatusError):
+            if error.response.status_code not in RETRYABLE_STATUS:
+                return None
+            retry_after = _parse_retry_after(error.response)
+            if retry_after is not None:
+                if error.response.status_code == 429:
+                    self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+                return retry_after
+        elif not isinstance(error, httpx.TransportError) or isinstance(error, httpx.ReadTimeout):
+            # 读超时说明上游已在处理，直接重试只会叠加延迟
+            return None
+        cap = min(config.LLM_RETRY_MAX_DELAY, config.LLM_RETRY_BASE_DELAY * 2 ** attempt)
+        return random.uniform(cap / 2, cap)
+
+    def _retry_traced(self, attempt: int, delay: float, error: Exception) -> None:
+        self._retries += 1
+        current_span().increment("retries")
+        current_span().add_event("retry", scheduler=self.name, attempt=attempt, delay_s=round(delay, 3), error=str(error))
+
+    async def run(self, call: Callable[[], Awaitable[T]], tokens: int = 0) -> T:
+        """在调度器内执行一次上游调用，可重试错误自动退避重试。"""
+        attempt = 0
+        while True:
+            async with self.slot(tokens):
+                try:
+                    return await call()
+                except Exception as e:
+                    delay = self._retry_delay(e, attempt)
+                    if delay is None:
+                        raise
+                    logger.warning(f"调度器 [{self.name}] 第 {attempt + 1} 次调用失败 ({e})，{delay:.1f}s 后重试")
+                    self._retry_traced(attempt + 1, delay, e)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def stream(self, open_stream: Callable[[], AsyncIterator[str]], tokens: int = 0) -> AsyncIterator[str]:
+        """流式版本的 run：仅在尚未产出任何内容时重试，整个流期间占用槽位。"""
+        attempt = 0
+        while True:
+            started = False
+            async with self.slot(tokens):
+                try:
+                    async for delta in open_stream():
+                        started = True
+                        yield delta
+                    return
+                except Exception as e:
+                    delay = None if started else self._retry_delay(e, attempt)
+                    if delay is None:
+                        raise
+                    logger.warning(f"调度器 [{self.name}] 第 {attempt + 1} 次流式调用失败 ({e})，{delay:.1f}s 后重试")
+                    self._retry_traced(attempt + 1, delay, e)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def snapshot(self) -> dict:
+        """当前排队深度与等待耗时，供状态事件展示。"""
+        return {
+            "queueDepth": self._queued,
+            "inflight": self._slots.holders,
+            "lastWaitMs": round(self._last_wait * 1000),
+            "avgWaitMs": round(self._avg_wait * 1000),
+            "retries": self._retries,
+        }
+
+
+_schedulers: dict[tuple[str, str], ProviderScheduler] = {}
+
+SCHEDULER_WAIT = REGISTRY.register(Histogram(
+    "beellix_scheduler_wait_seconds",
+    "Time upstream calls spent queued for a concurrency slot and rate-limit budget.",
+    ("provider", "op"),
+))
+REGISTRY.register(Gauge(
+    "beellix_upstream_inflight",
+    "Upstream calls currently holding a scheduler slot.",
+    ("provider", "op"),
+    collect=lambda: {key: s._slots.holders for key, s in _schedulers.items()},
+))
+REGISTRY.register(Gauge(
+    "beellix_upstream_queued",
+    "Upstream calls waiting in the scheduler.",
+    ("provider", "op"),
+    collect=lambda: {key: s._queued for key, s in _schedulers.items()},
+))
+
+
+def get_scheduler(provider: str, op: str) -> ProviderScheduler:
+    """返回 (provider, op) 的进程级调度器，op 为 "text" 或 "image"。"""
+    key = (provider, op)
+    scheduler = _schedulers.get(key)
+    if scheduler is None:
+        limits = config.RATE_LIMITS.get(key, {})
+        scheduler = ProviderScheduler(
+            f"{provider}/{op}",
+            rpm=limits.get("rpm", 0),
+            tpm=limits.get("tpm", 0),
+            max_inflight=limits.get("inflight", 0),
+        )
+        _schedulers[key] = scheduler
+    return scheduler
+
+
+class ScheduledLLMClient(DelegatingLLMClient):
+    """让所有上游调用经过进程级调度器：限流、限并发与重试。"""
+
+    async def chat(self, system_prompt: str, user_prompt: str) -> str:
+        return await get_scheduler(self.provider, "text").run(
+            lambda: self.inner.chat(system_prompt, user_prompt),
+            tokens=estimate_tokens(system_prompt, user_prompt),
+        )
+
+    async def chat_stream(self, system_prompt: str, user_prompt: str) -> AsyncIterator[str]:
+        async for delta in get_scheduler(self.provider, "text").stream(
+            lambda: self.inner.chat_stream(system_prompt, user_prompt),
+            tokens=estimate_tokens(system_prompt, user_prompt),
+        ):
+            yield delta
+
+    async def generate_image(self, prompt: str, size: str = "1280*720", negative_prompt: str = "") -> str:
+        return await get_scheduler(self.provider, "image").run(
+            lambda: self.inner.generate_image(prompt, size=size, negative_prompt=negative_prompt),
+        )
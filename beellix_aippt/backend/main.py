@@ -1,23 +1,63 @@
 import asyncio
 import json
 import logging
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pathlib import Path
 
 import config
-from llm.qwen_client import QwenClient
-from llm.gemini_client import GeminiClient
+from models import DesignerResult, FinalSlide, PlannerResult
+from llm.qwen_client import QwenClient, QWEN_CHAT_URL
+from llm.gemini_client import GeminiClient, GEMINI_BASE_URL
+from llm.cache import CachedLLMClient, get_llm_cache, set_cache_bypass
+from llm.scheduler import ScheduledLLMClient
+from llm.hedging import HedgedLLMClient
+from llm.instrumented import InstrumentedLLMClient
+from llm.replay import RecordingLLMClient, get_cassette, get_replay_client, is_replay
+from llm.router import ProviderRouter, health_snapshot
+from services.batch_service import BatchService
+from services.fair_share import get_slide_scheduler
+from services.job_backends import get_job_backend
+from services.job_service import JobManager
+from services.pdf_service import PDF_MODES, ImageOptions, PDFService
 from services.ppt_service import PPTService
-from services.pdf_service import PDFService
+from utils.browser_pool import close_browser_pool, get_browser_pool
+from utils.http_client import open_http_clients, close_http_clients
+from utils.image_saver import IMAGES_DIR, is_content_addressed
+from utils.metrics import REGISTRY, Gauge
+from utils.tracing import shutdown_tracing
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Beellix AI PPT", version="0.1.0")
+ACTIVE_WEBSOCKETS = REGISTRY.register(Gauge("beellix_active_websockets", "Open generation WebSocket connections."))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动时创建上游共享连接池、预热 PDF 浏览器并开始领取生成任务，关闭时统一释放。"""
+    global job_manager, batch_service
+    open_http_clients([QWEN_CHAT_URL, GEMINI_BASE_URL])
+    await get_browser_pool().start()
+    job_manager = JobManager(get_job_backend(), get_llm_router)
+    batch_service = BatchService(job_manager)
+    await job_manager.run()
+    yield
+    await job_manager.shutdown()
+    await close_http_clients()
+    await close_browser_pool()
+    await asyncio.to_thread(shutdown_tracing)
+
+
+# 生成任务管理器与批量生成服务，在 lifespan 中创建
+job_manager: JobManager | None = None
+batch_service: BatchService | None = None
+
+app = FastAPI(title="Beellix AI PPT", version="0.1.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -26,43 +66,128 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+class ImageFiles(StaticFiles):
+    """图片静态文件：内容寻址的文件名即内容哈希，可以标记为永久缓存。"""
+
+    async def get_response(self, path: str, scope):
+        response = await super().get_response(path, scope)
+        if response.status_code == 200 and is_content_addressed(Path(path).name):
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+
+
 # 挂载静态文件目录，用于提供生成的图片
-IMAGES_DIR = Path("generated_images")
-IMAGES_DIR.mkdir(exist_ok=True)
-app.mount("/images", StaticFiles(directory=str(IMAGES_DIR)), name="images")
+app.mount("/images", ImageFiles(directory=str(IMAGES_DIR)), name="images")
 
 
 def get_llm_clients(provider: str = "", api_key: str = ""):
     """根据供应商选择返回 (text_llm, image_llm, provider_name)"""
     provider = provider or config.get_active_provider()
-    if provider == "qwen":
+    if provider == "replay" or config.REPLAY_MODE == "replay":
+        # 回放模式下所有请求都从录制文件返回，沿用录制时的供应商名以选用相同的提示词
+        client, provider = get_replay_client()
+    elif provider == "qwen":
         client = QwenClient(api_key=api_key if api_key else None)
-        return client, client, provider
     elif provider == "gemini":
         client = GeminiClient(api_key=api_key if api_key else None)
-        return client, client, provider
     else:
         raise ValueError(f"未知供应商: {provider}")
+    if config.REPLAY_MODE == "record":
+        client = RecordingLLMClient(client, get_cassette())
+
+    # 所有上游调用经过进程级调度器；缓存放在调度器之前，命中时不占用限流配额
+    # 耗时指标紧贴供应商客户端，只统计上游请求本身，不含排队
+    upstream = ScheduledLLMClient(InstrumentedLLMClient(client))
+    # 对冲请求同样经过调度器，受限流与并发上限约束
+    if config.HEDGE_ENABLED:
+        upstream = HedgedLLMClient(upstream)
+    # 录制 / 回放时不经过响应缓存，保证每次调用都被录制、每次回放的工作量相同；
+    # 未设置 REPLAY_MODE、只在请求中选择 replay 供应商时同样如此
+    use_cache = config.LLM_CACHE_ENABLED and not config.REPLAY_MODE and not is_replay(client)
+    text_llm = CachedLLMClient(upstream, get_llm_cache()) if use_cache else upstream
+    return text_llm, upstream, provider
+
+
+def get_llm_router(provider: str = "", api_key: str = "") -> ProviderRouter:
+    """为一次生成构建供应商路由：用户所选供应商优先，开启 ROUTING_ENABLED 时其余已配置 Key 的供应商作为备选。"""
+    text_llm, image_llm, provider = get_llm_clients(provider, api_key)
+    clients = {provider: {"text": text_llm, "image": image_llm}}
+    # 录制文件只对应一个供应商，录制 / 回放时不启用备选
+    if config.ROUTING_ENABLED and not config.REPLAY_MODE and not is_replay(image_llm):
+        for other in config.get_configured_providers():
+            if other not in clients:
+                other_text, other_image, _ = get_llm_clients(other)
+                clients[other] = {"text": other_text, "image": other_image}
+    return ProviderRouter(clients, preferred=provider)
+
+
+async def regenerate_slide(request: dict) -> tuple[int | None, FinalSlide]:
+    """单页重新生成（WebSocket regenerate_slide 与 REST 接口共用），返回 (任务日志序号, 新幻灯片)。
+
+    请求字段：index、mode（"design" 重新设计并配图 / "image" 只重新配图）、imagePrompt（可选，替换配图提示词），
+    以及 jobId（从任务日志读取大纲与现有设计，任务已结束时结果写入任务日志）和 / 或 outline + design
+    （直接提供大纲与该页现有设计）。两者都提供时优先按 jobId，任务已过期再按 outline 重新生成。
+    provider / apiKey 应与生成时一致，否则可能换用其他供应商与提示词，或因服务端未配置 Key 而失败。
+    """
+    # 重新生成需要得到新结果，本任务内跳过 LLM 缓存与图片复用
+    set_cache_bypass(True)
+    index = int(request.get("index", -1))
+    redesign = request.get("mode", "design") != "image"
+    image_prompt = request.get("imagePrompt", "").strip()
+    provider = request.get("provider", "")
+    api_key = request.get("apiKey", "").strip()
+
+    if request.get("jobId"):
+        try:
+            return await job_manager.regenerate_slide(
+                request["jobId"], index, redesign, image_prompt, provider, api_key
+            )
+        except KeyError:
+            if not request.get("outline"):
+                raise
+
+    if not request.get("outline"):
+        raise ValueError("缺少 jobId 或 outline")
+    outline = PlannerResult(**request["outline"])
+    design = None
+    if not redesign:
+        if not request.get("design"):
+            raise ValueError("只重新配图时需要提供该页的 design")
+        design = DesignerResult(**request["design"])
+    service = PPTService(
+        get_llm_router(provider, api_key), share=get_slide_scheduler().share(config.INTERACTIVE_SHARE_WEIGHT)
+    )
+    return None, await service.regenerate_slide(outline, index, design, image_prompt)
 
 
 @app.websocket("/ws/generate")
 async def websocket_generate(ws: WebSocket):
     """
-    WebSocket 端点，处理 PPT 生成的双向通信。
+    WebSocket 端点，处理 PPT 生成的双向通信。生成以服务端任务运行，连接断开不会中止生成。
 
     前端 → 后端消息格式：
-      { "action": "generate", "topic": "...", "provider": "qwen" }
+      { "action": "generate", "topic": "...", "provider": "qwen", "noCache": false }
+      { "action": "attach", "jobId": "...", "offset": 0 }   重连后从 offset 回放任务事件
       { "action": "cancel" }
+      { "action": "regenerate_slide", "index": 2, "mode": "design|image", "imagePrompt": "...",
+        "provider": "qwen", "apiKey": "", "jobId": "...", "outline": {...}, "design": {...} }
+          重新生成 jobId 指定任务（缺省为当前任务）的一页，任务已过期时按 outline + design 重新生成；
+          结果以 slide 事件返回，失败时 error 事件带 regenerate: true
 
     后端 → 前端消息格式：
-      { "event": "status|outline|slide|done|error", "data": {...} }
+      { "event": "job|status|outline|slide|done|error", "data": {...}, "seq": n }
+    seq 为事件在任务日志中的序号（slide_partial 等不入日志的事件为 null），重连时以最后收到的 seq + 1 作为 offset。
     """
     await ws.accept()
     logger.info("WebSocket 连接已建立")
+    ACTIVE_WEBSOCKETS.inc()
 
-    cancel_event = asyncio.Event()
     connected = True
-    generate_task: asyncio.Task | None = None
+    job_id: str | None = None
+    stream_task: asyncio.Task | None = None
+    # 进行中的单页重新生成，持有引用防止被垃圾回收；连接断开后继续执行，结果写入任务日志
+    regenerating: set[asyncio.Task] = set()
 
     async def safe_send(data: str) -> bool:
         """安全发送消息，连接断开时返回 False。"""
@@ -74,29 +199,40 @@ async def websocket_generate(ws: WebSocket):
             return True
         except (WebSocketDisconnect, RuntimeError):
             connected = False
-            cancel_event.set()
             return False
 
-    async def run_generation(topic: str, provider: str, api_key: str = ""):
-        """在后台任务中运行生成流水线，结果通过 WebSocket 推送。"""
-        try:
-            text_llm, image_llm, resolved_provider = get_llm_clients(provider, api_key)
-            service = PPTService(text_llm, image_llm, resolved_provider)
+    async def send_error(message: str) -> None:
+        await safe_send(json.dumps({"event": "error", "data": {"message": message}}, ensure_ascii=False))
 
-            async for event in service.generate(topic, cancel_event):
-                msg = json.dumps(event.model_dump(), ensure_ascii=False)
-                if not await safe_send(msg):
-                    logger.info("WebSocket 已断开，停止生成")
+    async def stream_job(target: str, offset: int = 0):
+        """把任务事件（从 offset 开始回放）推送给当前连接。"""
+        try:
+            async for seq, event in job_manager.attach(target, offset):
+                if not await safe_send(json.dumps({**event, "seq": seq}, ensure_ascii=False)):
+                    logger.info("WebSocket 已断开，停止推送（任务继续在后台运行）")
                     return
+        except KeyError:
+            await send_error("生成任务不存在或已过期")
+
+    async def send_regenerated(request: dict) -> None:
+        index = request.get("index")
+        try:
+            seq, slide = await regenerate_slide(request)
+        except KeyError:
+            await send_error("生成任务不存在或已过期")
+            return
         except Exception as e:
-            if not connected:
-                logger.info("WebSocket 在生成过程中断开")
-                return
-            logger.error(f"生成过程异常: {e}")
-            await safe_send(json.dumps(
-                {"event": "error", "data": {"message": str(e)}},
-                ensure_ascii=False,
-            ))
+            logger.error(f"第 {index} 页重新生成失败: {e}")
+            await safe_send(json.dumps({
+                "event": "error",
+                "data": {"message": f"重新生成失败: {e}", "slideIndex": index, "regenerate": True},
+            }, ensure_ascii=False))
+            return
+        await safe_send(json.dumps({"event": "slide", "data": slide.model_dump(), "seq": seq}, ensure_ascii=False))
+
+    def stop_streaming() -> None:
+        if stream_task and not stream_task.done():
+            stream_task.cancel()
 
     try:
         while True:
@@ -106,37 +242,54 @@ async def websocket_generate(ws: WebSocket):
 
             if action == "generate":
                 # 如果有正在进行的生成任务，先取消
-                if generate_task and not generate_task.done():
-                    cancel_event.set()
-                    await generate_task
-                    cancel_event.clear()
+                if job_id:
+                    await job_manager.cancel(job_id)
+                stop_streaming()
 
                 topic = msg.get("topic", "").strip()
                 provider = msg.get("provider", "")
                 api_key = msg.get("apiKey", "").strip()
+                no_cache = bool(msg.get("noCache", False))
 
                 if not topic:
-                    await safe_send(json.dumps(
-                        {"event": "error", "data": {"message": "主题不能为空"}},
-                        ensure_ascii=False,
-                    ))
+                    await send_error("主题不能为空")
+                    continue
+
+                try:
+                    job_id = await job_manager.start(topic, provider, api_key, no_cache)
+                except Exception as e:
+                    logger.error(f"创建生成任务失败: {e}")
+                    await send_error(str(e))
+                    continue
+                stream_task = asyncio.create_task(stream_job(job_id))
+
+            elif action == "attach":
+                try:
+                    offset = max(0, int(msg.get("offset", 0)))
+                except (TypeError, ValueError):
+                    await send_error(f"无效的 offset: {msg.get('offset')!r}")
                     continue
+                stop_streaming()
+                job_id = msg.get("jobId", "")
+                stream_task = asyncio.create_task(stream_job(job_id, offset))
 
-                generate_task = asyncio.create_task(
-                    run_generation(topic, provider, api_key)
-                )
+            elif action == "regenerate_slide":
+                if not msg.get("jobId") and job_id:
+                    msg["jobId"] = job_id
+                task = asyncio.create_task(send_regenerated(msg))
+                regenerating.add(task)
+                task.add_done_callback(regenerating.discard)
 
             elif action == "cancel":
-                if generate_task and not generate_task.done():
-                    cancel_event.set()
+                if job_id and await job_manager.cancel(job_id):
                     logger.info("收到取消请求")
 
     except WebSocketDisconnect:
-        logger.info("WebSocket 连接已关闭")
+        logger.info("WebSocket 连接已关闭，生成任务继续在后台运行")
         connected = False
-        cancel_event.set()
-        if generate_task and not generate_task.done():
-            await generate_task
+        stop_streaming()
+    finally:
+        ACTIVE_WEBSOCKETS.dec()
 
 
 @app.get("/api/health")
@@ -149,9 +302,100 @@ async def health():
             "gemini": bool(config.GEMINI_API_KEY),
         },
         "active_provider": active if active else None,
+        "routing": health_snapshot(),
+        "slides": get_slide_scheduler().snapshot(),
+        "jobs": job_manager.snapshot(),
     }
 
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus 抓取端点（本进程的指标；多 worker 部署时每个 worker 各自统计）。"""
+    return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.post("/api/slides/regenerate")
+async def regenerate_slide_endpoint(request: dict):
+    """
+    单页重新生成：只重新运行该页的设计和 / 或配图，返回替换后的 FinalSlide。
+
+    请求体格式：
+    { "jobId": "...", "index": 2, "mode": "design", "imagePrompt": "" }
+    或 { "outline": {...}, "design": {...}, "index": 2, "mode": "image", "imagePrompt": "..." }
+    """
+    try:
+        _, slide = await regenerate_slide(request)
+    except KeyError:
+        return JSONResponse({"error": "生成任务不存在或已过期"}, status_code=404)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except Exception as e:
+        logger.error(f"单页重新生成失败: {e}")
+        return JSONResponse({"error": f"重新生成失败: {e}"}, status_code=500)
+    return slide
+
+
+@app.post("/api/batch")
+async def submit_batch(request: dict):
+    """
+    批量生成：每个主题创建一个排队的生成任务，由各 worker 在批量任务名额内领取执行。
+
+    请求体格式：
+    { "topics": ["...", ...], "provider": "qwen", "noCache": false }
+
+    返回 { "batchId": "...", "jobs": [{"jobId": "...", "topic": "..."}, ...] }；
+    进度通过 GET /api/batch/{batchId} 轮询或 GET /api/batch/{batchId}/events 订阅，
+    单个任务的结果通过 GET /api/jobs/{jobId}/events 读取。
+    """
+    topics = [t.strip() for t in request.get("topics", []) if isinstance(t, str) and t.strip()]
+    if not topics:
+        return JSONResponse({"error": "主题列表不能为空"}, status_code=400)
+    if len(topics) > config.BATCH_MAX_TOPICS:
+        return JSONResponse({"error": f"单个批次最多 {config.BATCH_MAX_TOPICS} 个主题"}, status_code=400)
+    try:
+        return await batch_service.submit(topics, request.get("provider", ""), bool(request.get("noCache", False)))
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+
+@app.get("/api/batch/{batch_id}")
+async def get_batch(batch_id: str):
+    """批次进度：各状态的任务数与每个任务的状态。"""
+    status = await batch_service.status(batch_id)
+    if status is None:
+        return JSONResponse({"error": "批次不存在或已过期"}, status_code=404)
+    return status
+
+
+@app.get("/api/batch/{batch_id}/events")
+async def stream_batch(batch_id: str):
+    """批次事件流（Server-Sent Events）：batch 进度事件，以及带 jobId 的 outline / slide / done / error 事件。"""
+    if await batch_service.status(batch_id) is None:
+        return JSONResponse({"error": "批次不存在或已过期"}, status_code=404)
+
+    async def events():
+        async for event in batch_service.stream(batch_id):
+            yield f"event: {event['event']}\ndata: {json.dumps(event['data'], ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@app.delete("/api/batch/{batch_id}")
+async def cancel_batch(batch_id: str):
+    """取消批次中所有未结束的任务。"""
+    return {"cancelled": await batch_service.cancel(batch_id)}
+
+
+@app.get("/api/jobs/{job_id}/events")
+async def get_job_events(job_id: str, offset: int = 0):
+    """读取任务事件日志（从 offset 开始），用于获取批量任务生成的幻灯片。"""
+    info = await job_manager.backend.get(job_id)
+    if info is None:
+        return JSONResponse({"error": "生成任务不存在或已过期"}, status_code=404)
+    events = await job_manager.backend.events(job_id, max(0, offset))
+    return {"jobId": job_id, "status": info["status"], "offset": max(0, offset), "events": events}
+
+
 @app.post("/api/providers/save-key")
 async def save_api_key(request: dict):
     """验证 API Key 有效性并保存到 .env。"""
@@ -196,12 +440,18 @@ async def export_pdf(request: dict):
             {"html": "<div>...</div>", "imageUrl": "http://..."},
             ...
         ],
-        "title": "演示文稿标题"
+        "title": "演示文稿标题",
+        "mode": "screenshot",  // 可选，"vector" 输出可选中文字的矢量 PDF
+        "imageFormat": "png",  // 可选，截图编码 "png" / "jpeg" / "auto"（按页面内容选择）
+        "quality": 85,  // 可选，JPEG 质量 1-100
+        "scale": 2,  // 可选，截图缩放 1 / 1.5 / 2
+        "maxSizeMB": 10  // 可选，目标文件大小，超出时逐步降低 JPEG 质量与分辨率
     }
     """
     try:
         slides_data = request.get("slides", [])
         title = request.get("title", "演示文稿")
+        mode = request.get("mode", "screenshot")
         
         if not slides_data:
             return Response(
@@ -209,6 +459,20 @@ async def export_pdf(request: dict):
                 status_code=400,
                 media_type="text/plain"
             )
+        if mode not in PDF_MODES:
+            return Response(
+                content=f"未知导出模式: {mode}",
+                status_code=400,
+                media_type="text/plain"
+            )
+        try:
+            image_options = ImageOptions.from_request(request)
+        except (TypeError, ValueError) as e:
+            return Response(
+                content=f"图片选项无效: {e}",
+                status_code=400,
+                media_type="text/plain"
+            )
         
         # 构建每页的完整 HTML（包含背景图片，转换为 base64）
         slides_html = []
@@ -218,7 +482,7 @@ async def export_pdf(request: dict):
             
             # 转换图片 URL 为 base64
             if image_url:
-                image_base64 = PDFService._convert_image_to_base64(image_url)
+                image_base64 = await PDFService._convert_image_to_base64(image_url)
                 full_slide_html = f"""
 <div style="position: relative; width: 100%; height: 100%;">
     <img src="{image_base64}" style="position: absolute; inset: 0; width: 100%; height: 100%; object-fit: cover;" />
@@ -233,7 +497,7 @@ async def export_pdf(request: dict):
             slides_html.append(full_slide_html)
         
         # 生成 PDF
-        pdf_bytes = await PDFService.generate_pdf_from_html(slides_html, title)
+        pdf_bytes = await PDFService.generate_pdf_from_html(slides_html, title, mode, image_options)
         
         # 返回 PDF 文件 - 使用 RFC 5987 编码支持中文文件名
         from urllib.parse import quote
@@ -49,12 +49,20 @@ class FinalSlide(BaseModel):
 # --- WebSocket 消息 ---
 class WSMessage(BaseModel):
     """前端 → 后端的 WebSocket 消息"""
-    action: str           # "generate" | "cancel"
+    action: str           # "generate" | "attach" | "cancel" | "regenerate_slide"
     topic: str = ""
     provider: str = ""    # "qwen" | "gemini"，为空则自动检测
+    noCache: bool = False # 为 True 时跳过 LLM 响应缓存
+    jobId: str = ""       # attach：要重新连接的生成任务
+    offset: int = 0       # attach：从该序号开始回放任务事件
+    index: int = -1       # regenerate_slide：要重新生成的页码
+    mode: str = "design"  # regenerate_slide："design" 重新设计并配图 | "image" 只重新配图
+    imagePrompt: str = "" # regenerate_slide：替换配图提示词（可选）
+    outline: PlannerResult | None = None  # regenerate_slide：不指定 jobId 时直接提供大纲
+    design: DesignerResult | None = None  # regenerate_slide：mode 为 image 时该页现有设计
 
 
 class WSEvent(BaseModel):
     """后端 → 前端的 WebSocket 事件"""
-    event: str            # "status" | "outline" | "slide" | "done" | "error"
+    event: str            # "job" | "status" | "outline" | "slide" | "done" | "error"
     data: dict = {}
\ No newline at end of file
@@ -0,0 +1,99 @@
+import asyncio
+import logging
+from typing import AsyncIterator
+
+import config
+from services.job_backends import ACTIVE_STATUSES
+from services.job_service import JobManager
+
+logger = logging.getLogger(__name__)
+
+# 批次事件流中转发的单个任务事件（进度状态与部分 HTML 不转发，以批次进度事件代替）
+FORWARDED_EVENTS = {"outline", "slide", "done", "error"}
+
+
+def summarize(batch_id: str, jobs: list[dict]) -> dict:
+    """批次进度：各状态的任务数；所有任务都结束后 status 为 finished。"""
+    counts = {status: 0 for status in ("queued", "running", "done", "failed", "cancelled")}
+    for info in jobs:
+        counts[info["status"]] = counts.get(info["status"], 0) + 1
+    active = any(info["status"] in ACTIVE_STATUSES for info in jobs)
+    return {"batchId": batch_id, "status": "running" if active else "finished", "total": len(jobs), **counts}
+
+
+class BatchService:
+    """批量生成：一个批次即一组带相同 batch 标记的排队任务，进度与结果都从任务后端读取，
+    因此任意 worker 都能查询或跟随任意批次。"""
+
+    def __init__(self, jobs: JobManager):
+        self.jobs = jobs
+
+    async def submit(self, topics: list[str], provider: str = "", no_cache: bool = False) -> dict:
+        batch_id, job_ids = await self.jobs.submit_batch(topics, provider, no_cache)
+        logger.info(f"批次 {batch_id} 已提交：{len(job_ids)} 个主题")
+        return {"batchId": batch_id, "jobs": [{"jobId": j, "topic": t} for j, t in zip(job_ids, topics)]}
+
+    async def status(self, batch_id: str) -> dict | None:
+        """批次进度与各任务状态，批次不存在时返回 None。"""
+        jobs = await self.jobs.backend.batch_jobs(batch_id)
+        if not jobs:
+            return None
+        return {
+            **summarize(batch_id, jobs),
+            "jobs": [{"jobId": info["id"], "topic": info["topic"], "status": info["status"]} for info in jobs],
+        }
+
+    async def cancel(self, batch_id: str) -> int:
+        """取消批次中所有未结束的任务，返回取消的任务数。"""
+        cancelled = 0
+        for info in await self.jobs.backend.batch_jobs(batch_id):
+            if await self.jobs.cancel(info["id"]):
+                cancelled += 1
+        return cancelled
+
+    async def stream(self, batch_id: str) -> AsyncIterator[dict]:
+        """批次事件流：进度变化时产出 {"event": "batch"}，并转发各任务的大纲、幻灯片、完成与错误事件
+        （data.jobId 标明所属任务）。所有任务结束后停止。批次不存在时抛出 KeyError。
+
+        只跟随已开始执行的任务，排队中的任务不占用轮询。
+        """
+        jobs = await self.jobs.backend.batch_jobs(batch_id)
+        if not jobs:
+            raise KeyError(batch_id)
+
+        queue: asyncio.Queue = asyncio.Queue()
+        followers: dict[str, asyncio.Task] = {}
+
+        async def follow(job_id: str) -> None:
+            async for seq, event in self.jobs.attach(job_id):
+                if seq is not None and event["event"] in FORWARDED_EVENTS:
+                    await queue.put({"event": event["event"], "data": {**event["data"], "jobId": job_id}})
+
+        last: dict | None = None
+        try:
+            while True:
+                for info in jobs:
+                    if info["status"] != "queued" and info["id"] not in followers:
+                        followers[info["id"]] = asyncio.create_task(follow(info["id"]))
+                progress = summarize(batch_id, jobs)
+                finished = progress["status"] == "finished"
+                if finished:
+                    # 等各任务的剩余事件都转发完再产出最终进度
+                    await asyncio.gather(*followers.values(), return_exceptions=True)
+                while not queue.empty():
+                    yield queue.get_nowait()
+                if progress != last:
+                    last = progress
+                    yield {"event": "batch", "data": progress}
+                if finished:
+                    return
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=config.JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    event = None
+                if event is not None:
+                    yield event
+                jobs = await self.jobs.backend.batch_jobs(batch_id)
+        finally:
+            for task in followers.values():
+                task.cancel()
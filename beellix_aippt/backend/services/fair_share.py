@@ -0,0 +1,108 @@
+import asyncio
+import heapq
+import itertools
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+import config
+from utils.metrics import REGISTRY, Gauge
+
+
+class DeckShare:
+    """单个 deck（一次生成任务）在槽位调度器中的份额，weight 越大分到的槽位越多。"""
+
+    def __init__(self, scheduler: "FairShareScheduler", weight: float):
+        self.scheduler = scheduler
+        self.weight = max(weight, 1e-6)
+        # 该 deck 上一次请求的虚拟结束时间
+        self.finish = 0.0
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        await self.scheduler._acquire(self)
+        try:
+            yield
+        finally:
+            self.scheduler._release()
+
+
+class FairShareScheduler:
+    """进程级幻灯片槽位：本 worker 上所有任务（交互式与批量）的「设计 → 配图」共享 slots 个并发槽位。
+
+    等待中的请求按加权公平排队（start-time fair queuing）分配：每个 deck 维护虚拟时间，
+    每占用一个槽位前进 1/weight，槽位空出时交给虚拟起始时间最小的请求。
+    多个 deck 的页面因此交错执行，交互式 deck 权重更高，不会被大批量任务饿死。
+    slots 为 0 表示不限制。
+    """
+
+    def __init__(self, slots: int):
+        self.slots = slots
+        self._busy = 0
+        self._vtime = 0.0
+        self._waiters: list[tuple[float, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+
+    def share(self, weight: float) -> DeckShare:
+        return DeckShare(self, weight)
+
+    async def _acquire(self, share: DeckShare) -> None:
+        start = max(self._vtime, share.finish)
+        share.finish = start + 1 / share.weight
+        if self.slots <= 0:
+            return
+        if self._busy < self.slots and not self._waiters:
+            self._busy += 1
+            self._vtime = start
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (start, next(self._seq), fut))
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # 槽位已移交给本协程但它被取消了，转交给下一个等待者
+                self._release()
+            else:
+                fut.cancel()
+            raise
+
+    def _release(self) -> None:
+        if self.slots <= 0:
+            return
+        while self._waiters:
+            start, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                self._vtime = start
+                fut.set_result(None)  # 槽位直接移交，_busy 不变
+                return
+        self._busy -= 1
+
+    def snapshot(self) -> dict:
+        return {
+            "slots": self.slots,
+            "busy": self._busy,
+            "waiting": sum(1 for _, _, fut in self._waiters if not fut.done()),
+        }
+
+
+_scheduler: FairShareScheduler | None = None
+
+
+def get_slide_scheduler() -> FairShareScheduler:
+    """返回进程级幻灯片槽位调度器。"""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = FairShareScheduler(config.SLIDE_GLOBAL_CONCURRENCY)
+    return _scheduler
+
+
+REGISTRY.register(Gauge(
+    "beellix_slide_slots_busy",
+    "Slide design/image slots currently in use on this worker.",
+    collect=lambda: {(): _scheduler._busy if _scheduler else 0},
+))
+REGISTRY.register(Gauge(
+    "beellix_slide_slots_waiting",
+    "Slides waiting for a design/image slot on this worker.",
+    collect=lambda: {(): _scheduler.snapshot()["waiting"] if _scheduler else 0},
+))
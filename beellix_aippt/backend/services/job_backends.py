@@ -0,0 +1,623 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# 未结束的任务状态：queued 等待 worker 领取，running 由持有租约的 worker 执行
+ACTIVE_STATUSES = ("queued", "running")
+
+
+class JobBackend(ABC):
+    """生成任务的共享状态：任务表、工作队列与租约、追加写事件日志、各页最新的部分 HTML、取消标记。
+
+    多个 worker 进程通过同一个后端协作：任意 worker 都可以创建任务、领取排队的任务、
+    读取其他 worker 正在执行的任务的事件。运行中的任务由持有租约的 worker 定期续约，
+    租约过期（worker 崩溃）后其他 worker 可重新领取并从断点继续。
+
+    批量任务带有 batch（批次 id）与 batch_index（在批次中的序号），与交互式任务分开排队；
+    批量任务按 batch_index 领取，多个批次的任务因此轮流执行。
+    """
+
+    @abstractmethod
+    async def create(
+        self, job_id: str, topic: str, provider: str, no_cache: bool, batch: str = "", batch_index: int = 0
+    ) -> None:
+        """创建 queued 状态的任务；batch 为空表示交互式任务。"""
+
+    @abstractmethod
+    async def get(self, job_id: str) -> dict | None:
+        """返回 {id, topic, provider, noCache, status, worker, batch}，不存在时返回 None。"""
+
+    @abstractmethod
+    async def claim(
+        self, worker_id: str, lease: float, job_id: str | None = None, batch: bool = False
+    ) -> dict | None:
+        """领取指定任务，或排在最前 / 租约已过期的交互式（batch=False）或批量（batch=True）任务；
+        成功时返回任务信息并置为 running。"""
+
+    @abstractmethod
+    async def batch_jobs(self, batch_id: str) -> list[dict]:
+        """批次中的所有任务信息，按 batch_index 排序；批次不存在时返回空列表。"""
+
+    @abstractmethod
+    async def renew(self, job_id: str, worker_id: str, lease: float) -> bool:
+        """续约；任务已被其他 worker 接管或已结束时返回 False。"""
+
+    @abstractmethod
+    async def release(self, job_id: str, worker_id: str) -> None:
+        """放弃租约但保持 running，其他 worker 可立即接管。"""
+
+    @abstractmethod
+    async def finish(self, job_id: str, status: str) -> None:
+        """标记任务结束（done / failed / cancelled）。"""
+
+    @abstractmethod
+    async def append(self, job_id: str, seq: int, event: dict) -> None:
+        """在事件日志末尾追加第 seq 个事件。"""
+
+    @abstractmethod
+    async def append_next(self, job_id: str, event: dict) -> int:
+        """在事件日志末尾追加事件，序号由后端原子分配并返回。
+
+        用于没有单一写入方的追加（已结束任务的重新生成、取消排队中的任务），并发追加不会序号冲突。
+        """
+
+    @abstractmethod
+    async def events(self, job_id: str, offset: int = 0) -> list[dict]:
+        """返回 seq >= offset 的事件。"""
+
+    @abstractmethod
+    async def set_partial(self, job_id: str, index: int, event: dict) -> None:
+        """记录某页最新的 slide_partial 事件（覆盖写，不进入事件日志）。"""
+
+    @abstractmethod
+    async def partials(self, job_id: str) -> dict[int, dict]:
+        """各页最新的 slide_partial 事件。"""
+
+    @abstractmethod
+    async def request_cancel(self, job_id: str) -> None:
+        ...
+
+    @abstractmethod
+    async def cancel_requested(self, job_id: str) -> bool:
+        ...
+
+    async def purge(self, before: float) -> None:
+        """删除 before 之前已结束的任务。"""
+
+    async def close(self) -> None:
+        pass
+
+
+class MemoryJobBackend(JobBackend):
+    """进程内后端，仅适用于单进程开发环境，重启后任务丢失。"""
+
+    def __init__(self):
+        self._jobs: dict[str, dict] = {}
+        self._events: dict[str, list[dict]] = {}
+        self._partials: dict[str, dict[int, dict]] = {}
+
+    async def create(
+        self, job_id: str, topic: str, provider: str, no_cache: bool, batch: str = "", batch_index: int = 0
+    ) -> None:
+        now = time.time()
+        self._jobs[job_id] = {
+            "id": job_id, "topic": topic, "provider": provider, "noCache": no_cache, "status": "queued",
+            "worker": "", "batch": batch, "batchIndex": batch_index, "leaseUntil": 0.0, "cancel": False,
+            "createdAt": now, "updatedAt": now,
+        }
+        self._events[job_id] = []
+        self._partials[job_id] = {}
+
+    async def get(self, job_id: str) -> dict | None:
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        return {k: job[k] for k in ("id", "topic", "provider", "noCache", "status", "worker", "batch")}
+
+    async def claim(
+        self, worker_id: str, lease: float, job_id: str | None = None, batch: bool = False
+    ) -> dict | None:
+        now = time.time()
+        if job_id is not None:
+            candidates = [self._jobs[job_id]] if job_id in self._jobs else []
+        else:
+            candidates = sorted(
+                (j for j in self._jobs.values() if bool(j["batch"]) == batch),
+                key=lambda j: (j["batchIndex"], j["createdAt"]),
+            )
+        for job in candidates:
+            if job["status"] == "queued" or (job["status"] == "running" and job["leaseUntil"] < now):
+                job.update(status="running", worker=worker_id, leaseUntil=now + lease, updatedAt=now)
+                return await self.get(job["id"])
+        return None
+
+    async def batch_jobs(self, batch_id: str) -> list[dict]:
+        jobs = sorted((j for j in self._jobs.values() if j["batch"] == batch_id), key=lambda j: j["batchIndex"])
+        return [await self.get(j["id"]) for j in jobs]
+
+    async def renew(self, job_id: str, worker_id: str, lease: float) -> bool:
+        job = self._jobs.get(job_id)
+        if job is None or job["status"] != "running" or job["worker"] != worker_id:
+            return False
+        job["leaseUntil"] = time.time() + lease
+        return True
+
+    async def release(self, job_id: str, worker_id: str) -> None:
+        job = self._jobs.get(job_id)
+        if job is not None and job["worker"] == worker_id:
+            job["leaseUntil"] = 0.0
+
+    async def finish(self, job_id: str, status: str) -> None:
+        job = self._jobs[job_id]
+        job.update(status=status, leaseUntil=0.0, updatedAt=time.time())
+        self._partials[job_id] = {}
+
+    async def append(self, job_id: str, seq: int, event: dict) -> None:
+        events = self._events[job_id]
+        if seq != len(events):
+            raise RuntimeError(f"任务 {job_id} 事件序号冲突: {seq} != {len(events)}")
+        events.append(event)
+
+    async def append_next(self, job_id: str, event: dict) -> int:
+        events = self._events[job_id]
+        events.append(event)
+        return len(events) - 1
+
+    async def events(self, job_id: str, offset: int = 0) -> list[dict]:
+        return self._events.get(job_id, [])[offset:]
+
+    async def set_partial(self, job_id: str, index: int, event: dict) -> None:
+        self._partials[job_id][index] = event
+
+    async def partials(self, job_id: str) -> dict[int, dict]:
+        return dict(self._partials.get(job_id, {}))
+
+    async def request_cancel(self, job_id: str) -> None:
+        if job_id in self._jobs:
+            self._jobs[job_id]["cancel"] = True
+
+    async def cancel_requested(self, job_id: str) -> bool:
+        return job_id in self._jobs and self._jobs[job_id]["cancel"]
+
+    async def purge(self, before: float) -> None:
+        expired = [
+            j["id"] for j in self._jobs.values() if j["status"] not in ACTIVE_STATUSES and j["updatedAt"] < before
+        ]
+        for job_id in expired:
+            del self._jobs[job_id], self._events[job_id], self._partials[job_id]
+
+
+class SQLiteJobBackend(JobBackend):
+    """SQLite 后端（WAL 模式），同一台机器上的多个 worker 进程共享同一个数据库文件。"""
+
+    def __init__(self, path: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # 自动提交模式，领取任务时用 BEGIN IMMEDIATE 显式加写锁，保证跨进程原子
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                topic TEXT NOT NULL,
+                provider TEXT NOT NULL,
+                no_cache INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                worker TEXT NOT NULL DEFAULT '',
+                lease_until REAL NOT NULL DEFAULT 0,
+                cancel INTEGER NOT NULL DEFAULT 0,
+                batch TEXT NOT NULL DEFAULT '',
+                batch_index INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )"""
+        )
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS job_events (
+                job_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                event TEXT NOT NULL,
+                PRIMARY KEY (job_id, seq)
+            )"""
+        )
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS job_partials (
+                job_id TEXT NOT NULL,
+                slide_index INTEGER NOT NULL,
+                event TEXT NOT NULL,
+                PRIMARY KEY (job_id, slide_index)
+            )"""
+        )
+        # 兼容旧版任务表：补齐租约与批次字段，遗留的 running 任务租约为 0，启动后即可被接管
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        for name, ddl in (
+            ("worker", "TEXT NOT NULL DEFAULT ''"),
+            ("lease_until", "REAL NOT NULL DEFAULT 0"),
+            ("cancel", "INTEGER NOT NULL DEFAULT 0"),
+            ("batch", "TEXT NOT NULL DEFAULT ''"),
+            ("batch_index", "INTEGER NOT NULL DEFAULT 0"),
+        ):
+            if name not in columns:
+                self._db.execute(f"ALTER TABLE jobs ADD COLUMN {name} {ddl}")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_batch ON jobs (batch, batch_index)")
+
+    def _execute(self, sql: str, params: tuple = ()) -> int:
+        """执行写语句，返回受影响的行数。"""
+        with self._lock:
+            return self._db.execute(sql, params).rowcount
+
+    def _query(self, sql: str, params: tuple = ()) -> list[tuple]:
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    _COLUMNS = "id, topic, provider, no_cache, status, worker, batch"
+
+    @staticmethod
+    def _row(row: tuple) -> dict:
+        return {
+            "id": row[0], "topic": row[1], "provider": row[2], "noCache": bool(row[3]),
+            "status": row[4], "worker": row[5], "batch": row[6],
+        }
+
+    def _get(self, job_id: str) -> dict | None:
+        rows = self._query(f"SELECT {self._COLUMNS} FROM jobs WHERE id = ?", (job_id,))
+        return self._row(rows[0]) if rows else None
+
+    def _claim(self, worker_id: str, lease: float, job_id: str | None, batch: bool) -> dict | None:
+        now = time.time()
+        claimable = "(status = 'queued' OR (status = 'running' AND lease_until < ?))"
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                if job_id is None:
+                    row = self._db.execute(
+                        f"SELECT id FROM jobs WHERE {claimable} AND (batch != '') = ?"
+                        " ORDER BY batch_index, created_at LIMIT 1",
+                        (now, batch),
+                    ).fetchone()
+                    job_id = row[0] if row else None
+                claimed = job_id is not None and self._db.execute(
+                    f"UPDATE jobs SET status = 'running', worker = ?, lease_until = ?, updated_at = ?"
+                    f" WHERE id = ? AND {claimable}",
+                    (worker_id, now + lease, now, job_id, now),
+                ).rowcount == 1
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return self._get(job_id) if claimed else None
+
+    def _batch_jobs(self, batch_id: str) -> list[dict]:
+        rows = self._query(f"SELECT {self._COLUMNS} FROM jobs WHERE batch = ? ORDER BY batch_index", (batch_id,))
+        return [self._row(row) for row in rows]
+
+    def _renew(self, job_id: str, worker_id: str, lease: float) -> bool:
+        return self._execute(
+            "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'running'",
+            (time.time() + lease, job_id, worker_id),
+        ) == 1
+
+    def _finish(self, job_id: str, status: str) -> None:
+        self._execute(
+            "UPDATE jobs SET status = ?, lease_until = 0, updated_at = ? WHERE id = ?", (status, time.time(), job_id)
+        )
+        self._execute("DELETE FROM job_partials WHERE job_id = ?", (job_id,))
+
+    def _append_next(self, job_id: str, event: str) -> int:
+        # 在同一个写事务内取最大序号并插入，跨进程原子
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                seq = self._db.execute(
+                    "SELECT COALESCE(MAX(seq) + 1, 0) FROM job_events WHERE job_id = ?", (job_id,)
+                ).fetchone()[0]
+                self._db.execute("INSERT INTO job_events (job_id, seq, event) VALUES (?, ?, ?)", (job_id, seq, event))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return seq
+
+    def _events(self, job_id: str, offset: int) -> list[dict]:
+        rows = self._query(
+            "SELECT event FROM job_events WHERE job_id = ? AND seq >= ? ORDER BY seq", (job_id, offset)
+        )
+        return [json.loads(row[0]) for row in rows]
+
+    def _partials(self, job_id: str) -> dict[int, dict]:
+        rows = self._query("SELECT slide_index, event FROM job_partials WHERE job_id = ?", (job_id,))
+        return {index: json.loads(event) for index, event in rows}
+
+    def _purge(self, before: float) -> None:
+        finished = "SELECT id FROM jobs WHERE status NOT IN ('queued', 'running') AND updated_at < ?"
+        self._execute(f"DELETE FROM job_events WHERE job_id IN ({finished})", (before,))
+        self._execute(f"DELETE FROM job_partials WHERE job_id IN ({finished})", (before,))
+        self._execute("DELETE FROM jobs WHERE status NOT IN ('queued', 'running') AND updated_at < ?", (before,))
+
+    async def create(
+        self, job_id: str, topic: str, provider: str, no_cache: bool, batch: str = "", batch_index: int = 0
+    ) -> None:
+        now = time.time()
+        await asyncio.to_thread(
+            self._execute,
+            "INSERT INTO jobs (id, topic, provider, no_cache, status, batch, batch_index, created_at, updated_at)"
+            " VALUES (?, ?, ?, ?, 'queued', ?, ?, ?, ?)",
+            (job_id, topic, provider, int(no_cache), batch, batch_index, now, now),
+        )
+
+    async def get(self, job_id: str) -> dict | None:
+        return await asyncio.to_thread(self._get, job_id)
+
+    async def claim(
+        self, worker_id: str, lease: float, job_id: str | None = None, batch: bool = False
+    ) -> dict | None:
+        return await asyncio.to_thread(self._claim, worker_id, lease, job_id, batch)
+
+    async def batch_jobs(self, batch_id: str) -> list[dict]:
+        return await asyncio.to_thread(self._batch_jobs, batch_id)
+
+    async def renew(self, job_id: str, worker_id: str, lease: float) -> bool:
+        return await asyncio.to_thread(self._renew, job_id, worker_id, lease)
+
+    async def release(self, job_id: str, worker_id: str) -> None:
+        await asyncio.to_thread(
+            self._execute, "UPDATE jobs SET lease_until = 0 WHERE id = ? AND worker = ?", (job_id, worker_id)
+        )
+
+    async def finish(self, job_id: str, status: str) -> None:
+        await asyncio.to_thread(self._finish, job_id, status)
+
+    async def append(self, job_id: str, seq: int, event: dict) -> None:
+        await asyncio.to_thread(
+            self._execute,
+            "INSERT INTO job_events (job_id, seq, event) VALUES (?, ?, ?)",
+            (job_id, seq, json.dumps(event, ensure_ascii=False)),
+        )
+
+    async def append_next(self, job_id: str, event: dict) -> int:
+        return await asyncio.to_thread(self._append_next, job_id, json.dumps(event, ensure_ascii=False))
+
+    async def events(self, job_id: str, offset: int = 0) -> list[dict]:
+        return await asyncio.to_thread(self._events, job_id, offset)
+
+    async def set_partial(self, job_id: str, index: int, event: dict) -> None:
+        await asyncio.to_thread(
+            self._execute,
+            "INSERT OR REPLACE INTO job_partials (job_id, slide_index, event) VALUES (?, ?, ?)",
+            (job_id, index, json.dumps(event, ensure_ascii=False)),
+        )
+
+    async def partials(self, job_id: str) -> dict[int, dict]:
+        return await asyncio.to_thread(self._partials, job_id)
+
+    async def request_cancel(self, job_id: str) -> None:
+        await asyncio.to_thread(self._execute, "UPDATE jobs SET cancel = 1 WHERE id = ?", (job_id,))
+
+    async def cancel_requested(self, job_id: str) -> bool:
+        rows = await asyncio.to_thread(self._query, "SELECT cancel FROM jobs WHERE id = ?", (job_id,))
+        return bool(rows and rows[0][0])
+
+    async def purge(self, before: float) -> None:
+        await asyncio.to_thread(self._purge, before)
+
+
+# 租约相关的读-改-写都在 Lua 脚本中原子执行，避免检查与写入之间被其他 worker 接管
+#
+# 续约 / 放弃租约：KEYS = [任务哈希, 租约集合]，ARGV = [worker, 新的到期时间, 任务 id]。
+# 任务仍由该 worker 执行且租约仍在集合中（未被其他 worker 移除接管）时更新到期时间并返回 1，否则返回 0
+_REDIS_SET_LEASE = """
+local status = redis.call('HGET', KEYS[1], 'status')
+local worker = redis.call('HGET', KEYS[1], 'worker')
+if status ~= 'running' or worker ~= ARGV[1] or not redis.call('ZSCORE', KEYS[2], ARGV[3]) then
+    return 0
+end
+redis.call('ZADD', KEYS[2], ARGV[2], ARGV[3])
+return 1
+"""
+
+# 接管租约已过期的任务：KEYS = [任务哈希, 租约集合]，ARGV = [当前时间, worker, 新的到期时间, 任务 id]。
+# 租约仍在集合中且已过期时改写 worker 与到期时间并返回 1，否则返回 0
+_REDIS_TAKE_EXPIRED = """
+local score = redis.call('ZSCORE', KEYS[2], ARGV[4])
+if not score or tonumber(score) >= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'status', 'running', 'worker', ARGV[2])
+redis.call('ZADD', KEYS[2], ARGV[3], ARGV[4])
+return 1
+"""
+
+
+# 按序号追加事件：KEYS = [事件列表]，ARGV = [序号, 事件]。列表长度等于序号时追加并返回 -1，否则不追加、返回当前长度
+_REDIS_APPEND_AT = """
+local length = redis.call('LLEN', KEYS[1])
+if length ~= tonumber(ARGV[1]) then
+    return length
+end
+redis.call('RPUSH', KEYS[1], ARGV[2])
+return -1
+"""
+
+
+class RedisJobBackend(JobBackend):
+    """Redis 兼容服务（Redis / Valkey / KeyDB 等）后端，可跨机器部署多个 worker。
+
+    需要安装可选依赖：uv sync --extra redis
+    """
+
+    _PREFIX = "beellix:job"
+
+    def __init__(self, url: str):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("JOB_BACKEND=redis 需要安装 redis 依赖：uv sync --extra redis") from e
+        self._redis = redis.from_url(url, decode_responses=True)
+        # 交互式任务队列（列表，先进先出）与批量任务队列（有序集合，score 为 batch_index）
+        self._queue = f"{self._PREFIX}s:queue"
+        self._batch_queue = f"{self._PREFIX}s:batch_queue"
+        self._set_lease = self._redis.register_script(_REDIS_SET_LEASE)
+        self._take_expired = self._redis.register_script(_REDIS_TAKE_EXPIRED)
+        self._append_at = self._redis.register_script(_REDIS_APPEND_AT)
+
+    def _key(self, job_id: str, suffix: str = "") -> str:
+        return f"{self._PREFIX}:{job_id}{':' + suffix if suffix else ''}"
+
+    def _leases(self, batch: bool) -> str:
+        """运行中任务的租约到期时间（有序集合，score 为到期时间戳），交互式与批量任务分开存放。"""
+        return f"{self._PREFIX}s:{'batch_leases' if batch else 'leases'}"
+
+    @staticmethod
+    def _batch_key(batch_id: str) -> str:
+        return f"beellix:batch:{batch_id}"
+
+    async def create(
+        self, job_id: str, topic: str, provider: str, no_cache: bool, batch: str = "", batch_index: int = 0
+    ) -> None:
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self._key(job_id), mapping={
+                "id": job_id, "topic": topic, "provider": provider, "noCache": int(no_cache),
+                "status": "queued", "worker": "", "cancel": 0, "batch": batch,
+            })
+            if batch:
+                pipe.zadd(self._batch_queue, {job_id: batch_index})
+                pipe.rpush(self._batch_key(batch), job_id)
+            else:
+                pipe.lpush(self._queue, job_id)
+            await pipe.execute()
+
+    async def get(self, job_id: str) -> dict | None:
+        data = await self._redis.hgetall(self._key(job_id))
+        if not data:
+            return None
+        return {
+            "id": data["id"], "topic": data["topic"], "provider": data["provider"],
+            "noCache": data["noCache"] == "1", "status": data["status"], "worker": data["worker"],
+            "batch": data.get("batch", ""),
+        }
+
+    async def _take_if_expired(self, job_id: str, worker_id: str, lease: float, batch: bool) -> dict | None:
+        now = time.time()
+        taken = await self._take_expired(
+            keys=[self._key(job_id), self._leases(batch)], args=[now, worker_id, now + lease, job_id]
+        )
+        return await self.get(job_id) if taken == 1 else None
+
+    async def _take(self, job_id: str, worker_id: str, lease: float, batch: bool) -> dict:
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self._key(job_id), mapping={"status": "running", "worker": worker_id})
+            pipe.zadd(self._leases(batch), {job_id: time.time() + lease})
+            await pipe.execute()
+        return await self.get(job_id)
+
+    async def claim(
+        self, worker_id: str, lease: float, job_id: str | None = None, batch: bool = False
+    ) -> dict | None:
+        # 排队任务以 LREM / ZPOPMIN / RPOP 的返回值作为互斥：只有成功移除的 worker 获得任务；
+        # 租约过期的任务由脚本原子地检查并改写租约，原 worker 随后续约失败
+        if job_id is not None:
+            batch = bool(await self._redis.hget(self._key(job_id), "batch"))
+            queued = (
+                await self._redis.zrem(self._batch_queue, job_id) if batch
+                else await self._redis.lrem(self._queue, 1, job_id)
+            )
+            if queued == 1:
+                return await self._take(job_id, worker_id, lease, batch)
+            return await self._take_if_expired(job_id, worker_id, lease, batch)
+
+        for expired in await self._redis.zrangebyscore(self._leases(batch), "-inf", time.time(), start=0, num=5):
+            info = await self._take_if_expired(expired, worker_id, lease, batch)
+            if info is not None:
+                return info
+        if batch:
+            popped = await self._redis.zpopmin(self._batch_queue)
+            queued = popped[0][0] if popped else None
+        else:
+            queued = await self._redis.rpop(self._queue)
+        return await self._take(queued, worker_id, lease, batch) if queued else None
+
+    async def batch_jobs(self, batch_id: str) -> list[dict]:
+        infos = [await self.get(job_id) for job_id in await self._redis.lrange(self._batch_key(batch_id), 0, -1)]
+        return [info for info in infos if info is not None]
+
+    async def _update_lease(self, job_id: str, worker_id: str, until: float) -> bool:
+        # batch 字段创建后不变，可以在脚本外读取
+        batch = await self._redis.hget(self._key(job_id), "batch")
+        updated = await self._set_lease(
+            keys=[self._key(job_id), self._leases(bool(batch))], args=[worker_id, until, job_id]
+        )
+        return updated == 1
+
+    async def renew(self, job_id: str, worker_id: str, lease: float) -> bool:
+        return await self._update_lease(job_id, worker_id, time.time() + lease)
+
+    async def release(self, job_id: str, worker_id: str) -> None:
+        await self._update_lease(job_id, worker_id, 0)
+
+    async def finish(self, job_id: str, status: str) -> None:
+        ttl = int(config.JOB_RETENTION)
+        batch = await self._redis.hget(self._key(job_id), "batch")
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self._key(job_id), "status", status)
+            pipe.zrem(self._leases(bool(batch)), job_id)
+            pipe.delete(self._key(job_id, "partials"))
+            pipe.expire(self._key(job_id), ttl)
+            pipe.expire(self._key(job_id, "events"), ttl)
+            if batch:
+                pipe.expire(self._batch_key(batch), ttl)
+            await pipe.execute()
+
+    async def append(self, job_id: str, seq: int, event: dict) -> None:
+        # 序号冲突（如失去租约的 worker 仍在发布）时不写入，避免其他客户端回放到错误的事件
+        length = await self._append_at(
+            keys=[self._key(job_id, "events")], args=[seq, json.dumps(event, ensure_ascii=False)]
+        )
+        if length != -1:
+            raise RuntimeError(f"任务 {job_id} 事件序号冲突: {seq} != {length}")
+
+    async def append_next(self, job_id: str, event: dict) -> int:
+        # RPUSH 返回追加后的长度，本身即原子分配的序号
+        return await self._redis.rpush(self._key(job_id, "events"), json.dumps(event, ensure_ascii=False)) - 1
+
+    async def events(self, job_id: str, offset: int = 0) -> list[dict]:
+        return [json.loads(e) for e in await self._redis.lrange(self._key(job_id, "events"), offset, -1)]
+
+    async def set_partial(self, job_id: str, index: int, event: dict) -> None:
+        await self._redis.hset(self._key(job_id, "partials"), str(index), json.dumps(event, ensure_ascii=False))
+
+    async def partials(self, job_id: str) -> dict[int, dict]:
+        data = await self._redis.hgetall(self._key(job_id, "partials"))
+        return {int(index): json.loads(event) for index, event in data.items()}
+
+    async def request_cancel(self, job_id: str) -> None:
+        await self._redis.hset(self._key(job_id), "cancel", 1)
+
+    async def cancel_requested(self, job_id: str) -> bool:
+        return await self._redis.hget(self._key(job_id), "cancel") == "1"
+
+    async def close(self) -> None:
+        await self._redis.aclose()
+
+
+def get_job_backend() -> JobBackend:
+    """按 JOB_BACKEND 创建任务后端："memory" / "sqlite" / "redis"。"""
+    kind = config.JOB_BACKEND
+    if kind == "memory":
+        if config.WORKERS > 1:
+            logger.warning("JOB_BACKEND=memory 不支持多 worker，各 worker 的任务互不可见")
+        return MemoryJobBackend()
+    if kind == "sqlite":
+        return SQLiteJobBackend(config.JOBS_DB_PATH)
+    if kind == "redis":
+        return RedisJobBackend(config.JOB_REDIS_URL)
+    raise ValueError(f"未知任务后端: {kind}")
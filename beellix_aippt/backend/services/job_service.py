@@ -0,0 +1,402 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Callable
+
+import config
+from llm.cache import set_cache_bypass
+from llm.context import set_session_class
+from llm.router import ProviderRouter
+from models import DesignerResult, FinalSlide, PlannerResult, WSEvent
+from services.fair_share import get_slide_scheduler
+from services.job_backends import ACTIVE_STATUSES, JobBackend
+from services.ppt_service import Checkpoint, PPTService
+from utils.metrics import REGISTRY, Histogram
+from utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+# 清理过期任务的最长间隔（秒）；保留时长较短时按其四分之一清理
+_PURGE_INTERVAL = 3600
+
+# 不写入事件日志的高频事件：本进程订阅者实时推送，其他 worker 只能读到各页最新一条
+EPHEMERAL_EVENTS = {"slide_partial"}
+
+
+def build_checkpoint(events: list[dict]) -> Checkpoint | None:
+    """从事件日志还原断点。
+
+    每次从头生成以 planning 状态事件开始；最近一次生成已产出完整大纲时，
+    该次生成中完成的页（包括大纲写完前提前完成的页）都视为已完成，否则返回 None 表示需从头生成。
+    """
+    checkpoint: Checkpoint | None = None
+    completed: set[int] = set()
+    for event in events:
+        kind, data = event["event"], event["data"]
+        if kind == "status" and data.get("status") == "planning":
+            checkpoint, completed = None, set()
+        elif kind == "outline":
+            checkpoint = Checkpoint(outline=PlannerResult(**data), completed=completed)
+        elif kind == "slide":
+            completed.add(data["index"])
+    return checkpoint
+
+
+CANCEL_TO_IDLE = REGISTRY.register(Histogram(
+    "beellix_cancel_to_idle_seconds",
+    "Time from a cancel request until all of the job's coroutines and upstream calls have stopped.",
+))
+
+
+class CancelLatency:
+    """取消到空闲的耗时：从本 worker 收到取消请求（或在维护循环中读到其他 worker 写入的取消标记）
+    到该任务的所有规划 / 设计 / 配图协程与上游请求都已终止。"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.last = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.last = seconds
+        self.max = max(self.max, seconds)
+        CANCEL_TO_IDLE.observe(seconds)
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "lastMs": round(self.last * 1000),
+            "avgMs": round(self.total / self.count * 1000) if self.count else 0,
+            "maxMs": round(self.max * 1000),
+        }
+
+
+@dataclass
+class Job:
+    """本 worker 正在执行的生成任务。events 为已写入日志的事件，下标即 seq。"""
+    id: str
+    topic: str
+    provider: str
+    no_cache: bool
+    batch: str = ""
+    events: list[dict] = field(default_factory=list)
+    subscribers: set[asyncio.Queue] = field(default_factory=set)
+    cancel_event: asyncio.Event = field(default_factory=asyncio.Event)
+    cancelled_at: float | None = None  # 收到取消请求的时刻（monotonic）
+    task: asyncio.Task | None = None
+
+
+class JobManager:
+    """生成任务管理：任务在服务端独立运行，不随 WebSocket 断开而终止。
+
+    任务状态保存在共享的 JobBackend 中，多个 worker 进程协作：
+      - 接收 WebSocket 的 worker 创建任务，有空闲容量时直接领取执行，否则留在队列中由其他 worker 领取
+      - 每个 worker 定期续约自己执行的任务、响应取消标记，并领取排队或租约过期（worker 崩溃）的任务，
+        接管的任务从事件日志还原断点继续生成
+      - 任意 worker 都可以 attach 任意任务，从 offset 回放事件日志并继续跟随
+
+    批量任务（submit_batch）只进入队列，由各 worker 在 BATCH_WORKER_CONCURRENCY 的名额内领取；
+    交互式任务另有 JOB_WORKER_CONCURRENCY 个名额，两者的页面再由进程级槽位调度器按权重交错执行。
+    """
+
+    def __init__(self, backend: JobBackend, router_factory: Callable[[str, str], ProviderRouter]):
+        self.backend = backend
+        self.router_factory = router_factory
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._jobs: dict[str, Job] = {}
+        self._maintain_task: asyncio.Task | None = None
+        self._last_purge = 0.0
+        self.cancel_latency = CancelLatency()
+
+    async def start(self, topic: str, provider: str = "", api_key: str = "", no_cache: bool = False) -> str:
+        """创建任务并尽量在本 worker 上执行，返回任务 id。"""
+        router = self.router_factory(provider, api_key)
+        job_id = uuid.uuid4().hex
+        await self.backend.create(job_id, topic, router.preferred, no_cache)
+        await self.backend.append(job_id, 0, WSEvent(event="job", data={"jobId": job_id, "topic": topic}).model_dump())
+        # 用户临时填写的 API Key 不写入共享后端，只能在本 worker 执行
+        if api_key or self._running(batch=False) < config.JOB_WORKER_CONCURRENCY:
+            info = await self.backend.claim(self.worker_id, config.JOB_LEASE_SECONDS, job_id)
+            if info is not None:
+                await self._launch(info, router)
+        return job_id
+
+    async def submit_batch(
+        self, topics: list[str], provider: str = "", no_cache: bool = False
+    ) -> tuple[str, list[str]]:
+        """创建一批排队的生成任务，返回 (批次 id, 各主题的任务 id)。批量任务只使用服务端配置的 Key。"""
+        router = self.router_factory(provider, "")
+        batch_id = uuid.uuid4().hex
+        job_ids = []
+        for index, topic in enumerate(topics):
+            job_id = uuid.uuid4().hex
+            await self.backend.create(job_id, topic, router.preferred, no_cache, batch_id, index)
+            await self.backend.append(job_id, 0, WSEvent(event="job", data={
+                "jobId": job_id, "topic": topic, "batchId": batch_id,
+            }).model_dump())
+            job_ids.append(job_id)
+        await self._claim_pending()
+        return batch_id, job_ids
+
+    async def run(self) -> None:
+        """启动后台维护循环：续约、响应取消、领取排队任务、定期清理过期任务。"""
+        await self._purge()
+        self._maintain_task = asyncio.create_task(self._maintain())
+
+    async def shutdown(self) -> None:
+        """进程退出时停止本地任务并释放租约，任务保持 running，由其他 worker 或重启后的进程接管。"""
+        if self._maintain_task:
+            self._maintain_task.cancel()
+        jobs = list(self._jobs.values())
+        for job in jobs:
+            job.task.cancel()
+        await asyncio.gather(*(job.task for job in jobs), return_exceptions=True)
+        for job in jobs:
+            await self.backend.release(job.id, self.worker_id)
+        await self.backend.close()
+
+    async def cancel(self, job_id: str) -> bool:
+        """请求取消任务；任务在其他 worker 上执行时由其在下一次维护循环中响应，尚在排队的任务直接结束。"""
+        info = await self.backend.get(job_id)
+        if info is None or info["status"] not in ACTIVE_STATUSES:
+            return False
+        await self.backend.request_cancel(job_id)
+        job = self._jobs.get(job_id)
+        if job is not None:
+            self._cancel_local(job)
+        elif info["status"] == "queued" and await self.backend.claim(
+            self.worker_id, config.JOB_LEASE_SECONDS, job_id
+        ) is not None:
+            await self.backend.append_next(job_id, WSEvent(event="error", data={"message": "已取消生成"}).model_dump())
+            await self.backend.finish(job_id, "cancelled")
+        return True
+
+    async def regenerate_slide(
+        self,
+        job_id: str,
+        index: int,
+        redesign: bool = True,
+        image_prompt: str = "",
+        provider: str = "",
+        api_key: str = "",
+    ) -> tuple[int | None, FinalSlide]:
+        """按任务事件日志中的大纲（以及 redesign=False 时该页现有的设计）重新生成一页，返回 (seq, 新幻灯片)。
+
+        任务已结束时新的 slide 事件追加到日志末尾，重连回放得到的是替换后的页面；任务仍在运行时不写日志，seq 为 None。
+        任务不存在时抛出 KeyError，尚无大纲或该页尚未生成时抛出 ValueError。
+        """
+        info = await self.backend.get(job_id)
+        if info is None:
+            raise KeyError(job_id)
+        events = await self.backend.events(job_id)
+        outline: PlannerResult | None = None
+        design: DesignerResult | None = None
+        for event in events:
+            if event["event"] == "outline":
+                outline = PlannerResult(**event["data"])
+            elif event["event"] == "slide" and event["data"]["index"] == index:
+                design = DesignerResult(**event["data"]["design"])
+        if outline is None:
+            raise ValueError("任务尚未生成大纲")
+        if not redesign and design is None:
+            raise ValueError(f"第 {index + 1} 页尚未生成")
+
+        router = self.router_factory(provider or info["provider"], api_key)
+        service = PPTService(router, share=get_slide_scheduler().share(config.INTERACTIVE_SHARE_WEIGHT))
+        slide = await service.regenerate_slide(outline, index, None if redesign else design, image_prompt)
+
+        seq = None
+        info = await self.backend.get(job_id)
+        if info is not None and info["status"] not in ACTIVE_STATUSES:
+            # 同一任务的多次重新生成可能同时完成，序号由后端分配
+            seq = await self.backend.append_next(job_id, WSEvent(event="slide", data=slide.model_dump()).model_dump())
+        return seq, slide
+
+    async def attach(self, job_id: str, offset: int = 0) -> AsyncIterator[tuple[int | None, dict]]:
+        """从 offset 开始回放任务事件，任务未结束时继续推送后续事件，产出 (seq, event)。
+
+        不写入日志的临时事件（slide_partial）seq 为 None。任务不存在时抛出 KeyError。
+        """
+        if await self.backend.get(job_id) is None:
+            raise KeyError(job_id)
+
+        job = self._jobs.get(job_id)
+        if job is not None:
+            async for seq, event in self._follow_local(job, offset):
+                if seq is not None:
+                    offset = seq + 1
+                yield seq, event
+        # 任务在其他 worker 上执行，或本地执行已结束 / 被接管：从共享后端跟随
+        async for seq, event in self._follow_remote(job_id, offset):
+            yield seq, event
+
+    async def _follow_local(self, job: Job, offset: int) -> AsyncIterator[tuple[int | None, dict]]:
+        queue: asyncio.Queue = asyncio.Queue()
+        job.subscribers.add(queue)
+        try:
+            replayed = len(job.events)
+            for seq in range(offset, replayed):
+                yield seq, job.events[seq]
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                seq, event = item
+                if seq is not None and seq < replayed:
+                    continue
+                yield seq, event
+        finally:
+            job.subscribers.discard(queue)
+
+    async def _follow_remote(self, job_id: str, offset: int) -> AsyncIterator[tuple[int | None, dict]]:
+        completed: set[int] = set()
+        sent_partials: dict[int, str] = {}
+        while True:
+            # 先读状态再读日志：状态已结束时日志必然已写完
+            info = await self.backend.get(job_id)
+            for event in await self.backend.events(job_id, offset):
+                if event["event"] == "slide":
+                    completed.add(event["data"]["index"])
+                yield offset, event
+                offset += 1
+            # 跟随期间任务已被清理或过期，视为已结束
+            if info is None or info["status"] not in ACTIVE_STATUSES:
+                return
+            for index, event in sorted((await self.backend.partials(job_id)).items()):
+                html = event["data"]["htmlContent"]
+                if index not in completed and sent_partials.get(index) != html:
+                    sent_partials[index] = html
+                    yield None, event
+            await asyncio.sleep(config.JOB_POLL_INTERVAL)
+
+    async def _launch(self, info: dict, router: ProviderRouter | None = None) -> None:
+        """在本 worker 上执行已领取的任务；事件日志中已有进度时从断点继续。"""
+        events = await self.backend.events(info["id"])
+        job = Job(
+            id=info["id"], topic=info["topic"], provider=info["provider"], no_cache=info["noCache"],
+            batch=info["batch"], events=events,
+        )
+        self._jobs[job.id] = job
+        checkpoint = None
+        if len(events) > 1:
+            checkpoint = build_checkpoint(events)
+            done = len(checkpoint.completed) if checkpoint else 0
+            logger.info(f"接管任务 {job.id}：已完成 {done} 页")
+        job.task = asyncio.create_task(self._run(job, router, checkpoint))
+
+    async def _maintain(self) -> None:
+        while True:
+            try:
+                for job in list(self._jobs.values()):
+                    if not await self.backend.renew(job.id, self.worker_id, config.JOB_LEASE_SECONDS):
+                        # 租约已被其他 worker 接管，停止本地执行但不改动任务状态
+                        logger.warning(f"任务 {job.id} 的租约已失效，停止本地执行")
+                        job.task.cancel()
+                    elif await self.backend.cancel_requested(job.id):
+                        self._cancel_local(job)
+                await self._claim_pending()
+                if time.monotonic() - self._last_purge >= min(_PURGE_INTERVAL, config.JOB_RETENTION / 4):
+                    await self._purge()
+            except Exception as e:
+                logger.error(f"任务维护循环异常: {e}")
+            await asyncio.sleep(config.JOB_POLL_INTERVAL)
+
+    async def _purge(self) -> None:
+        """删除结束超过 JOB_RETENTION 的任务及其事件日志。"""
+        self._last_purge = time.monotonic()
+        await self.backend.purge(time.time() - config.JOB_RETENTION)
+
+    @staticmethod
+    def _cancel_local(job: Job) -> None:
+        """立即停止本地执行：流水线随即取消所有进行中的协程，断开未完成的上游请求。"""
+        if not job.cancel_event.is_set():
+            job.cancelled_at = time.monotonic()
+            job.cancel_event.set()
+
+    def snapshot(self) -> dict:
+        """本 worker 的任务执行情况，供健康检查接口展示。"""
+        return {
+            "worker": self.worker_id,
+            "interactive": self._running(batch=False),
+            "batch": self._running(batch=True),
+            "cancelToIdle": self.cancel_latency.snapshot(),
+        }
+
+    def _running(self, batch: bool) -> int:
+        return sum(1 for job in self._jobs.values() if bool(job.batch) == batch)
+
+    async def _claim_pending(self) -> None:
+        """在交互式与批量任务各自的名额内领取排队或租约过期的任务。"""
+        for batch, limit in ((False, config.JOB_WORKER_CONCURRENCY), (True, config.BATCH_WORKER_CONCURRENCY)):
+            while self._running(batch) < limit:
+                info = await self.backend.claim(self.worker_id, config.JOB_LEASE_SECONDS, batch=batch)
+                if info is None:
+                    break
+                await self._launch(info)
+
+    async def _publish(self, job: Job, event: WSEvent) -> None:
+        data = event.model_dump()
+        seq = None
+        if event.event in EPHEMERAL_EVENTS:
+            await self.backend.set_partial(job.id, data["data"]["slideIndex"], data)
+        else:
+            seq = len(job.events)
+            # 先落盘再推送，客户端收到的事件都可回放
+            await self.backend.append(job.id, seq, data)
+            job.events.append(data)
+        for queue in job.subscribers:
+            queue.put_nowait((seq, data))
+
+    async def _run(self, job: Job, router: ProviderRouter | None, checkpoint: Checkpoint | None) -> None:
+        # 任务内设置，流水线派生的子任务随上下文继承
+        set_cache_bypass(job.no_cache)
+        set_session_class("batch" if job.batch else "interactive")
+        attributes = {
+            "job.id": job.id,
+            "job.worker": self.worker_id,
+            "topic.chars": len(job.topic),
+            "provider": job.provider,
+            "batch.id": job.batch,
+            "no_cache": job.no_cache,
+            "resumed_slides": len(checkpoint.completed) if checkpoint else -1,
+        }
+        # 每个任务一条 trace；规划、各页设计 / 配图与上游调用都挂在这个根 span 下
+        with span("generate", **attributes) as current:
+            status = "failed"
+            try:
+                if await self.backend.cancel_requested(job.id):
+                    self._cancel_local(job)
+                if router is None:
+                    router = self.router_factory(job.provider, "")
+                weight = 1 if job.batch else config.INTERACTIVE_SHARE_WEIGHT
+                service = PPTService(router, share=get_slide_scheduler().share(weight))
+                async for event in service.generate(job.topic, job.cancel_event, checkpoint):
+                    await self._publish(job, event)
+                    if event.event == "done":
+                        status = "done"
+                if job.cancel_event.is_set():
+                    status = "cancelled"
+            except asyncio.CancelledError:
+                # 进程退出或租约被接管，保留 running 状态由其他 worker 继续
+                status = "running"
+                raise
+            except Exception as e:
+                logger.error(f"任务 {job.id} 异常: {e}")
+                await self._publish(job, WSEvent(event="error", data={"message": str(e)}))
+            finally:
+                self._jobs.pop(job.id, None)
+                for queue in job.subscribers:
+                    queue.put_nowait(None)
+                if status == "cancelled" and job.cancelled_at is not None:
+                    self.cancel_latency.record(time.monotonic() - job.cancelled_at)
+                if status != "running":
+                    await self.backend.finish(job.id, status)
+                current.set_attributes(status=status, events=len(job.events))
+                logger.info(f"任务 {job.id} 在 {self.worker_id} 上结束: {status}")
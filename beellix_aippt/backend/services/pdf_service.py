@@ -1,17 +1,139 @@
+import asyncio
 import logging
 import base64
 import io
+import mimetypes
+from dataclasses import dataclass
 from pathlib import Path
-from playwright.sync_api import sync_playwright
-from concurrent.futures import ThreadPoolExecutor
-import asyncio
-import httpx
 from fpdf import FPDF
+from PIL import Image
+from pypdf import PdfReader, PdfWriter
+
+import config
+from utils.browser_pool import get_browser_pool
+from utils.http_client import get_download_client, stage_timeout
+from utils.metrics import REGISTRY, Counter, Histogram, time_stage
+from utils.tracing import current_span, span
 
 logger = logging.getLogger(__name__)
 
-# 创建线程池用于运行同步的 Playwright
-_executor = ThreadPoolExecutor(max_workers=2)
+PDF_READY_SECONDS = REGISTRY.register(Histogram(
+    "beellix_pdf_ready_seconds",
+    "Time from loading a slide until each readiness condition was met (cumulative; total ends at the ceiling).",
+    ("condition",),
+))
+PDF_READY_TIMEOUTS = REGISTRY.register(Counter(
+    "beellix_pdf_ready_timeouts_total",
+    "Slides screenshotted after PDF_READY_TIMEOUT without every readiness condition met.",
+))
+
+# 渲染就绪探针：页面装入后立即在浏览器中开始依次等待 load 事件、字体、全部 <img> 解码、有限时长的动画 / 过渡，
+# 记录各条件满足时距开始的毫秒数。无限循环的动画不等待，按截图时刻的画面输出
+_READY_PROBE = """() => {
+    const start = performance.now();
+    const report = {};
+    const step = async (name, wait) => {
+        await wait();
+        report[name] = Math.round(performance.now() - start);
+    };
+    window.__beellixReady = {start, report, done: (async () => {
+        await step("load", () => document.readyState === "complete"
+            ? null : new Promise(resolve => window.addEventListener("load", resolve, {once: true})));
+        await step("fonts", () => document.fonts.ready);
+        await step("images", () => Promise.all([...document.images].map(img => img.decode().catch(() => null))));
+        await step("animations", () => Promise.all(document.getAnimations()
+            .filter(a => Number.isFinite(a.effect?.getComputedTiming().endTime))
+            .map(a => a.finished.catch(() => null))));
+    })()};
+}"""
+
+# 等待探针完成，至多到探针开始后 timeout 毫秒；超时返回已满足的条件并标记 timedOut
+_READY_WAIT = """async (timeout) => {
+    const probe = window.__beellixReady;
+    const remaining = Math.max(0, timeout - (performance.now() - probe.start));
+    const finished = await Promise.race([
+        probe.done.then(() => true),
+        new Promise(resolve => setTimeout(() => resolve(false), remaining)),
+    ]);
+    return {...probe.report, total: Math.round(performance.now() - probe.start), timedOut: !finished};
+}"""
+
+# 矢量模式下打印管线无法正确输出的元素（backdrop-filter 在打印时不生效），标记最外层的一个并返回其位置；
+# 被标记元素的子元素随它一起栅格化
+_MARK_RASTER = """() => {
+    const rects = [];
+    for (const el of document.body.querySelectorAll("*")) {
+        const backdrop = getComputedStyle(el).backdropFilter;
+        if (!backdrop || backdrop === "none" || el.parentElement?.closest("[data-beellix-raster]")) continue;
+        const r = el.getBoundingClientRect();
+        if (r.width < 1 || r.height < 1) continue;
+        el.setAttribute("data-beellix-raster", rects.length);
+        rects.push({x: r.x, y: r.y, width: r.width, height: r.height});
+    }
+    return rects;
+}"""
+
+# 用屏幕渲染的截图替换标记的元素：截图覆盖在原位置，原元素隐藏（保留占位，不影响布局）
+_APPLY_RASTER = """async (images) => {
+    const placed = images.map(([index, src]) => {
+        const el = document.querySelector(`[data-beellix-raster="${index}"]`);
+        const r = el.getBoundingClientRect();
+        const img = document.createElement("img");
+        img.src = src;
+        img.style.cssText = `position:absolute;left:${r.x}px;top:${r.y}px;width:${r.width}px;height:${r.height}px;`
+            + "margin:0;z-index:2147483647;";
+        el.style.visibility = "hidden";
+        document.body.appendChild(img);
+        return img.decode().catch(() => null);
+    });
+    await Promise.all(placed);
+}"""
+
+PDF_MODES = ("screenshot", "vector")
+PDF_IMAGE_FORMATS = ("png", "jpeg", "auto")
+PDF_SCALES = (1.0, 1.5, 2.0)
+
+PDF_PAGES_ENCODED = REGISTRY.register(Counter(
+    "beellix_pdf_pages_encoded_total",
+    "Screenshot pages embedded in PDFs by image format, and whether they were degraded to fit the size target.",
+    ("format", "degraded"),
+))
+
+# 超出大小预算时依次尝试的缩放比例与 JPEG 质量
+_FALLBACK_SCALES = (1.0, 0.75, 0.5)
+_FALLBACK_QUALITIES = (75, 60, 45, 30)
+# 缩小后颜色数不超过该值的页面视为纯色 / 图表为主，PNG 更小且文字锐利；否则按照片处理用 JPEG
+_FLAT_MAX_COLORS = 4096
+# 预留给 PDF 结构（页面对象、xref 等）的字节数
+_PDF_OVERHEAD = 4096
+
+
+@dataclass
+class ImageOptions:
+    """截图模式下页面图像的编码方式；scale 同时决定矢量模式中栅格化元素的分辨率。"""
+    format: str = config.PDF_IMAGE_FORMAT  # png / jpeg / auto（按页面内容选择）
+    quality: int = config.PDF_IMAGE_QUALITY  # JPEG 质量 1-100
+    scale: float = config.PDF_IMAGE_SCALE  # 截图缩放 1 / 1.5 / 2
+    max_bytes: int = 0  # 整个 PDF 的目标大小，0 表示不限制
+
+    @classmethod
+    def from_request(cls, request: dict) -> "ImageOptions":
+        """从导出请求读取 imageFormat / quality / scale / maxSizeMB，缺省取配置，取值非法时抛出 ValueError。"""
+        options = cls(
+            format=str(request.get("imageFormat") or cls.format).lower(),
+            quality=int(request.get("quality") or cls.quality),
+            scale=float(request.get("scale") or cls.scale),
+            max_bytes=int(float(request.get("maxSizeMB") or 0) * 1024 * 1024),
+        )
+        if options.format not in PDF_IMAGE_FORMATS:
+            raise ValueError(f"未知图片格式: {options.format}")
+        if not 1 <= options.quality <= 100:
+            raise ValueError(f"JPEG 质量应在 1-100 之间: {options.quality}")
+        if options.scale not in PDF_SCALES:
+            raise ValueError(f"缩放比例只支持 1 / 1.5 / 2: {options.scale}")
+        if options.max_bytes < 0:
+            raise ValueError("maxSizeMB 不能为负数")
+        return options
 
 # 幻灯片截图分辨率（与前端保持一致）
 _SLIDE_W = 1280
@@ -26,21 +148,22 @@ class PDFService:
     """使用 Playwright 截图 + fpdf2 生成像素级一致的 PDF"""
 
     @staticmethod
-    def _convert_image_to_base64(image_url: str) -> str:
+    async def _convert_image_to_base64(image_url: str) -> str:
         """将图片 URL 转换为 base64 数据 URI"""
         try:
             # 如果是相对路径，转换为本地文件路径
             if image_url.startswith("/images/"):
-                local_path = Path("generated_images") / image_url.replace("/images/", "")
+                local_path = Path(config.IMAGES_DIR) / image_url.replace("/images/", "")
                 if local_path.exists():
-                    with open(local_path, "rb") as f:
-                        image_data = f.read()
+                    image_data = await asyncio.to_thread(local_path.read_bytes)
                     base64_data = base64.b64encode(image_data).decode("utf-8")
-                    return f"data:image/png;base64,{base64_data}"
+                    # 内容寻址存储下扩展名与真实格式一致
+                    content_type = mimetypes.guess_type(local_path.name)[0] or "image/png"
+                    return f"data:{content_type};base64,{base64_data}"
 
             # 如果是完整 URL，下载图片
             elif image_url.startswith("http"):
-                response = httpx.get(image_url, timeout=10)
+                response = await get_download_client().get(image_url, timeout=stage_timeout(10))
                 if response.status_code == 200:
                     base64_data = base64.b64encode(response.content).decode("utf-8")
                     content_type = response.headers.get("content-type", "image/png")
@@ -77,65 +200,231 @@ img {{ display: block; }}
 </html>"""
 
     @staticmethod
-    def _generate_pdf_sync(slides_html: list[str], title: str) -> bytes:
-        """截图每张幻灯片，合成为 PDF（在线程池中运行）
+    def _record_readiness(index: int, report: dict) -> None:
+        """记录一页的就绪报告：各条件耗时直方图、超时计数与当前页 span 的属性。"""
+        for condition in ("load", "fonts", "images", "animations", "total"):
+            if condition in report:
+                PDF_READY_SECONDS.observe(report[condition] / 1000, condition=condition)
+        if report["timedOut"]:
+            PDF_READY_TIMEOUTS.inc()
+            logger.warning(f"第 {index + 1} 页在 {config.PDF_READY_TIMEOUT}s 内未就绪，按当前画面截图: {report}")
+        timings = {f"ready.{key}_ms": value for key, value in report.items() if key != "timedOut"}
+        current_span().set_attributes(**{"ready.timed_out": report["timedOut"]}, **timings)
 
-        核心策略：用 page.screenshot() 代替 page.pdf()。
-        screenshot 走的是屏幕渲染管线，完整支持 backdrop-filter、text-shadow 等
-        CSS 特性，输出与浏览器显示完全一致。然后用 fpdf2 将截图逐页嵌入 PDF。
+    @staticmethod
+    async def _rasterize_unprintable(page) -> int:
+        """把打印时无法正确输出的元素替换为屏幕渲染的截图，返回替换的元素数。"""
+        rects = await page.evaluate(_MARK_RASTER)
+        images = []
+        for index, rect in enumerate(rects):
+            # 只截取视口内的部分
+            x, y = max(0, rect["x"]), max(0, rect["y"])
+            width = min(_SLIDE_W, rect["x"] + rect["width"]) - x
+            height = min(_SLIDE_H, rect["y"] + rect["height"]) - y
+            if width < 1 or height < 1:
+                continue
+            png = await page.screenshot(type="png", clip={"x": x, "y": y, "width": width, "height": height})
+            images.append([index, "data:image/png;base64," + base64.b64encode(png).decode("ascii")])
+        if images:
+            await page.evaluate(_APPLY_RASTER, images)
+        return len(images)
+
+    @staticmethod
+    async def _render_slide(
+        pages: asyncio.Queue, index: int, slide_html: str, mode: str, options: ImageOptions
+    ) -> bytes:
+        """借用一个空闲页面渲染一张幻灯片：装入内容、等待就绪，截图模式返回 PNG / JPEG，矢量模式返回单页 PDF。"""
+        page = await pages.get()
+        stage = "pdf_screenshot" if mode == "screenshot" else "pdf_print"
+        try:
+            with span("render_slide", index=index, mode=mode) as current, time_stage(stage, "local", "chromium"):
+                html_doc = PDFService._build_slide_html(slide_html)
+                await page.set_content(html_doc, wait_until="domcontentloaded", timeout=15000)
+                await page.evaluate(_READY_PROBE)
+                report = await page.evaluate(_READY_WAIT, config.PDF_READY_TIMEOUT * 1000)
+                PDFService._record_readiness(index, report)
+                if mode == "screenshot" and options.format == "jpeg" and not options.max_bytes:
+                    # 固定 JPEG 且不限大小时直接由 Chromium 编码，字节原样嵌入 PDF
+                    data = await page.screenshot(type="jpeg", quality=options.quality, full_page=False)
+                elif mode == "screenshot":
+                    data = await page.screenshot(type="png", full_page=False)
+                else:
+                    rasterized = await PDFService._rasterize_unprintable(page)
+                    current.set_attribute("rasterized", rasterized)
+                    data = await page.pdf(
+                        width=f"{_PAGE_W_MM}mm",
+                        height=f"{_PAGE_H_MM}mm",
+                        print_background=True,
+                        margin={"top": "0", "right": "0", "bottom": "0", "left": "0"},
+                        page_ranges="1",
+                    )
+            logger.info(f"第 {index + 1} 页渲染完成（{mode}），就绪耗时(ms) {report}")
+            return data
+        finally:
+            pages.put_nowait(page)
+
+    @staticmethod
+    def _is_flat(image: Image.Image) -> bool:
+        """颜色数少的页面（纯色背景、文字、图表）。先缩小 4 倍再统计，避免逐像素计数。"""
+        return image.reduce(4).getcolors(maxcolors=_FLAT_MAX_COLORS) is not None
+
+    @staticmethod
+    def _encode_page(data: bytes, options: ImageOptions, budget: int) -> tuple[bytes, str, bool]:
+        """按选项编码一页截图，返回 (图像字节, 格式, 是否为满足大小预算而降质)。
+
+        返回的 JPEG 由 fpdf2 原样嵌入（DCTDecode），不再解码；PNG 由 fpdf2 解码后重新压缩。
+        超出每页预算时改用 JPEG，先降低质量、再缩小尺寸，直到放得下；仍放不下时返回最小的结果。
         """
-        logger.info(f"开始生成 PDF（截图模式），共 {len(slides_html)} 页")
+        if data.startswith(b"\xff\xd8"):
+            return data, "jpeg", False
+        with Image.open(io.BytesIO(data)) as img:
+            image = img.convert("RGB")
+        fmt = options.format
+        if fmt == "auto":
+            fmt = "png" if PDFService._is_flat(image) else "jpeg"
+        if fmt == "png" and (not budget or len(data) <= budget):
+            return data, "png", False
 
-        screenshots: list[bytes] = []
+        def to_jpeg(source: Image.Image, quality: int) -> bytes:
+            output = io.BytesIO()
+            source.save(output, format="JPEG", quality=quality, optimize=True)
+            return output.getvalue()
 
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=True)
-            page = browser.new_page(
-                viewport={"width": _SLIDE_W, "height": _SLIDE_H},
-                device_scale_factor=2,  # 2x 缩放，输出 3840×2160 高清截图
+        encoded = to_jpeg(image, options.quality)
+        if not budget or len(encoded) <= budget:
+            return encoded, "jpeg", False
+        for factor in _FALLBACK_SCALES:
+            source = image if factor == 1.0 else image.resize(
+                (round(image.width * factor), round(image.height * factor)), Image.Resampling.LANCZOS
             )
+            for quality in _FALLBACK_QUALITIES:
+                if factor == 1.0 and quality >= options.quality:
+                    continue
+                encoded = to_jpeg(source, quality)
+                if len(encoded) <= budget:
+                    return encoded, "jpeg", True
+        return encoded, "jpeg", True
 
-            for i, slide_html in enumerate(slides_html):
-                html_doc = PDFService._build_slide_html(slide_html)
-                page.set_content(html_doc, wait_until="networkidle", timeout=15000)
-                # 额外等待确保字体渲染、CSS 动画等完成
-                page.wait_for_timeout(800)
+    @staticmethod
+    def _assemble_pdf(screenshots: list[bytes], options: ImageOptions) -> bytes:
+        """将截图按选项编码后合成为 PDF —— 16:9 自定义页面尺寸（CPU 密集，在线程中运行）。
+
+        有大小目标时从最小的页面开始分配预算：每页得到剩余预算在剩余页面间的均分，
+        小页面用不完的部分留给后面的大页面（通常是照片类页面）。
+        """
+        images: list[bytes] = [b""] * len(screenshots)
+        with time_stage("pdf_encode", "local", "pillow"):
+            remaining = options.max_bytes - _PDF_OVERHEAD
+            order = sorted(range(len(screenshots)), key=lambda i: len(screenshots[i]))
+            for count, i in enumerate(order):
+                budget = max(1, remaining // (len(order) - count)) if options.max_bytes else 0
+                encoded, fmt, degraded = PDFService._encode_page(screenshots[i], options, budget)
+                PDF_PAGES_ENCODED.inc(format=fmt, degraded=str(degraded).lower())
+                images[i] = encoded
+                remaining -= len(encoded)
+
+        with time_stage("pdf_assemble", "local", "fpdf2"):
+            pdf = FPDF(unit="mm", format=(_PAGE_W_MM, _PAGE_H_MM))
+            pdf.set_auto_page_break(False)
+
+            for image in images:
+                pdf.add_page()
+                pdf.image(io.BytesIO(image), x=0, y=0, w=_PAGE_W_MM, h=_PAGE_H_MM)
 
-                png_bytes = page.screenshot(type="png", full_page=False)
-                screenshots.append(png_bytes)
-                logger.info(f"第 {i + 1}/{len(slides_html)} 页截图完成")
+            pdf_bytes = bytes(pdf.output())
+        if options.max_bytes and len(pdf_bytes) > options.max_bytes:
+            logger.warning(f"PDF 大小 {len(pdf_bytes)} 字节，降到最低质量仍超出目标 {options.max_bytes} 字节")
+        return pdf_bytes
 
-            browser.close()
+    @staticmethod
+    def _merge_pdfs(pages: list[bytes], title: str) -> bytes:
+        """按幻灯片顺序合并单页 PDF，并去除重复对象（多页共用的背景图等）（CPU 密集，在线程中运行）。"""
+        with time_stage("pdf_merge", "local", "pypdf"):
+            writer = PdfWriter()
+            for data in pages:
+                writer.append(PdfReader(io.BytesIO(data)))
+            writer.add_metadata({"/Title": title})
+            writer.compress_identical_objects(remove_identicals=True, remove_orphans=True)
+            output = io.BytesIO()
+            writer.write(output)
+            return output.getvalue()
+
+    @staticmethod
+    async def _render_pdf(
+        browser, slides_html: list[str], title: str, mode: str, options: ImageOptions
+    ) -> bytes:
+        """渲染每张幻灯片，合成为 PDF
 
-        # 将截图合成为 PDF —— 16:9 自定义页面尺寸
-        pdf = FPDF(unit="mm", format=(_PAGE_W_MM, _PAGE_H_MM))
-        pdf.set_auto_page_break(False)
+        截图模式（默认）：用 page.screenshot() 代替 page.pdf()。
+        screenshot 走的是屏幕渲染管线，完整支持 backdrop-filter、text-shadow 等
+        CSS 特性，输出与浏览器显示完全一致。然后用 fpdf2 将截图逐页嵌入 PDF。
+        截图缩放、编码（PNG / JPEG / 按页面内容选择）与整份文件的大小目标由 ImageOptions 指定。
 
-        for png in screenshots:
-            pdf.add_page()
-            pdf.image(io.BytesIO(png), x=0, y=0, w=_PAGE_W_MM, h=_PAGE_H_MM)
+        矢量模式：每页用 page.pdf() 按 16:9 页面尺寸输出，文字与矢量图形保持可选中、可缩放，文件小得多；
+        打印管线不支持的 backdrop-filter 元素先替换为屏幕渲染的截图，再用 pypdf 按顺序合并各页。
 
-        pdf_bytes = pdf.output()
+        浏览器由池共享，每次导出使用独立的 context，结束后关闭，导出之间不共享页面状态。
+        context 内 PDF_PAGE_FANOUT 个页面同时渲染不同的幻灯片，按幻灯片顺序合成。
+        """
+        logger.info(f"开始生成 PDF（{mode}），共 {len(slides_html)} 页")
+
+        context = await browser.new_context(
+            viewport={"width": _SLIDE_W, "height": _SLIDE_H},
+            device_scale_factor=options.scale,  # 默认 2x 缩放，输出 2560×1440 高清截图
+        )
+        tasks: list[asyncio.Task] = []
+        try:
+            pages: asyncio.Queue = asyncio.Queue()
+            for _ in range(max(1, min(config.PDF_PAGE_FANOUT, len(slides_html)))):
+                page = await context.new_page()
+                if mode == "vector":
+                    # 与截图模式一致按屏幕样式排版，而不是打印样式
+                    await page.emulate_media(media="screen")
+                pages.put_nowait(page)
+            tasks = [
+                asyncio.create_task(PDFService._render_slide(pages, i, slide_html, mode, options))
+                for i, slide_html in enumerate(slides_html)
+            ]
+            rendered = list(await asyncio.gather(*tasks))
+        finally:
+            # 任一页失败或导出被取消时停止其余页面
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await context.close()
+
+        if mode == "vector":
+            pdf_bytes = await asyncio.to_thread(PDFService._merge_pdfs, rendered, title)
+        else:
+            pdf_bytes = await asyncio.to_thread(PDFService._assemble_pdf, rendered, options)
         logger.info(f"PDF 生成完成，大小: {len(pdf_bytes)} 字节")
-        return bytes(pdf_bytes)
+        return pdf_bytes
 
     @staticmethod
-    async def generate_pdf_from_html(slides_html: list[str], title: str = "演示文稿") -> bytes:
+    async def generate_pdf_from_html(
+        slides_html: list[str],
+        title: str = "演示文稿",
+        mode: str = "screenshot",
+        options: ImageOptions | None = None,
+    ) -> bytes:
         """
         从幻灯片 HTML 列表生成 PDF
 
         Args:
             slides_html: 每页幻灯片的完整 HTML 内容列表
             title: PDF 文档标题
+            mode: "screenshot"（逐页截图，像素级一致）或 "vector"（Chromium 打印输出，文字可选中、体积小）
+            options: 截图缩放、编码与大小目标，默认取配置
 
         Returns:
             PDF 文件的字节内容
         """
-        loop = asyncio.get_event_loop()
-        pdf_bytes = await loop.run_in_executor(
-            _executor,
-            PDFService._generate_pdf_sync,
-            slides_html,
-            title,
-        )
-        return pdf_bytes
\ No newline at end of file
+        if mode not in PDF_MODES:
+            raise ValueError(f"未知导出模式: {mode}")
+        options = options or ImageOptions()
+        attributes = {"image.format": options.format, "image.scale": options.scale, "max_bytes": options.max_bytes}
+        with span("export_pdf", slides=len(slides_html), mode=mode, **attributes) as current:
+            async with get_browser_pool().browser() as browser:
+                pdf_bytes = await PDFService._render_pdf(browser, slides_html, title, mode, options)
+            current.set_attribute("bytes", len(pdf_bytes))
+        return pdf_bytes
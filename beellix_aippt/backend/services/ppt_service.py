@@ -1,130 +1,355 @@
 import asyncio
 import logging
-from typing import AsyncGenerator
+import time
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from typing import AsyncGenerator, Callable
 
-from models import PlannerResult, FinalSlide, WSEvent
+import config
+from models import DesignerResult, PlannerResult, SlideOutline, FinalSlide, WSEvent
 from agents.ppt_planner_agent import PPTPlannerAgent
 from agents.ppt_designer_agent import PPTDesignerAgent
 from agents.ppt_artist_agent import PPTArtistAgent
-from llm.base import BaseLLMClient
+from llm.context import set_slide_index
+from llm.router import ProviderRouter
+from llm.scheduler import get_scheduler
+from services.fair_share import DeckShare
+from utils.tracing import Span, current_span, span
 
 logger = logging.getLogger(__name__)
 
+# 队列中大纲事件使用的页码占位
+_PLANNER_INDEX = -1
+# 队列中取消信号使用的页码占位
+_CANCEL_INDEX = -2
+
+
+@dataclass
+class _RunState:
+    """单次 generate 调用内 planner 协程与各页工作协程共享的状态。"""
+    queue: asyncio.Queue  # 元素：(页码, 事件, 是否为该页的终结事件)
+    semaphore: asyncio.Semaphore
+    is_cancelled: Callable[[], bool]
+    metadata: dict | None = None
+    total: int | None = None  # 完整大纲解析完成前未知
+    tasks: list[asyncio.Task] = field(default_factory=list)
+    # 本次生成的 span；各页工作协程由 planner 派生，需显式挂到这里而不是大纲 span 下
+    span: Span | None = None
+
+
+@dataclass
+class Checkpoint:
+    """从中断处恢复生成所需的进度：已生成的完整大纲与已完成的页码。"""
+    outline: PlannerResult
+    completed: set[int] = field(default_factory=set)
+
+
+def _outline_metadata(outline: PlannerResult) -> dict:
+    return {
+        "topic": outline.topic,
+        "title": outline.title,
+        "visualTheme": outline.visualTheme,
+        "tone": outline.tone,
+        "accentColor": outline.accentColor,
+    }
+
 
 class PPTService:
-    """编排完整的 PPT 生成流水线，支持通过 cancel_event 中途取消。"""
+    """编排完整的 PPT 生成流水线，支持通过 cancel_event 中途取消：
+    取消时立即中止所有进行中的规划 / 设计 / 配图协程，正在进行的上游 HTTP 请求与图片下载随之断开。
 
-    def __init__(self, text_llm: BaseLLMClient, image_llm: BaseLLMClient, provider: str):
-        self.planner = PPTPlannerAgent(text_llm, provider)
-        self.designer = PPTDesignerAgent(text_llm, provider)
-        self.artist = PPTArtistAgent(image_llm, provider)
+    每页幻灯片的「设计 → 配图」由最多 concurrency 个协程并发执行；
+    event_order 决定 slide 事件按完成先后（"completion"）还是按页码（"ordered"）推送；
+    各次规划 / 设计 / 配图调用由 router 在已配置的供应商之间路由；
+    传入 share 时每页还需占用进程级槽位，与其他任务的页面公平交错执行。
+    """
+
+    def __init__(
+        self,
+        router: ProviderRouter,
+        concurrency: int | None = None,
+        event_order: str | None = None,
+        share: DeckShare | None = None,
+    ):
+        self.router = router
+        self.share = share
+        self.planner = PPTPlannerAgent(router)
+        self.designer = PPTDesignerAgent(router)
+        self.artist = PPTArtistAgent(router)
+        self.concurrency = max(1, concurrency or config.SLIDE_CONCURRENCY)
+        self.event_order = event_order or config.SLIDE_EVENT_ORDER
+
+    def _queue_snapshot(self, op: str) -> dict:
+        """当前首选供应商的调度器排队情况，随状态事件推送。"""
+        provider = self.router.primary(op)
+        return {"provider": provider, **get_scheduler(provider, op).snapshot()}
 
     async def generate(
-        self, topic: str, cancel_event: asyncio.Event | None = None
+        self,
+        topic: str,
+        cancel_event: asyncio.Event | None = None,
+        checkpoint: Checkpoint | None = None,
     ) -> AsyncGenerator[WSEvent, None]:
         """
         完整流水线，以异步生成器逐步推送 WSEvent：
-          - "status"   — 进度状态更新
+          - "status"   — 进度状态更新（data.queue 为上游调度器的排队深度与等待耗时）
           - "outline"  — 完整大纲
-          - "slide"    — 单页幻灯片完成
+          - "slide_partial" — 设计中的单页部分 HTML（流式）
+          - "slide"    — 单页幻灯片完成（data.index 为页码）
           - "done"     — 全部完成
           - "error"    — 发生错误
+
+        传入 checkpoint 时跳过规划，只生成尚未完成的页，不再重复推送 outline 与已完成页的事件。
         """
 
         def is_cancelled() -> bool:
             return cancel_event is not None and cancel_event.is_set()
 
-        # --- 第一步：生成大纲 ---
-        yield WSEvent(event="status", data={"status": "planning", "message": "正在规划幻灯片大纲..."})
+        run = _RunState(
+            queue=asyncio.Queue(),
+            semaphore=asyncio.Semaphore(self.concurrency),
+            is_cancelled=is_cancelled,
+            span=current_span(),
+        )
+        ordered = self.event_order == "ordered"
+        # 取消时向队列投递占位事件，不必等到某一页的下一个事件到达才响应
+        watcher = asyncio.create_task(self._watch_cancel(cancel_event, run.queue)) if cancel_event else None
+
+        title = ""
+        total: int | None = None
+        slide_count = 0
+        finished = 0
+        # ordered 模式下暂存已完成但前序页尚未推送的终结事件
+        pending: dict[int, WSEvent | None] = {}
+        next_index = 0
+        planner_task: asyncio.Task | None = None
+
+        if checkpoint is None:
+            # --- 第一步：流式生成大纲；已到达的页在大纲写完前即开始设计 + 配图 ---
+            yield WSEvent(event="status", data={
+                "status": "planning",
+                "message": "正在规划幻灯片大纲...",
+                "queue": self._queue_snapshot("text"),
+            })
+            planner_task = asyncio.create_task(self._run_planner(topic, run))
+        else:
+            outline = checkpoint.outline
+            title = outline.title
+            total = run.total = len(outline.slides)
+            run.metadata = _outline_metadata(outline)
+            finished = slide_count = len(checkpoint.completed)
+            pending = {i: None for i in checkpoint.completed}
+            yield WSEvent(event="status", data={
+                "status": "resuming",
+                "message": f"从断点恢复生成：已完成 {finished}/{total} 页",
+                "totalSlides": total,
+            })
+            for i, slide_outline in enumerate(outline.slides):
+                if i not in checkpoint.completed:
+                    run.tasks.append(asyncio.create_task(self._run_slide(i, slide_outline, run)))
 
         try:
-            outline: PlannerResult = await self.planner.generate_outline(topic)
-        except Exception as e:
-            logger.error(f"Planner 失败: {e}")
-            yield WSEvent(event="error", data={"message": f"大纲生成失败: {e}"})
-            return
+            while total is None or finished < total:
+                index, event, terminal = await run.queue.get()
+                if is_cancelled():
+                    break
+
+                if index == _PLANNER_INDEX:
+                    # 大纲失败为终结事件，整体结束；否则为完整 outline 事件
+                    yield event
+                    if terminal:
+                        return
+                    title = event.data["title"]
+                    total = len(event.data["slides"])
+                    continue
+
+                if not terminal:
+                    yield event
+                    continue
+
+                finished += 1
+                if event is not None and event.event == "slide":
+                    slide_count += 1
+
+                if not ordered:
+                    if event is not None:
+                        yield event
+                    continue
+
+                pending[index] = event
+                while next_index in pending:
+                    ready = pending.pop(next_index)
+                    next_index += 1
+                    if ready is not None:
+                        yield ready
+        finally:
+            tasks = [task for task in (planner_task, watcher) if task is not None] + run.tasks
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
 
         if is_cancelled():
             yield WSEvent(event="error", data={"message": "已取消生成"})
             return
 
-        yield WSEvent(event="outline", data=outline.model_dump())
+        # --- 第四步：完成 ---
+        yield WSEvent(event="done", data={
+            "totalSlides": slide_count,
+            "title": title,
+        })
 
-        # 构建 metadata
-        metadata = {
-            "topic": outline.topic,
-            "title": outline.title,
-            "visualTheme": outline.visualTheme,
-            "tone": outline.tone,
-            "accentColor": outline.accentColor,
-        }
+    @staticmethod
+    async def _watch_cancel(cancel_event: asyncio.Event, queue: asyncio.Queue) -> None:
+        await cancel_event.wait()
+        await queue.put((_CANCEL_INDEX, None, True))
 
-        # --- 第二步 & 第三步：逐页设计 + 生成配图 ---
-        slides: list[FinalSlide] = []
-        total = len(outline.slides)
+    async def _run_planner(self, topic: str, run: _RunState) -> None:
+        """消费流式大纲：metadata 就绪后每到达一页就启动该页的工作协程，最后推送完整 outline 事件。"""
+        arrived: list[SlideOutline] = []
 
-        for i, slide_outline in enumerate(outline.slides):
-            if is_cancelled():
-                yield WSEvent(event="error", data={"message": "已取消生成"})
+        def dispatch() -> None:
+            if run.metadata is None:
                 return
+            while len(run.tasks) < len(arrived):
+                i = len(run.tasks)
+                run.tasks.append(asyncio.create_task(self._run_slide(i, arrived[i], run)))
 
-            yield WSEvent(event="status", data={
-                "status": "designing",
-                "slideIndex": i,
-                "totalSlides": total,
-                "message": f"正在设计第 {i + 1}/{total} 页：{slide_outline.title}",
-            })
+        try:
+            with span("generate_outline", **{"topic.chars": len(topic)}) as current:
+                async for kind, payload in self.planner.generate_outline_stream(topic):
+                    if kind == "metadata":
+                        run.metadata = payload
+                        current.add_event("metadata")
+                    elif kind == "slide":
+                        arrived.append(payload)
+                        current.add_event("slide_outline", index=len(arrived) - 1)
+                    else:
+                        outline: PlannerResult = payload
+                        current.set_attribute("slides", len(outline.slides))
+                    dispatch()
+        except Exception as e:
+            logger.error(f"Planner 失败: {e}")
+            await run.queue.put((_PLANNER_INDEX, WSEvent(event="error", data={"message": f"大纲生成失败: {e}"}), True))
+            return
+
+        # 以完整解析结果为准，补齐增量阶段未产出的页
+        if run.metadata is None:
+            run.metadata = _outline_metadata(outline)
+        arrived[len(run.tasks):] = outline.slides[len(run.tasks):]
+        dispatch()
+        run.total = len(outline.slides)
 
-            try:
-                # 设计幻灯片
-                design = await self.designer.design_slide(
-                    metadata=metadata,
-                    slide_outline=slide_outline.model_dump(),
-                    index=i,
-                )
+        await run.queue.put((_PLANNER_INDEX, WSEvent(event="outline", data=outline.model_dump()), False))
 
+    async def _run_slide(self, i: int, slide_outline: SlideOutline, run: _RunState) -> None:
+        """单页「设计 → 配图」工作协程，所有事件通过 run.queue 交给 generate 推送。"""
+        queue, is_cancelled = run.queue, run.is_cancelled
+        # 每页是独立的任务，标记只作用于本页发起的上游调用
+        set_slide_index(i)
+        with span("slide", parent=run.span, **{"slide.index": i}) as current:
+            queued_at = time.monotonic()
+            async with run.semaphore, self.share.slot() if self.share else nullcontext():
+                current.set_attribute("slot.wait_ms", round((time.monotonic() - queued_at) * 1000))
+                total = run.total
+                page = f"{i + 1}/{total}" if total else f"{i + 1}"
                 if is_cancelled():
-                    yield WSEvent(event="error", data={"message": "已取消生成"})
+                    await queue.put((i, None, True))
                     return
 
-                yield WSEvent(event="status", data={
-                    "status": "generating_image",
+                await queue.put((i, WSEvent(event="status", data={
+                    "status": "designing",
                     "slideIndex": i,
                     "totalSlides": total,
-                    "message": f"正在为第 {i + 1}/{total} 页生成配图...",
-                })
+                    "message": f"正在设计第 {page} 页：{slide_outline.title}",
+                    "queue": self._queue_snapshot("text"),
+                }), False))
 
-                # 生成配图
-                image_local_path = await self.artist.generate_image(design.imagePrompt)
-                
-                # 将本地路径转换为前端可访问的 URL
-                # 例如: generated_images/slide_20240101_120000.png -> /images/slide_20240101_120000.png
-                image_filename = image_local_path.split("/")[-1].split("\\")[-1]  # 兼容 Windows 和 Unix 路径
-                image_url = f"/images/{image_filename}"
-
-                # 替换占位符
-                final_html = design.htmlContent.replace("__SLIDE_IMAGE__", image_url)
-
-                slide = FinalSlide(
-                    index=i,
-                    outline=slide_outline,
-                    design=design,
-                    imageUrl=image_url,
-                    finalHtml=final_html,
-                )
-                slides.append(slide)
-
-                yield WSEvent(event="slide", data=slide.model_dump())
-
-            except Exception as e:
-                logger.error(f"第 {i + 1} 页失败: {e}")
-                yield WSEvent(event="error", data={
-                    "message": f"第 {i + 1} 页生成失败: {e}",
-                    "slideIndex": i,
-                })
+                async def push_partial(html: str) -> None:
+                    await queue.put((i, WSEvent(event="slide_partial", data={
+                        "slideIndex": i,
+                        # 配图尚未生成，先去掉占位符避免前端请求无效地址
+                        "htmlContent": html.replace("__SLIDE_IMAGE__", ""),
+                    }), False))
 
-        # --- 第四步：完成 ---
-        yield WSEvent(event="done", data={
-            "totalSlides": len(slides),
-            "title": outline.title,
-        })
\ No newline at end of file
+                try:
+                    # 设计幻灯片
+                    design = await self.designer.design_slide(
+                        metadata=run.metadata,
+                        slide_outline=slide_outline.model_dump(),
+                        index=i,
+                        on_partial=push_partial if config.STREAM_PARTIAL_SLIDES else None,
+                    )
+
+                    if is_cancelled():
+                        await queue.put((i, None, True))
+                        return
+
+                    await queue.put((i, WSEvent(event="status", data={
+                        "status": "generating_image",
+                        "slideIndex": i,
+                        "totalSlides": total,
+                        "message": f"正在为第 {page} 页生成配图...",
+                        "queue": self._queue_snapshot("image"),
+                    }), False))
+
+                    # 生成配图
+                    image_local_path = await self.artist.generate_image(design.imagePrompt)
+
+                    slide = self._final_slide(i, slide_outline, design, image_local_path)
+                    await queue.put((i, WSEvent(event="slide", data=slide.model_dump()), True))
+
+                except Exception as e:
+                    logger.error(f"第 {i + 1} 页失败: {e}")
+                    current.set_attributes(failed=True, error=str(e))
+                    await queue.put((i, WSEvent(event="error", data={
+                        "message": f"第 {i + 1} 页生成失败: {e}",
+                        "slideIndex": i,
+                    }), True))
+
+    @staticmethod
+    def _final_slide(i: int, slide_outline: SlideOutline, design: DesignerResult, image_local_path: str) -> FinalSlide:
+        # 将本地路径转换为前端可访问的 URL
+        # 例如: generated_images/slide_20240101_120000.png -> /images/slide_20240101_120000.png
+        image_filename = image_local_path.split("/")[-1].split("\\")[-1]  # 兼容 Windows 和 Unix 路径
+        image_url = f"/images/{image_filename}"
+
+        # 替换占位符
+        final_html = design.htmlContent.replace("__SLIDE_IMAGE__", image_url)
+
+        return FinalSlide(
+            index=i,
+            outline=slide_outline,
+            design=design,
+            imageUrl=image_url,
+            finalHtml=final_html,
+        )
+
+    async def regenerate_slide(
+        self,
+        outline: PlannerResult,
+        index: int,
+        design: DesignerResult | None = None,
+        image_prompt: str = "",
+    ) -> FinalSlide:
+        """只重新生成一页，不重新规划，也不影响其他页。
+
+        未传入 design 时重新设计该页再配图；传入 design（该页现有设计）时只重新生成配图。
+        image_prompt 非空时替换配图提示词。需要得到新结果时，调用方应在当前任务中开启缓存旁路。
+        """
+        if not 0 <= index < len(outline.slides):
+            raise ValueError(f"页码超出范围: {index}")
+        slide_outline = outline.slides[index]
+        set_slide_index(index)
+        mode = "image" if design is not None else "design"
+        with span("regenerate_slide", mode=mode, **{"slide.index": index}):
+            async with self.share.slot() if self.share else nullcontext():
+                if design is None:
+                    design = await self.designer.design_slide(
+                        metadata=_outline_metadata(outline),
+                        slide_outline=slide_outline.model_dump(),
+                        index=index,
+                    )
+                if image_prompt:
+                    design = design.model_copy(update={"imagePrompt": image_prompt})
+                image_local_path = await self.artist.generate_image(design.imagePrompt)
+        return self._final_slide(index, slide_outline, design, image_local_path)
@@ -0,0 +1,176 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+import config
+from utils.metrics import REGISTRY, Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+BROWSER_LAUNCHES = REGISTRY.register(Counter(
+    "beellix_pdf_browser_launches_total",
+    "Chromium launches by the browser pool (startup, recycle after N renders, crash).",
+    ("reason",),
+))
+
+
+class _PooledBrowser:
+    def __init__(self, browser):
+        self.browser = browser
+        # 当前借出数 / 累计借出次数；累计达到 PDF_BROWSER_MAX_RENDERS 后不再借出，最后一个借用方归还时关闭
+        self.leases = 0
+        self.renders = 0
+        self.retired = False
+
+
+class BrowserPool:
+    """事件循环上常驻的 Chromium 池（playwright.async_api）。
+
+    PDF_BROWSERS 个浏览器在启动时预热，由所有异步代码共享；借用方各自创建 context，同一浏览器可同时服务多个借用方。
+    并发由信号量限制（PDF_CONCURRENCY），等待中的导出不占用线程。每次借用挑选借出最少的浏览器；
+    浏览器累计借出 PDF_BROWSER_MAX_RENDERS 次后换新（进行中的借用结束后再关闭），断开连接后重启。
+    """
+
+    def __init__(self, size: int, concurrency: int):
+        self.size = max(1, size)
+        self._slots = asyncio.Semaphore(max(1, concurrency))
+        self._playwright = None
+        self._browsers: list[_PooledBrowser] = []
+        # 启动 / 重启浏览器时串行化，避免并发借用方同时补齐
+        self._launching = asyncio.Lock()
+        self._health_task: asyncio.Task | None = None
+        # 等待信号量的借用方数 / 持有信号量的借用方数
+        self.queued = 0
+        self.active = 0
+
+    async def start(self) -> None:
+        """预热浏览器并开始健康检查。浏览器未安装等失败不影响应用启动，首次借用时再试并把错误返回给借用方。"""
+        if self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop())
+        try:
+            await self._fill("startup")
+        except Exception as e:
+            logger.warning(f"预热 Chromium 失败: {e}")
+            return
+        logger.info(f"浏览器池已启动，{self.size} 个浏览器，并发上限 {config.PDF_CONCURRENCY}")
+
+    async def close(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        browsers, self._browsers = self._browsers, []
+        for pooled in browsers:
+            await self._close_browser(pooled)
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+
+    async def _launch(self, reason: str) -> _PooledBrowser:
+        if self._playwright is None:
+            from playwright.async_api import async_playwright
+
+            self._playwright = await async_playwright().start()
+        browser = await self._playwright.chromium.launch(headless=True)
+        BROWSER_LAUNCHES.inc(reason=reason)
+        logger.info(f"Chromium 已启动（{reason}）")
+        return _PooledBrowser(browser)
+
+    @staticmethod
+    async def _close_browser(pooled: _PooledBrowser) -> None:
+        try:
+            await pooled.browser.close()
+        except Exception as e:
+            logger.warning(f"关闭 Chromium 失败: {e}")
+
+    async def _fill(self, reason: str) -> None:
+        """移除已断开的浏览器，并补齐到 size 个可借出的浏览器。"""
+        async with self._launching:
+            crashed = [p for p in self._browsers if not p.browser.is_connected()]
+            for pooled in crashed:
+                logger.warning("Chromium 已断开，重新启动")
+                self._browsers.remove(pooled)
+            if crashed:
+                reason = "crash"
+            while sum(not p.retired for p in self._browsers) < self.size:
+                self._browsers.append(await self._launch(reason))
+
+    def _needs_fill(self) -> bool:
+        available = [p for p in self._browsers if not p.retired]
+        return len(available) < self.size or any(not p.browser.is_connected() for p in available)
+
+    async def _health_loop(self) -> None:
+        """空闲时定期检查连接，崩溃的浏览器在下一次借用之前重启。"""
+        while True:
+            await asyncio.sleep(config.PDF_BROWSER_HEALTH_INTERVAL)
+            if self._browsers and self._needs_fill():
+                try:
+                    # 发现断开的浏览器时 _fill 会改记为 crash
+                    await self._fill("recycle")
+                except Exception as e:
+                    logger.warning(f"重启 Chromium 失败: {e}")
+
+    async def _checkout(self) -> _PooledBrowser:
+        if self._needs_fill():
+            await self._fill("recycle" if self._browsers else "startup")
+        pooled = min((p for p in self._browsers if not p.retired), key=lambda p: p.leases)
+        pooled.leases += 1
+        pooled.renders += 1
+        if config.PDF_BROWSER_MAX_RENDERS and pooled.renders >= config.PDF_BROWSER_MAX_RENDERS:
+            pooled.retired = True
+        return pooled
+
+    async def _checkin(self, pooled: _PooledBrowser) -> None:
+        pooled.leases -= 1
+        if pooled.retired and pooled.leases == 0:
+            if pooled in self._browsers:
+                self._browsers.remove(pooled)
+            await self._close_browser(pooled)
+
+    @asynccontextmanager
+    async def browser(self):
+        """借用一个浏览器（占用一个并发名额），with 块结束时归还。借用方负责关闭自己创建的 context。"""
+        self.queued += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.queued -= 1
+        self.active += 1
+        try:
+            pooled = await self._checkout()
+            try:
+                yield pooled.browser
+            finally:
+                await self._checkin(pooled)
+        finally:
+            self.active -= 1
+            self._slots.release()
+
+
+_pool: BrowserPool | None = None
+
+
+def get_browser_pool() -> BrowserPool:
+    """进程内共享的浏览器池（惰性创建，应用启动时预热）。"""
+    global _pool
+    if _pool is None:
+        _pool = BrowserPool(config.PDF_BROWSERS, config.PDF_CONCURRENCY)
+    return _pool
+
+
+async def close_browser_pool() -> None:
+    global _pool
+    pool, _pool = _pool, None
+    if pool is not None:
+        await pool.close()
+
+
+REGISTRY.register(Gauge(
+    "beellix_pdf_queue_depth",
+    "PDF exports waiting for a free browser slot.",
+    collect=lambda: {(): _pool.queued if _pool else 0},
+))
+REGISTRY.register(Gauge(
+    "beellix_pdf_active",
+    "PDF exports currently rendering.",
+    collect=lambda: {(): _pool.active if _pool else 0},
+))
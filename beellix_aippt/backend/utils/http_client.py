@@ -0,0 +1,83 @@
+import logging
+from urllib.parse import urlsplit
+
+import httpx
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# 上游主机 → 共享的长连接客户端
+_clients: dict[str, httpx.AsyncClient] = {}
+# 调用方提供的任意 URL（如 PDF 导出的图片）共用的下载客户端，主机不可控，不按主机缓存
+_download_client: httpx.AsyncClient | None = None
+
+
+def _http2_supported() -> bool:
+    if not config.HTTP2_ENABLED:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        logger.warning("未安装 h2，HTTP/2 不可用，回退为 HTTP/1.1")
+        return False
+    return True
+
+
+def stage_timeout(read: float) -> httpx.Timeout:
+    """按操作类型构造分阶段超时：connect / write / pool 取全局配置，read 由调用方指定。"""
+    return httpx.Timeout(
+        connect=config.HTTP_CONNECT_TIMEOUT,
+        read=read,
+        write=config.HTTP_WRITE_TIMEOUT,
+        pool=config.HTTP_POOL_TIMEOUT,
+    )
+
+
+def _new_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        http2=_http2_supported(),
+        limits=httpx.Limits(
+            max_connections=config.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=config.HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=config.HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=stage_timeout(read=60),
+    )
+
+
+def get_http_client(url: str) -> httpx.AsyncClient:
+    """返回 url 所属上游主机的共享客户端，不存在时惰性创建。只用于已知的上游主机。"""
+    host = urlsplit(url).netloc
+    client = _clients.get(host)
+    if client is None or client.is_closed:
+        client = _new_client()
+        _clients[host] = client
+        logger.info(f"已创建上游连接池: {host}")
+    return client
+
+
+def get_download_client() -> httpx.AsyncClient:
+    """返回下载任意 URL 共用的客户端：连接总数受 HTTP_MAX_CONNECTIONS 限制，空闲连接按 keepalive 过期回收。"""
+    global _download_client
+    if _download_client is None or _download_client.is_closed:
+        _download_client = _new_client()
+    return _download_client
+
+
+def open_http_clients(urls: list[str]) -> None:
+    """应用启动时为已知上游预先创建客户端。"""
+    for url in urls:
+        get_http_client(url)
+
+
+async def close_http_clients() -> None:
+    """应用关闭时释放所有连接。"""
+    global _download_client
+    clients = list(_clients.values())
+    _clients.clear()
+    if _download_client is not None:
+        clients.append(_download_client)
+        _download_client = None
+    for client in clients:
+        await client.aclose()
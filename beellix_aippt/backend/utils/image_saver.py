@@ -1,45 +1,88 @@
+import asyncio
 import os
+import re
 import base64
-import httpx
+import hashlib
+import json
 import logging
+import sqlite3
+import threading
 from pathlib import Path
-from datetime import datetime
+
+import config
+from utils.http_client import get_http_client, stage_timeout
+from utils.metrics import time_stage
+from utils.tracing import span
 
 logger = logging.getLogger(__name__)
 
 # 图片保存目录
-IMAGES_DIR = Path("generated_images")
-IMAGES_DIR.mkdir(exist_ok=True)
+IMAGES_DIR = Path(config.IMAGES_DIR)
+IMAGES_DIR.mkdir(parents=True, exist_ok=True)
+
+# 内容寻址文件名：<sha256>.<ext>，内容不变则文件名不变，可长期强缓存
+_CONTENT_ADDRESSED_RE = re.compile(r"^[0-9a-f]{64}\.(png|jpg|webp|gif)$")
+
+
+def _detect_extension(data: bytes) -> str:
+    """根据文件头判断图片格式，未知格式按 png 处理。"""
+    if data.startswith(b"\xff\xd8\xff"):
+        return "jpg"
+    if data.startswith(b"RIFF") and data[8:12] == b"WEBP":
+        return "webp"
+    if data.startswith((b"GIF87a", b"GIF89a")):
+        return "gif"
+    return "png"
+
+
+def is_content_addressed(filename: str) -> bool:
+    return bool(_CONTENT_ADDRESSED_RE.match(filename))
+
+
+def _write_image(data: bytes, filename: str = None) -> Path:
+    """写入图片。未指定文件名时以内容哈希命名，已存在的相同内容直接复用。"""
+    if not filename:
+        filename = f"{hashlib.sha256(data).hexdigest()}.{_detect_extension(data)}"
+
+    filepath = IMAGES_DIR / filename
+    if filepath.exists() and is_content_addressed(filename):
+        logger.info(f"图片内容已存在，复用: {filepath}")
+        return filepath
+
+    # 先写临时文件再原子替换，避免并发请求读到半个文件
+    tmp_path = filepath.with_name(f".{filename}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, filepath)
+    logger.info(f"图片已保存到: {filepath}")
+    return filepath
 
 
 async def save_image_from_url(url: str, filename: str = None) -> str:
     """
     从 URL 下载图片并保存到本地，返回本地路径。
-    
+
+    所在任务被取消时下载随之中止并断开连接，下载完成前不会写入任何文件。
+
     Args:
         url: 图片的 URL 地址
-        filename: 可选的文件名，如果不提供则自动生成
-    
+        filename: 可选的文件名，如果不提供则以内容哈希命名
+
     Returns:
         本地图片路径（相对于项目根目录）
     """
-    if not filename:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-        filename = f"slide_{timestamp}.png"
-    
-    filepath = IMAGES_DIR / filename
-    
     try:
-        async with httpx.AsyncClient(timeout=60) as client:
-            response = await client.get(url)
+        with span("image_download") as current, time_stage("image_download"):
+            client = get_http_client(url)
+            response = await client.get(url, timeout=stage_timeout(60))
             response.raise_for_status()
-            
-            with open(filepath, "wb") as f:
-                f.write(response.content)
-            
-            logger.info(f"图片已保存到: {filepath}")
-            return str(filepath)
-    
+            content = response.content
+            current.set_attributes(host=response.url.host, bytes=len(content))
+        with span("image_save", bytes=len(content)) as current, time_stage("image_save"):
+            path = _write_image(content, filename)
+            current.set_attribute("file", path.name)
+            return str(path)
+
     except Exception as e:
         logger.error(f"保存图片失败: {e}")
         raise
@@ -48,34 +91,90 @@ async def save_image_from_url(url: str, filename: str = None) -> str:
 def save_image_from_base64(base64_data: str, filename: str = None) -> str:
     """
     从 base64 数据保存图片到本地，返回本地路径。
-    
+
     Args:
         base64_data: base64 编码的图片数据（可以包含 data:image/png;base64, 前缀）
-        filename: 可选的文件名，如果不提供则自动生成
-    
+        filename: 可选的文件名，如果不提供则以内容哈希命名
+
     Returns:
         本地图片路径（相对于项目根目录）
     """
-    if not filename:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-        filename = f"slide_{timestamp}.png"
-    
-    filepath = IMAGES_DIR / filename
-    
     try:
         # 移除 data:image/png;base64, 前缀（如果存在）
         if "base64," in base64_data:
             base64_data = base64_data.split("base64,")[1]
-        
+
         # 解码并保存
-        image_bytes = base64.b64decode(base64_data)
-        
-        with open(filepath, "wb") as f:
-            f.write(image_bytes)
-        
-        logger.info(f"图片已保存到: {filepath}")
-        return str(filepath)
-    
+        with span("image_save", **{"base64.chars": len(base64_data)}) as current, time_stage("image_save"):
+            image_bytes = base64.b64decode(base64_data)
+            path = _write_image(image_bytes, filename)
+            current.set_attributes(bytes=len(image_bytes), file=path.name)
+            return str(path)
+
     except Exception as e:
         logger.error(f"保存 base64 图片失败: {e}")
         raise
+
+
+async def save_image_bytes(data: bytes, filename: str = None) -> str:
+    """保存已在内存中的图片字节（如回放的录制图片），返回本地路径。"""
+    with span("image_save", bytes=len(data)) as current, time_stage("image_save"):
+        path = await asyncio.to_thread(_write_image, data, filename)
+        current.set_attribute("file", path.name)
+        return str(path)
+
+
+class ImageIndex:
+    """(provider, 增强后提示词, 负向提示词, 尺寸) → 内容寻址文件名 的索引。"""
+
+    def __init__(self, path: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS image_index (key TEXT PRIMARY KEY, filename TEXT NOT NULL)"
+        )
+        self._db.commit()
+
+    @staticmethod
+    def make_key(provider: str, prompt: str, negative_prompt: str, size: str) -> str:
+        raw = json.dumps([provider, prompt, negative_prompt, size], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _lookup(self, key: str) -> str | None:
+        with self._lock:
+            row = self._db.execute("SELECT filename FROM image_index WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        filepath = IMAGES_DIR / row[0]
+        return str(filepath) if filepath.exists() else None
+
+    def _record(self, key: str, local_path: str) -> None:
+        filename = Path(local_path).name
+        if not is_content_addressed(filename):
+            return
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO image_index (key, filename) VALUES (?, ?)", (key, filename)
+            )
+            self._db.commit()
+
+    # sqlite 查询与提交（含 fsync）在线程中执行，不阻塞事件循环
+
+    async def lookup(self, key: str) -> str | None:
+        """返回已生成图片的本地路径；文件已被清理时视为未命中。"""
+        return await asyncio.to_thread(self._lookup, key)
+
+    async def record(self, key: str, local_path: str) -> None:
+        await asyncio.to_thread(self._record, key, local_path)
+
+
+_index: ImageIndex | None = None
+
+
+def get_image_index() -> ImageIndex:
+    """进程内共享的图片索引（惰性创建）。"""
+    global _index
+    if _index is None:
+        _index = ImageIndex(config.IMAGE_INDEX_PATH)
+    return _index
@@ -0,0 +1,159 @@
+import json
+import re
+
+_THINK_OPEN = "<think>"
+_THINK_CLOSE = "</think>"
+
+
+class IncrementalJSONParser:
+    """增量解析 LLM 流式输出的顶层 JSON 对象。
+
+    每次 feed() 追加一段文本，返回本段新完成的事件：
+      - ("field", key, value)        顶层标量 / 非数组字段的值已完整
+      - ("item", key, index, value)  array_fields 中某个数组字段的第 index 个对象元素已闭合
+
+    与 extract_json 一致，会跳过 <think>...</think> 推理块与 markdown 围栏等前缀噪声，
+    从第一个 { 开始解析。
+    """
+
+    def __init__(self, array_fields: set[str] | frozenset[str] = frozenset()):
+        self.array_fields = set(array_fields)
+        self.done = False
+
+        self._buf = ""
+        self._pos = 0
+        self._started = False
+        self._stack: list[str] = []
+        self._in_string = False
+        self._escape = False
+
+        # 顶层对象的键值状态
+        self._expect_key = True
+        self._key_start = -1
+        self._key: str | None = None
+        self._value_start = -1
+
+        # 数组字段元素状态
+        self._item_start = -1
+        self._item_index = 0
+
+    def feed(self, chunk: str) -> list[tuple]:
+        self._buf += chunk
+        events: list[tuple] = []
+        if self.done:
+            return events
+
+        if not self._started and not self._find_start():
+            return events
+
+        buf = self._buf
+        while self._pos < len(buf):
+            i = self._pos
+            c = buf[i]
+            self._pos += 1
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    self._on_string_end(i, events)
+                continue
+
+            if c == '"':
+                self._in_string = True
+                if len(self._stack) == 1:
+                    if self._expect_key:
+                        self._key_start = i
+                    elif self._value_start == -1:
+                        self._value_start = i
+                continue
+
+            if c in "{[":
+                if len(self._stack) == 1 and not self._expect_key and self._value_start == -1:
+                    self._value_start = i
+                elif c == "{" and self._in_array_field():
+                    self._item_start = i
+                self._stack.append(c)
+                continue
+
+            if c in "}]":
+                if len(self._stack) == 1:
+                    # 顶层对象闭合：收尾最后一个标量值
+                    self._finish_scalar(i, events)
+                    self._stack.pop()
+                    self.done = True
+                    break
+                self._stack.pop()
+                if c == "}" and self._item_start != -1 and self._in_array_field():
+                    value = json.loads(buf[self._item_start:i + 1])
+                    events.append(("item", self._key, self._item_index, value))
+                    self._item_index += 1
+                    self._item_start = -1
+                elif len(self._stack) == 1:
+                    self._emit_field(buf[self._value_start:i + 1], events)
+                continue
+
+            if len(self._stack) != 1:
+                continue
+            if c == ":":
+                self._expect_key = False
+            elif c == ",":
+                self._finish_scalar(i, events)
+                self._expect_key = True
+            elif not c.isspace() and self._value_start == -1 and not self._expect_key:
+                # 数字 / true / false / null 的起始位置
+                self._value_start = i
+
+        return events
+
+    def _find_start(self) -> bool:
+        """定位顶层 { 的位置；<think> 块未闭合前不开始解析。"""
+        text = self._buf
+        offset = 0
+        think = text.find(_THINK_OPEN)
+        if think != -1:
+            close = text.find(_THINK_CLOSE, think)
+            if close == -1:
+                return False
+            offset = close + len(_THINK_CLOSE)
+        start = text.find("{", offset)
+        if start == -1:
+            return False
+        self._started = True
+        self._stack = ["{"]
+        self._pos = start + 1
+        return True
+
+    def _in_array_field(self) -> bool:
+        return (
+            len(self._stack) == 2
+            and self._stack[1] == "["
+            and self._key in self.array_fields
+        )
+
+    def _on_string_end(self, i: int, events: list[tuple]) -> None:
+        if len(self._stack) != 1:
+            return
+        if self._expect_key and self._key_start != -1:
+            self._key = json.loads(self._buf[self._key_start:i + 1])
+            self._key_start = -1
+            self._item_index = 0
+        elif self._value_start != -1:
+            self._emit_field(self._buf[self._value_start:i + 1], events)
+
+    def _finish_scalar(self, i: int, events: list[tuple]) -> None:
+        """在 , 或 } 处收尾尚未结束的数字 / 布尔 / null 值。"""
+        if self._value_start == -1:
+            return
+        raw = self._buf[self._value_start:i].strip()
+        if re.fullmatch(r"-?\d+(\.\d+)?([eE][+-]?\d+)?|true|false|null", raw):
+            self._emit_field(raw, events)
+        self._value_start = -1
+
+    def _emit_field(self, raw: str, events: list[tuple]) -> None:
+        if self._key is not None and self._key not in self.array_fields:
+            events.append(("field", self._key, json.loads(raw)))
+        self._value_start = -1
@@ -0,0 +1,213 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Iterable, TypeVar
+
+# 延迟分桶上界（秒），覆盖毫秒级的解析到分钟级的图片生成
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    """带标签的指标基类；更新可能来自 PDF 线程池，统一加锁。"""
+
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in items]
+
+
+class Gauge(_Metric):
+    """可直接设置 / 增减的仪表；传入 collect 时改为在抓取时调用 collect() 读取 {标签值元组: 数值}。"""
+
+    type = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...] = (),
+        collect: Callable[[], dict[tuple[str, ...], float]] | None = None,
+    ):
+        super().__init__(name, help, labelnames)
+        # 无标签的仪表从 0 开始暴露，抓取端不必处理缺失的序列
+        self._values: dict[tuple[str, ...], float] = {} if labelnames else {(): 0.0}
+        self.collect = collect
+
+    def set(self, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def samples(self) -> list[str]:
+        if self.collect is not None:
+            items = sorted(self.collect().items())
+        else:
+            with self._lock:
+                items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in items]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(
+        self, name: str, help: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS
+    ):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 标签值元组 → [各桶计数（非累积）..., +Inf 桶计数, 总和]
+        self._series: dict[tuple[str, ...], list[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0.0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        lines = []
+        for key, series in items:
+            cumulative = 0.0
+            for bound, count in zip((*self.buckets, math.inf), series):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {_format_value(cumulative)}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{labels} {_format_value(cumulative)}")
+        return lines
+
+
+M = TypeVar("M", bound=_Metric)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: M) -> M:
+        if metric.name in self._metrics:
+            raise ValueError(f"指标已注册: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Prometheus 文本格式（0.0.4）。"""
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+# 进程级指标注册表；多 worker 部署时每个 worker 各自统计
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "beellix_stage_duration_seconds",
+    "Duration of successful pipeline stage executions.",
+    ("stage", "provider", "model"),
+))
+STAGE_FAILURES = REGISTRY.register(Counter(
+    "beellix_stage_failures_total",
+    "Pipeline stage executions that raised an error.",
+    ("stage", "provider", "model"),
+))
+
+# 当前上游调用的 (provider, model)，供下载 / 保存图片等不直接知道供应商的环节打标签
+_labels: ContextVar[tuple[str, str]] = ContextVar("metric_labels", default=("", ""))
+
+
+@contextmanager
+def metric_labels(provider: str, model: str):
+    """在 with 块内通过 time_stage 记录的阶段默认带上 provider / model 标签。"""
+    token = _labels.set((provider, model))
+    try:
+        yield
+    finally:
+        _labels.reset(token)
+
+
+@contextmanager
+def time_stage(stage: str, provider: str | None = None, model: str | None = None):
+    """记录 with 块的耗时到 beellix_stage_duration_seconds，抛出异常时计入 beellix_stage_failures_total。
+
+    未指定 provider / model 时取 metric_labels 设置的值。取消（CancelledError 等）不计入任何一项。
+    """
+    default_provider, default_model = _labels.get()
+    labels = {
+        "stage": stage,
+        "provider": default_provider if provider is None else provider,
+        "model": default_model if model is None else model,
+    }
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_FAILURES.inc(**labels)
+        raise
+    STAGE_SECONDS.observe(time.perf_counter() - start, **labels)
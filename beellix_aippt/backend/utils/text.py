@@ -20,4 +20,122 @@ def extract_json(raw: str) -> str:
         if start != -1 and end != -1:
             text = text[start:end + 1]
 
-    return text
\ No newline at end of file
+    return text
+
+
+_JSON_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+# 字段名之后、值的引号之前允许出现的内容（尚未到达引号时继续等待）
+_KEY_TAIL = re.compile(r"\s*(?::\s*)?")
+# 字符串值中不需要转义处理的连续片段
+_PLAIN = re.compile(r'[^"\\]+')
+_HEX4 = re.compile(r"[0-9a-fA-F]{4}")
+
+
+def _hex4(text: str) -> int | None:
+    return int(text, 16) if _HEX4.fullmatch(text) else None
+
+
+class PartialStringField:
+    """增量取出流式 JSON 文本中某个字符串字段目前已到达的部分值。
+
+    每次 feed() 只扫描新到达的文本（以及上次停下的被截断的转义序列），单次开销与增量长度成正比。
+    遇到被截断的转义序列（含尚未到达低代理项的高代理项）时停在其之前，等待后续文本；
+    孤立的高 / 低代理项无法编码为 UTF-8，直接丢弃；非法的 \\u 转义之后的内容不再输出。
+    """
+
+    def __init__(self, field: str):
+        self._key = f'"{field}"'
+        self._pattern = re.compile(rf'{re.escape(self._key)}\s*:\s*"')
+        self._buf = ""
+        self._search_from = 0
+        # 值的扫描位置，-1 表示尚未找到字段
+        self._pos = -1
+        self._done = False
+        self._parts: list[str] = []
+        self._length = 0
+
+    def __len__(self) -> int:
+        return self._length
+
+    @property
+    def value(self) -> str:
+        if len(self._parts) > 1:
+            self._parts = ["".join(self._parts)]
+        return self._parts[0] if self._parts else ""
+
+    def feed(self, chunk: str) -> None:
+        self._buf += chunk
+        if self._done or (self._pos < 0 and not self._find_value()):
+            return
+
+        buf, i, n = self._buf, self._pos, len(self._buf)
+        out: list[str] = []
+        while i < n:
+            plain = _PLAIN.match(buf, i)
+            if plain:
+                out.append(plain.group())
+                i = plain.end()
+                continue
+            if buf[i] == '"':
+                self._done = True
+                break
+            if i + 1 >= n:
+                break
+            esc = buf[i + 1]
+            if esc != "u":
+                out.append(_JSON_ESCAPES.get(esc, esc))
+                i += 2
+                continue
+            if i + 6 > n:
+                break
+            code = _hex4(buf[i + 2:i + 6])
+            if code is None:
+                self._done = True
+                break
+            if 0xDC00 <= code < 0xE000:
+                # 孤立的低代理项
+                i += 6
+                continue
+            if 0xD800 <= code < 0xDC00:
+                # 高代理项必须与紧随其后的低代理项组合，否则无法编码为 UTF-8
+                tail = buf[i + 6:i + 12]
+                if len(tail) < 6 and "\\u".startswith(tail[:2]):
+                    break
+                low = _hex4(tail[2:]) if tail.startswith("\\u") else None
+                if low is None or not 0xDC00 <= low < 0xE000:
+                    i += 6
+                    continue
+                code = 0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)
+                i += 6
+            out.append(chr(code))
+            i += 6
+
+        self._pos = i
+        if out:
+            text = "".join(out)
+            self._parts.append(text)
+            self._length += len(text)
+
+    def _find_value(self) -> bool:
+        """定位字段值的起始引号。只向前推进搜索位置，保留可能被截断的字段名。"""
+        buf = self._buf
+        while True:
+            key = buf.find(self._key, self._search_from)
+            if key == -1:
+                self._search_from = max(self._search_from, len(buf) - len(self._key) + 1)
+                return False
+            match = self._pattern.match(buf, key)
+            if match:
+                self._pos = match.end()
+                return True
+            if _KEY_TAIL.fullmatch(buf, key + len(self._key)):
+                self._search_from = key
+                return False
+            self._search_from = key + 1
+
+
+def extract_partial_string_field(raw: str, field: str) -> str:
+    """从尚未输出完整的 JSON 文本中取出某个字符串字段目前已到达的部分值（一次性版本）。"""
+    partial = PartialStringField(field)
+    partial.feed(raw)
+    return partial.value
@@ -0,0 +1,290 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+import httpx
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    """一段计时的操作：属于某条 trace，可带父 span、属性与事件。结束时交给导出器。"""
+
+    def __init__(self, name: str, parent: "Span | None" = None, attributes: dict | None = None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else ""
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes: dict = dict(attributes or {})
+        self.events: list[tuple[int, str, dict]] = []
+        # "ok" / "error" / "cancelled"
+        self.status = "ok"
+        self.error = ""
+
+    def set_attribute(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    def set_attributes(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def increment(self, key: str, amount: int = 1) -> None:
+        self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def add_event(self, name: str, **attributes) -> None:
+        self.events.append((time.time_ns(), name, attributes))
+
+    def end(self, error: BaseException | None = None) -> None:
+        if self.end_ns:
+            return
+        self.end_ns = time.time_ns()
+        if isinstance(error, Exception):
+            self.status, self.error = "error", f"{type(error).__name__}: {error}"
+        elif error is not None:
+            self.status = "cancelled"
+        _export(self)
+
+    def to_dict(self) -> dict:
+        """本地 JSONL 记录。"""
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id or None,
+            "name": self.name,
+            "start": self.start_ns / 1e9,
+            "durationMs": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "status": self.status,
+            "error": self.error or None,
+            "attributes": self.attributes,
+            "events": [
+                {"name": name, "offsetMs": round((ts - self.start_ns) / 1e6, 3), "attributes": attrs}
+                for ts, name, attrs in self.events
+            ],
+        }
+
+    def to_otlp(self) -> dict:
+        """OTLP/HTTP JSON 编码的 span。"""
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": _otlp_attributes(self.attributes),
+            "events": [
+                {"timeUnixNano": str(ts), "name": name, "attributes": _otlp_attributes(attrs)}
+                for ts, name, attrs in self.events
+            ],
+            # 取消不算错误，与正常结束一样标为 UNSET
+            "status": {"code": 2, "message": self.error} if self.status == "error" else {},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: dict) -> list[dict]:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items()]
+
+
+# --- 导出 ---
+
+class SpanExporter:
+    """后台线程批量导出已结束的 span，调用方（事件循环或 PDF 线程池）只做入队。"""
+
+    def __init__(self):
+        self._queue: queue.SimpleQueue[Span | None] = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._loop, name=f"{type(self).__name__}", daemon=True)
+        self._thread.start()
+
+    def submit(self, span: Span) -> None:
+        self._queue.put(span)
+
+    def shutdown(self, timeout: float = 5) -> None:
+        """导出剩余 span 后停止后台线程。"""
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _loop(self) -> None:
+        stopping = False
+        while not stopping:
+            batch: list[Span] = []
+            try:
+                item = self._queue.get(timeout=config.TRACE_FLUSH_INTERVAL)
+            except queue.Empty:
+                continue
+            while True:
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+                if len(batch) >= config.TRACE_BATCH_SIZE:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                try:
+                    self.export(batch)
+                except Exception as e:
+                    logger.warning(f"{len(batch)} 个 span 导出失败: {e}")
+
+    def export(self, spans: list[Span]) -> None:
+        raise NotImplementedError
+
+
+class JsonlSpanExporter(SpanExporter):
+    """追加写入本地 JSONL 文件，每行一个 span。多 worker 可共用同一文件（每批一次追加写）。"""
+
+    def __init__(self, path: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        super().__init__()
+
+    def export(self, spans: list[Span]) -> None:
+        data = "".join(json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n" for span in spans)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(data)
+
+
+class OTLPSpanExporter(SpanExporter):
+    """以 OTLP/HTTP JSON 发送到兼容的收集器（OpenTelemetry Collector、Jaeger、Tempo 等）。"""
+
+    def __init__(self, endpoint: str, service_name: str):
+        self.endpoint = endpoint
+        self.resource = {"attributes": _otlp_attributes({"service.name": service_name, "process.pid": os.getpid()})}
+        self._client = httpx.Client(timeout=10)
+        super().__init__()
+
+    def export(self, spans: list[Span]) -> None:
+        payload = {"resourceSpans": [{
+            "resource": self.resource,
+            "scopeSpans": [{"scope": {"name": "beellix"}, "spans": [span.to_otlp() for span in spans]}],
+        }]}
+        response = self._client.post(self.endpoint, json=payload)
+        response.raise_for_status()
+
+
+_exporter: SpanExporter | None = None
+# span 也可能在 PDF 线程池中结束，惰性创建导出器时加锁
+_exporter_lock = threading.Lock()
+
+
+def _get_exporter() -> SpanExporter | None:
+    global _exporter
+    with _exporter_lock:
+        if _exporter is None:
+            if config.TRACE_EXPORTER == "jsonl":
+                _exporter = JsonlSpanExporter(config.TRACE_JSONL_PATH)
+            elif config.TRACE_EXPORTER == "otlp":
+                _exporter = OTLPSpanExporter(config.TRACE_OTLP_ENDPOINT, config.TRACE_SERVICE_NAME)
+        return _exporter
+
+
+def _export(span: Span) -> None:
+    exporter = _get_exporter()
+    if exporter is not None:
+        exporter.submit(span)
+
+
+def shutdown_tracing() -> None:
+    """进程退出前导出剩余 span（阻塞至多数秒，异步代码中请放到线程里调用）。"""
+    global _exporter
+    with _exporter_lock:
+        exporter, _exporter = _exporter, None
+    if exporter is not None:
+        exporter.shutdown()
+
+
+def tracing_enabled() -> bool:
+    return config.TRACE_EXPORTER in ("jsonl", "otlp")
+
+
+# --- 上下文 ---
+
+_current: ContextVar[Span | None] = ContextVar("trace_span", default=None)
+
+
+class _NoopSpan(Span):
+    """追踪关闭时使用的空 span，所有操作都被忽略。"""
+
+    def __init__(self):
+        pass
+
+    def set_attribute(self, key: str, value) -> None:
+        pass
+
+    def set_attributes(self, **attributes) -> None:
+        pass
+
+    def increment(self, key: str, amount: int = 1) -> None:
+        pass
+
+    def add_event(self, name: str, **attributes) -> None:
+        pass
+
+    def end(self, error: BaseException | None = None) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def current_span() -> Span:
+    """当前上下文中的 span，没有时返回空 span，调用方可直接设置属性而不必判断。"""
+    return _current.get() or NOOP_SPAN
+
+
+def start_span(name: str, parent: Span | None = None, **attributes) -> Span:
+    """创建 span 但不设为当前 span，调用方负责 end()。用于跨越异步生成器 yield 的操作。
+
+    未指定 parent 时以当前 span 为父 span；没有当前 span 时开始一条新的 trace。
+    """
+    if not tracing_enabled():
+        return NOOP_SPAN
+    if parent is None or parent is NOOP_SPAN:
+        parent = _current.get()
+    return Span(name, parent, attributes)
+
+
+@contextmanager
+def span(name: str, parent: Span | None = None, **attributes):
+    """在 with 块内以新 span 为当前 span，异常时标记 error，取消时标记 cancelled。
+
+    属性名中的点号写法（如 prompt.chars）可用 **{"prompt.chars": n} 传入。
+    与 llm_stage 一样，不要让 with 块跨越异步生成器的 yield。
+    """
+    current = start_span(name, parent, **attributes)
+    if current is NOOP_SPAN:
+        yield current
+        return
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.end(e)
+        raise
+    finally:
+        _current.reset(token)
+        current.end()
@@ -9,9 +9,11 @@ import {
   ChevronLeft,
   ChevronRight,
   Save,
-  AlertCircle
+  AlertCircle,
+  RefreshCw,
+  ImageIcon
 } from 'lucide-react';
-import { useWebSocket } from './hooks/useWebSocket';
+import { useWebSocket, type RegenerateMode } from './hooks/useWebSocket';
 import { slideCache } from './utils/slideCache';
 
 // --- 聊天消息类型 ---
@@ -45,7 +47,7 @@ function App() {
   const thumbnailContainerRef = useRef<HTMLDivElement>(null);
   const [previewScale, setPreviewScale] = useState(1);
 
-  const { state, startGeneration, cancelGeneration } = useWebSocket();
+  const { state, startGeneration, cancelGeneration, regenerateSlide } = useWebSocket();
 
   // 主预览区 ResizeObserver — 计算适配容器的缩放比
   useEffect(() => {
@@ -281,6 +283,14 @@ function App() {
   // 当前预览的幻灯片
   const previewSlide = state.slides[currentSlideIndex];
 
+  // 只重新生成当前预览的一页
+  const isRegenerating = !!previewSlide && state.regeneratingSlides.includes(previewSlide.index);
+  const handleRegenerate = useCallback((mode: RegenerateMode) => {
+    if (!previewSlide) return;
+    slideCache.delete(`slide-${previewSlide.index}`);
+    regenerateSlide(previewSlide.index, mode);
+  }, [previewSlide, regenerateSlide]);
+
   // 自动截图缓存当前幻灯片
   useEffect(() => {
     if (!previewSlide || !mainSlideRef.current) return;
@@ -498,6 +508,17 @@ function App() {
       <div className="flex-1 bg-gray-50 flex flex-col h-full overflow-hidden relative">
         {state.slides.length === 0 ? (
           <div className="flex-1 flex flex-col items-center justify-center text-gray-400">
+            {/* 首页设计流式到达时，先展示部分 HTML */}
+            {isGenerating && Object.keys(state.partialSlides).length > 0 && (
+              <div className="aspect-video w-[640px] bg-gray-900 rounded-xl shadow-2xl overflow-hidden relative mb-6">
+                <div
+                  style={{ width: 1280, height: 720, transform: 'scale(0.5)', transformOrigin: 'top left' }}
+                  dangerouslySetInnerHTML={{
+                    __html: state.partialSlides[Math.min(...Object.keys(state.partialSlides).map(Number))],
+                  }}
+                />
+              </div>
+            )}
             <div className="w-20 h-20 bg-white rounded-3xl shadow-sm border border-gray-100 flex items-center justify-center mb-6">
               {isGenerating ? (
                 <Loader2 className="w-10 h-10 text-blue-500 animate-spin" />
@@ -529,6 +550,24 @@ function App() {
           </div>
 
           <div className="flex items-center gap-3">
+            <button
+              onClick={() => handleRegenerate('design')}
+              disabled={isGenerating || !previewSlide || isRegenerating}
+              title="重新设计当前页并生成配图"
+              className="flex items-center gap-2 px-3 py-2 bg-white border border-gray-200 hover:bg-gray-50 text-gray-700 rounded-lg text-sm font-medium transition-colors shadow-sm disabled:opacity-50 disabled:cursor-not-allowed"
+            >
+              <RefreshCw className={`w-4 h-4 ${isRegenerating ? 'animate-spin' : ''}`} />
+              <span>{isRegenerating ? '正在重新生成...' : '重新生成本页'}</span>
+            </button>
+            <button
+              onClick={() => handleRegenerate('image')}
+              disabled={isGenerating || !previewSlide || isRegenerating}
+              title="保留当前页设计，只重新生成配图"
+              className="flex items-center gap-2 px-3 py-2 bg-white border border-gray-200 hover:bg-gray-50 text-gray-700 rounded-lg text-sm font-medium transition-colors shadow-sm disabled:opacity-50 disabled:cursor-not-allowed"
+            >
+              <ImageIcon className="w-4 h-4" />
+              <span>换配图</span>
+            </button>
             <button
               onClick={handleExportPdf}
               disabled={isGenerating || !!exportProgress}
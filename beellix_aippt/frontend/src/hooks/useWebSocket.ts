@@ -1,4 +1,4 @@
-import { useRef, useState, useCallback } from 'react';
+import { useRef, useState, useCallback, useEffect } from 'react';
 
 // --- 类型定义 ---
 
@@ -53,126 +53,218 @@ export interface GenerationState {
   statusMessage: string;
   outline: OutlineData | null;
   slides: FinalSlide[];
+  // 设计中页面的部分 HTML（slide_partial 流式推送），页码 → HTML
+  partialSlides: Record<number, string>;
   currentSlideIndex: number;
   totalSlides: number;
   error: string;
+  // 正在重新生成的页码
+  regeneratingSlides: number[];
 }
 
+// 单页重新生成：design 重新设计并配图，image 只重新配图
+export type RegenerateMode = 'design' | 'image';
+
 // --- Hook ---
 
+// 当前生成任务 id，刷新页面后据此重新连接
+const JOB_STORAGE_KEY = 'beellix.jobId';
+// 连接意外断开后重连的间隔（毫秒）
+const RECONNECT_DELAY = 1000;
+
+const initialState: GenerationState = {
+  phase: 'idle',
+  statusMessage: '',
+  outline: null,
+  slides: [],
+  partialSlides: {},
+  currentSlideIndex: -1,
+  totalSlides: 0,
+  error: '',
+  regeneratingSlides: [],
+};
+
 export function useWebSocket() {
   const wsRef = useRef<WebSocket | null>(null);
-  const [state, setState] = useState<GenerationState>({
-    phase: 'idle',
-    statusMessage: '',
-    outline: null,
-    slides: [],
-    currentSlideIndex: -1,
-    totalSlides: 0,
-    error: '',
+  // 正在跟踪的任务与已收到的最后一个事件序号，用于断线后从断点回放
+  const jobIdRef = useRef<string | null>(null);
+  const lastSeqRef = useRef(-1);
+  // 当前演示文稿所属的任务与生成时使用的供应商 / Key，任务结束后仍保留，供单页重新生成使用
+  const deckRef = useRef<{ jobId: string | null; provider: string; apiKey: string }>({
+    jobId: null, provider: '', apiKey: '',
   });
+  const [state, setState] = useState<GenerationState>(initialState);
 
   const resetState = useCallback(() => {
-    setState({
-      phase: 'idle',
-      statusMessage: '',
-      outline: null,
-      slides: [],
-      currentSlideIndex: -1,
-      totalSlides: 0,
-      error: '',
-    });
+    setState(initialState);
   }, []);
 
-  const startGeneration = useCallback((topic: string, provider: string, apiKey: string = '') => {
-    // 关闭已有连接
-    if (wsRef.current) {
-      wsRef.current.close();
+  const finishJob = useCallback(() => {
+    jobIdRef.current = null;
+    sessionStorage.removeItem(JOB_STORAGE_KEY);
+  }, []);
+
+  const handleMessage = useCallback((e: MessageEvent) => {
+    const msg = JSON.parse(e.data);
+    const { event, data, seq } = msg;
+    if (typeof seq === 'number') {
+      // 回放与实时推送可能重叠，跳过已处理过的事件
+      if (seq <= lastSeqRef.current) return;
+      lastSeqRef.current = seq;
     }
 
-    setState(prev => ({
-      ...prev,
-      phase: 'connecting',
-      statusMessage: '正在连接服务器...',
-      outline: null,
-      slides: [],
-      currentSlideIndex: -1,
-      totalSlides: 0,
-      error: '',
-    }));
+    switch (event) {
+      case 'job':
+        jobIdRef.current = data.jobId;
+        deckRef.current.jobId = data.jobId;
+        sessionStorage.setItem(JOB_STORAGE_KEY, data.jobId);
+        break;
 
-    const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-    const ws = new WebSocket(`${protocol}//${window.location.host}/ws/generate`);
-    wsRef.current = ws;
+      case 'status':
+        setState(prev => ({
+          ...prev,
+          phase: data.status === 'resuming' ? 'designing' : data.status as GenerationPhase,
+          statusMessage: data.message,
+          currentSlideIndex: data.slideIndex ?? prev.currentSlideIndex,
+          totalSlides: data.totalSlides ?? prev.totalSlides,
+        }));
+        break;
 
-    ws.onopen = () => {
-      ws.send(JSON.stringify({ action: 'generate', topic, provider, apiKey }));
-      setState(prev => ({ ...prev, phase: 'planning', statusMessage: '正在规划幻灯片大纲...' }));
-    };
+      case 'outline':
+        setState(prev => ({
+          ...prev,
+          outline: data as OutlineData,
+          totalSlides: data.slides.length,
+          statusMessage: `大纲已生成，共 ${data.slides.length} 页`,
+        }));
+        break;
 
-    ws.onmessage = (e) => {
-      const msg = JSON.parse(e.data);
-      const { event, data } = msg;
+      case 'slide_partial':
+        setState(prev => ({
+          ...prev,
+          partialSlides: { ...prev.partialSlides, [data.slideIndex]: data.htmlContent },
+        }));
+        break;
 
-      switch (event) {
-        case 'status':
-          setState(prev => ({
-            ...prev,
-            phase: data.status as GenerationPhase,
-            statusMessage: data.message,
-            currentSlideIndex: data.slideIndex ?? prev.currentSlideIndex,
-            totalSlides: data.totalSlides ?? prev.totalSlides,
-          }));
-          break;
+      case 'slide':
+        setState(prev => ({
+          ...prev,
+          partialSlides: Object.fromEntries(
+            Object.entries(prev.partialSlides).filter(([idx]) => Number(idx) !== data.index),
+          ),
+          // 并发生成时 slide 事件可能乱序到达，按页码插入
+          slides: [...prev.slides.filter(s => s.index !== data.index), data as FinalSlide]
+            .sort((a, b) => a.index - b.index),
+          regeneratingSlides: prev.regeneratingSlides.filter(i => i !== data.index),
+        }));
+        break;
 
-        case 'outline':
-          setState(prev => ({
-            ...prev,
-            outline: data as OutlineData,
-            totalSlides: data.slides.length,
-            statusMessage: `大纲已生成，共 ${data.slides.length} 页`,
-          }));
-          break;
+      case 'done':
+        finishJob();
+        setState(prev => ({
+          ...prev,
+          phase: 'done',
+          statusMessage: `全部完成！共 ${data.totalSlides} 页`,
+        }));
+        break;
 
-        case 'slide':
+      case 'error':
+        // 重新生成失败不影响已生成的演示文稿
+        if (data.regenerate) {
           setState(prev => ({
             ...prev,
-            slides: [...prev.slides, data as FinalSlide],
+            statusMessage: data.message,
+            regeneratingSlides: prev.regeneratingSlides.filter(i => i !== data.slideIndex),
           }));
           break;
+        }
+        // 单页失败带 slideIndex，其余错误意味着任务结束
+        if (data.slideIndex === undefined) finishJob();
+        setState(prev => ({
+          ...prev,
+          phase: 'error',
+          error: data.message,
+          statusMessage: data.message,
+        }));
+        break;
+    }
+  }, [finishJob]);
 
-        case 'done':
-          setState(prev => ({
-            ...prev,
-            phase: 'done',
-            statusMessage: `全部完成！共 ${data.totalSlides} 页`,
-          }));
-          break;
+  const connect = useCallback((firstMessage: () => object) => {
+    // 关闭已有连接
+    if (wsRef.current) {
+      wsRef.current.onclose = null;
+      wsRef.current.close();
+    }
 
-        case 'error':
-          setState(prev => ({
-            ...prev,
-            phase: 'error',
-            error: data.message,
-            statusMessage: data.message,
-          }));
-          break;
-      }
+    const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+    const ws = new WebSocket(`${protocol}//${window.location.host}/ws/generate`);
+    wsRef.current = ws;
+
+    ws.onopen = () => {
+      ws.send(JSON.stringify(firstMessage()));
     };
 
+    ws.onmessage = handleMessage;
+
     ws.onerror = () => {
-      setState(prev => ({
+      // 已有任务时由 onclose 重连，任务仍在服务端继续生成
+      setState(prev => jobIdRef.current ? {
+        ...prev,
+        statusMessage: '与服务器的连接中断，正在重连...',
+      } : {
         ...prev,
         phase: 'error',
         error: '与服务器的连接出错',
         statusMessage: '连接出错',
-      }));
+      });
     };
 
     ws.onclose = () => {
       wsRef.current = null;
+      // 任务未结束时自动重连，从最后收到的事件之后继续回放
+      if (jobIdRef.current) {
+        setTimeout(() => {
+          if (jobIdRef.current && !wsRef.current) {
+            const jobId = jobIdRef.current;
+            connect(() => ({ action: 'attach', jobId, offset: lastSeqRef.current + 1 }));
+          }
+        }, RECONNECT_DELAY);
+      }
     };
-  }, []);
+  }, [handleMessage]);
+
+  const startGeneration = useCallback((topic: string, provider: string, apiKey: string = '') => {
+    jobIdRef.current = null;
+    lastSeqRef.current = -1;
+    deckRef.current = { jobId: null, provider, apiKey };
+
+    setState({
+      ...initialState,
+      phase: 'planning',
+      statusMessage: '正在规划幻灯片大纲...',
+    });
+
+    connect(() => ({ action: 'generate', topic, provider, apiKey }));
+  }, [connect]);
+
+  const attachJob = useCallback((jobId: string) => {
+    jobIdRef.current = jobId;
+    lastSeqRef.current = -1;
+    deckRef.current = { jobId, provider: '', apiKey: '' };
+    setState({
+      ...initialState,
+      phase: 'connecting',
+      statusMessage: '正在恢复生成任务...',
+    });
+    connect(() => ({ action: 'attach', jobId, offset: lastSeqRef.current + 1 }));
+  }, [connect]);
+
+  // 刷新页面后重新连接未完成的任务
+  useEffect(() => {
+    const jobId = sessionStorage.getItem(JOB_STORAGE_KEY);
+    if (jobId) attachJob(jobId);
+  }, [attachJob]);
 
   const cancelGeneration = useCallback(() => {
     if (wsRef.current && wsRef.current.readyState === WebSocket.OPEN) {
@@ -180,7 +272,37 @@ export function useWebSocket() {
     }
   }, []);
 
-  return { state, startGeneration, cancelGeneration, resetState };
+  // 只重新生成一页：优先按任务 id 重新生成（结果写入任务日志，重连回放得到新页面），
+  // 同时携带大纲与该页现有设计，任务已过期时服务端据此重新生成；供应商与 Key 与生成时一致
+  const regenerateSlide = useCallback((index: number, mode: RegenerateMode = 'design', imagePrompt: string = '') => {
+    const slide = state.slides.find(s => s.index === index);
+    if (!state.outline || !slide || state.regeneratingSlides.includes(index)) return;
+
+    const { jobId, provider, apiKey } = deckRef.current;
+    const message = {
+      action: 'regenerate_slide',
+      index,
+      mode,
+      imagePrompt,
+      provider,
+      apiKey,
+      ...(jobId ? { jobId } : {}),
+      outline: state.outline,
+      design: slide.design,
+    };
+    setState(prev => ({
+      ...prev,
+      regeneratingSlides: [...prev.regeneratingSlides, index],
+      statusMessage: `正在重新生成第 ${index + 1} 页...`,
+    }));
+    if (wsRef.current && wsRef.current.readyState === WebSocket.OPEN) {
+      wsRef.current.send(JSON.stringify(message));
+    } else {
+      connect(() => message);
+    }
+  }, [state.outline, state.slides, state.regeneratingSlides, connect]);
+
+  return { state, startGeneration, attachJob, cancelGeneration, regenerateSlide, resetState };
 }
 
 export type UseWebSocketReturn = ReturnType<typeof useWebSocket>;
@@ -36,6 +36,13 @@ class SlideCache {
     return this.cache.get(slideId);
   }
 
+  /**
+   * 移除单页截图（该页重新生成后）
+   */
+  delete(slideId: string): void {
+    this.cache.delete(slideId);
+  }
+
   /**
    * 清除所有缓存
    */